@@ -4,12 +4,30 @@ import os
 import subprocess
 import sys
 
-from .app import app
-from .create_vectorstore import create_vectorstore
-from .download_dataset import download_dataset
-from .eval import eval
+from dotenv import load_dotenv
+
+# The modules of the commands (and their dependencies: LangChain, Chroma, the Google SDK...)
+# are imported when the command is dispatched, so `--help` and the light commands start fast.
+from .settings import (
+    EVAL_CONCURRENCY,
+    EVAL_QUESTIONS_PATH,
+    GENERATORS,
+    JUDGES,
+    NUMPY_DTYPES,
+    QUANTIZATIONS,
+    SERVER_HOST,
+    SERVER_PORT,
+    SHARDING,
+    SHARDINGS,
+    SNAPSHOT_PATH,
+    VECTOR_BACKEND,
+    VECTOR_BACKENDS,
+)
+from .tracing import TRACING_ENV, JsonFormatter, enable_tracing
 
 DATASET_FOLDER = "pokemon_dataset"
+# Benchmarks indexing the dataset with a local embedding model
+DATASET_BENCHMARKS = {"retrieval", "context", "backends", "quantization", "snapshot"}
 VECTORSTORE_FILE = "chroma_db"
 logging.basicConfig(
     level=logging.INFO,
@@ -32,6 +50,8 @@ def ensure_dataset():
             .lower()
         )
         if response in ("y", ""):
+            from .download_dataset import download_dataset
+
             logger.info("Downloading default dataset...")
             download_dataset()
         else:
@@ -41,6 +61,47 @@ def ensure_dataset():
             sys.exit(1)
 
 
+def build_vectorstore(args: argparse.Namespace):
+    """Create or update the vector store with the options of the command line."""
+    from .create_vectorstore import create_vectorstore
+
+    create_vectorstore(
+        workers=args.workers,
+        backend=args.backend,
+        vector_dtype=args.vector_dtype,
+        quantization=args.quantization,
+        sharding=args.sharding,
+    )
+
+
+def ensure_vectorstore(args: argparse.Namespace):
+    """Ensures the vector store exists: imports the snapshot of the store if there is one,
+    otherwise creates the store from the dataset.
+    """
+    if os.path.exists(VECTORSTORE_FILE):
+        return
+    if os.path.exists(SNAPSHOT_PATH):
+        from .snapshot import import_snapshot
+
+        logger.info(f"There is no vector store at '{VECTORSTORE_FILE}'.\nImporting the snapshot '{SNAPSHOT_PATH}'...")
+        import_snapshot(SNAPSHOT_PATH, VECTORSTORE_FILE)
+        return
+    logger.info(
+        f"There is no vector store at '{VECTORSTORE_FILE}'.\nAttempting to create the vector store...",
+    )
+    ensure_dataset()
+    build_vectorstore(args)
+
+
+def export_vectorstore(path: str):
+    """Write the vector store to a single snapshot file, with the backend it was built with."""
+    from .manifest import load_manifest
+    from .snapshot import export_snapshot
+
+    manifest = load_manifest(VECTORSTORE_FILE) or {}
+    export_snapshot(VECTORSTORE_FILE, path, manifest.get("backend", VECTOR_BACKEND))
+
+
 if __name__ == "__main__":
     """
     Parses command-line arguments and calls the appropriate functions.
@@ -58,11 +119,59 @@ if __name__ == "__main__":
         const=True,
         help="Download a specific pokemon generation. If no name is provided, the gen 1 will be downloaded.\nExample: python -m RAG --download-dataset 1",
     )
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="With --download-dataset, check the pages already downloaded for updates instead of skipping them.",
+    )
     parser.add_argument(
         "--create-vectorstore",
         action="store_true",
         help="Create the vector store from the available dataset.",
     )
+    parser.add_argument(
+        "--workers",
+        metavar="N",
+        type=int,
+        default=1,
+        help="Number of processes parsing the dataset when creating the vector store.\nExample: python -m RAG --create-vectorstore --workers 4",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=VECTOR_BACKENDS,
+        default=VECTOR_BACKEND,
+        help=f"Vector index of the store created with --create-vectorstore: a Chroma collection,\nor a memory-mapped NumPy matrix with exact search (default: {VECTOR_BACKEND}).\nThe application then uses the backend the store was built with.\nExample: python -m RAG --create-vectorstore --backend numpy",
+    )
+    parser.add_argument(
+        "--vector-dtype",
+        choices=NUMPY_DTYPES,
+        default="float32",
+        help="Type of the vectors stored by the NumPy backend (default: float32).",
+    )
+    parser.add_argument(
+        "--quantization",
+        choices=QUANTIZATIONS,
+        default="none",
+        help="With --backend numpy, also store int8 or product quantized codes of the vectors:\nthe search scans the codes, then re-ranks the best candidates with the exact vectors.\nExample: python -m RAG --create-vectorstore --backend numpy --quantization int8",
+    )
+    parser.add_argument(
+        "--sharding",
+        choices=SHARDINGS,
+        default=SHARDING,
+        help=f"Layout of the store created with --create-vectorstore: one index, or one index per\ngeneration, searched only for the generations or the Pokémon named in the question\n(default: {SHARDING}). Changing it rebuilds the index of an existing store.\nExample: python -m RAG --create-vectorstore --sharding generation",
+    )
+    parser.add_argument(
+        "--export-snapshot",
+        metavar="PATH",
+        nargs="?",
+        const=SNAPSHOT_PATH,
+        help=f"Write the vector store to a single versioned and checksummed file, read in place by\nthe application (default: {SNAPSHOT_PATH}).\nExample: python -m RAG --export-snapshot",
+    )
+    parser.add_argument(
+        "--import-snapshot",
+        metavar="PATH",
+        help=f"Unpack a snapshot written by --export-snapshot to the vector store, replacing it.\nExample: python -m RAG --import-snapshot {SNAPSHOT_PATH}",
+    )
     parser.add_argument(
         "--app",
         action="store_true",
@@ -73,13 +182,84 @@ if __name__ == "__main__":
         action="store_true",
         help="Run the evaluation on the RAG application.",
     )
+    parser.add_argument(
+        "--questions",
+        metavar="PATH",
+        default=EVAL_QUESTIONS_PATH,
+        help="JSON file of the evaluation set, a list of {\"question\": ..., \"reference\": ...}.",
+    )
+    parser.add_argument(
+        "--judge",
+        choices=JUDGES,
+        default="gemini",
+        help="Judge of the evaluation: Gemini with the Ragas metrics, or a local stub scoring\nlexical overlap, for offline runs.\nExample: python -m RAG --eval --judge stub",
+    )
+    parser.add_argument(
+        "--generator",
+        choices=GENERATORS,
+        default="gemini",
+        help="Model answering the evaluation questions: Gemini, or a local stub answering with the\nretrieved context, for offline runs.\nExample: python -m RAG --eval --generator stub --judge stub",
+    )
+    parser.add_argument(
+        "--concurrency",
+        metavar="N",
+        type=int,
+        default=EVAL_CONCURRENCY,
+        help=f"Number of evaluation questions answered at the same time (default: {EVAL_CONCURRENCY}).",
+    )
     parser.add_argument(
         "--app_streamlit",
         action="store_true",
         help="Launch the RAG application on Streamlit.",
     )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="Serve the RAG application as an HTTP API (POST /ask, POST /retrieve, GET /health).\nExample: python -m RAG --serve --port 8000",
+    )
+    parser.add_argument(
+        "--host",
+        default=SERVER_HOST,
+        help=f"Address the HTTP API listens on with --serve (default: {SERVER_HOST}).",
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=SERVER_PORT,
+        help=f"Port the HTTP API listens on with --serve (default: {SERVER_PORT}).",
+    )
+    parser.add_argument(
+        "--trace",
+        action="store_true",
+        help="Trace every question (time of each stage, tokens, retrieved documents, cache hits):\none log line per question, and the metrics on GET /metrics with --serve.\nAlso enabled by the RAG_TRACING=1 environment variable.\nExample: python -m RAG --serve --trace --log-format json",
+    )
+    parser.add_argument(
+        "--log-format",
+        choices=("text", "json"),
+        default="text",
+        help="Format of the logs: text, or one JSON object per line with the traces as structured data.",
+    )
+    parser.add_argument(
+        "--bench",
+        metavar="NAME",
+        help="Run a micro-benchmark with a local fake embedding model (retriever, extraction, serve,\nbackends, quantization, startup...).\nExample: python -m RAG --bench retriever",
+    )
+    parser.add_argument(
+        "--bench-retrieval",
+        action="store_true",
+        help="Same as --bench retrieval: benchmark the retrieval alone on the labelled queries of\nRAG/retrieval_queries.json (recall@k, MRR and p50/p95/p99 latency per stage, as JSON).\nExample: python -m RAG --bench-retrieval --output retrieval.json",
+    )
+    parser.add_argument(
+        "--output",
+        metavar="PATH",
+        help="With --bench retrieval (or --bench-retrieval), also write the JSON results to this file.\nExample: python -m RAG --bench retrieval --output retrieval.json",
+    )
 
     args = parser.parse_args()
+    if args.bench_retrieval:
+        if args.bench not in (None, "retrieval"):
+            parser.error("--bench-retrieval cannot be combined with --bench.")
+        args.bench = "retrieval"
     if len(sys.argv) == 1:
         parser.print_help()
         response = (
@@ -96,33 +276,60 @@ if __name__ == "__main__":
             logger.info("No action selected. Exiting gracefully.")
             sys.exit(0)  # Exit cleanly if user declines or gives invalid input
 
+    if args.log_format == "json":
+        for handler in logging.getLogger().handlers:
+            handler.setFormatter(JsonFormatter())
+    if args.trace:
+        os.environ[TRACING_ENV] = "1"  # also for the Streamlit process
+        enable_tracing()
+    load_dotenv()  # GOOGLE_API_KEY
     if args.download_dataset is not None:
+        from .download_dataset import download_dataset
+
         if args.download_dataset is True: 
-            download_dataset()  
+            download_dataset(refresh=args.refresh)  
         else:
-            download_dataset(args.download_dataset)  
+            download_dataset(args.download_dataset, refresh=args.refresh)  
     elif args.create_vectorstore:
         # Ensure dataset is ready before creating vector store
         ensure_dataset()
-        create_vectorstore()
+        build_vectorstore(args)
+    elif args.export_snapshot:
+        export_vectorstore(args.export_snapshot)
+    elif args.import_snapshot:
+        from .snapshot import import_snapshot
+
+        import_snapshot(args.import_snapshot, VECTORSTORE_FILE)
     elif args.app:
         # Check if vector store exists before launching app
-        if not os.path.exists(VECTORSTORE_FILE):
-            logger.info(
-                f"There is no vector store at '{VECTORSTORE_FILE}'.\nAttempting to create the vector store...",
-            )
-            ensure_dataset()
-            create_vectorstore()
+        ensure_vectorstore(args)
+        from .app import app, init
+
+        init()
         app()
     elif args.eval:
-        if not os.path.exists(VECTORSTORE_FILE):
-            logger.info(
-                f"There is no vector store at '{VECTORSTORE_FILE}'.\nAttempting to create the vector store...",
-            )
-            ensure_dataset()
-            create_vectorstore()
-        eval()
+        ensure_vectorstore(args)
+        from .app import init
+        from .eval import eval
+
+        init()
+        eval(args.questions, judge=args.judge, concurrency=args.concurrency, generator=args.generator)
     elif args.app_streamlit:
         subprocess.run(
             ["streamlit", "run", os.path.join("RAG", "app_streamlit.py")], check=False
         )
+    elif args.serve:
+        ensure_vectorstore(args)
+        from .app import init
+        from .server import serve
+
+        init()
+        serve(args.host, args.port)
+    elif args.bench:
+        if args.output and args.bench != "retrieval":
+            parser.error("--output is only supported by --bench retrieval.")
+        from .bench import run_benchmark
+
+        if args.bench in DATASET_BENCHMARKS:
+            ensure_dataset()
+        run_benchmark(args.bench, **({"output": args.output} if args.output else {}))
@@ -1,50 +1,138 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import threading
+import time
+from collections import Counter
+from collections.abc import AsyncIterator, Awaitable, Callable, Iterator
+from typing import Any
+from uuid import UUID
+
 from dotenv import load_dotenv
 from langchain.docstore.document import Document
 from langchain.schema import StrOutputParser
-from langchain_chroma import Chroma
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.language_models import BaseLanguageModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import LLMResult
 from langchain_core.prompts import PromptTemplate
 from langchain_core.runnables import (
+    Runnable,
     RunnableLambda,
     RunnableParallel,
     RunnablePassthrough,
 )
-from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
-from langchain.globals import set_llm_cache
-from langchain_community.cache import InMemoryCache
 
+from .context import ContextCompressor, get_context_compressor
+from .retriever import PokemonRetriever, estimate_tokens, get_retriever
+from .semantic_cache import SemanticCache, get_semantic_cache, normalize_question
+from .tracing import count, span, tracing_enabled
 
-set_llm_cache(InMemoryCache())
+logger = logging.getLogger(__name__)
 
-load_dotenv()
+_initialized = False
+_init_lock = threading.Lock()
 
-RELEVANCE_THRESHOLD = 0.55
 
-def get_and_filter_docs(query: str) -> list[Document]:
-    """Retrieve the documents and filter them directly based on their relevance score."""
-    gemini_embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
-    vectorstore = Chroma(
-        persist_directory="./chroma_db",
-        embedding_function=gemini_embeddings,
-    )
-    docs_with_scores = vectorstore.similarity_search_with_relevance_scores(query, k=10)
-    return [doc for doc, score in docs_with_scores if score >= RELEVANCE_THRESHOLD]
+def init():
+    """Initialize the process once, before using the application: load the environment from
+    the .env file (GOOGLE_API_KEY) and install the in-memory LLM cache.
+    Called by the entry points (command line, Streamlit) rather than when the module is imported.
+    """
+    global _initialized
+    with _init_lock:
+        if _initialized:
+            return
+        from langchain_core.caches import InMemoryCache
+        from langchain_core.globals import set_llm_cache
 
+        load_dotenv()
+        set_llm_cache(InMemoryCache())
+        _initialized = True
 
-def format_docs(docs: list[Document]) -> str:
-    """Format the documents for the LLM input."""
-    return "\n\n".join(doc.page_content for doc in docs)
 
+def get_and_filter_docs(query: str, embedding: list[float] | None = None) -> list[Document]:
+    """Retrieve the documents and filter them directly based on their relevance score.
+    The vector store is shared by the whole process, see `get_retriever`.
+    """
+    return get_retriever().get_and_filter_docs(query, embedding)
 
-def init_rag_chain() -> RunnableParallel:
-    """Initialize the RAG chain with LangChain."""
-    llm = ChatGoogleGenerativeAI(
-        model="gemini-2.0-flash",
-        temperature=0.1, #low temperature for more deterministic responses
-        max_output_tokens=3000, # high max output tokens to allow for detailed responses
-        model_kwargs={"topP": 0.8, "topK": 60}, # topP and topK for better quality responses
-    )
-    llm_prompt = PromptTemplate.from_template(
-        """
+
+def embed_question(query: str) -> list[float] | None:
+    """The embedding of the query, or None if its retrieval needs none, see `PokemonRetriever.query_embedding`."""
+    return get_retriever().query_embedding(query)
+
+
+def embed_text(text: str) -> list[float]:
+    """Embed a text with the embedding model of the store, see `PokemonRetriever.embed`."""
+    return get_retriever().embed(text)
+
+
+class LLMTracer(BaseCallbackHandler):
+    """Trace the LLM calls as "generate" spans of the current trace, with the tokens sent and
+    generated (from the usage reported by the model, estimated otherwise) and the time to the
+    first streamed token. Ignored by LangChain while tracing is off.
+    """
+
+    run_inline = True
+
+    def __init__(self):
+        self._calls = {}
+
+    @property
+    def ignore_llm(self) -> bool:
+        return not tracing_enabled()
+
+    @property
+    def ignore_chat_model(self) -> bool:
+        return not tracing_enabled()
+
+    def on_llm_start(self, serialized: dict, prompts: list[str], *, run_id: UUID, **kwargs):
+        self._calls[run_id] = (span("generate"), sum(estimate_tokens(prompt) for prompt in prompts))
+
+    def on_chat_model_start(self, serialized: dict, messages: list[list[BaseMessage]], *, run_id: UUID, **kwargs):
+        text = "".join(str(message.content) for batch in messages for message in batch)
+        self._calls[run_id] = (span("generate"), estimate_tokens(text))
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs):
+        call = self._calls.get(run_id)
+        if call is not None and "first_token_ms" not in call[0].attributes:
+            call[0].set(first_token_ms=round((time.perf_counter() - call[0].start) * 1000, 3))
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs):
+        call = self._calls.pop(run_id, None)
+        if call is None:
+            return
+        generate_span, input_tokens = call
+        generations = [generation for batch in response.generations for generation in batch]
+        usage = [getattr(getattr(generation, "message", None), "usage_metadata", None) for generation in generations]
+        if usage and all(usage):
+            input_tokens = sum(item["input_tokens"] for item in usage)
+            output_tokens = sum(item["output_tokens"] for item in usage)
+        else:
+            output_tokens = sum(estimate_tokens(generation.text) for generation in generations)
+            generate_span.set(tokens_estimated=True)
+        generate_span.set(input_tokens=input_tokens, output_tokens=output_tokens)
+        count("rag_llm_tokens_total", input_tokens, direction="input")
+        count("rag_llm_tokens_total", output_tokens, direction="output")
+        generate_span.end()
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs):
+        call = self._calls.pop(run_id, None)
+        if call is not None:
+            call[0].set(error=type(error).__name__)
+            call[0].end()
+
+
+llm_tracer = LLMTracer()
+
+
+LLM_MODEL = "gemini-2.0-flash"
+LLM_TEMPERATURE = 0.1 #low temperature for more deterministic responses
+LLM_MAX_OUTPUT_TOKENS = 3000 # high max output tokens to allow for detailed responses
+
+RAG_PROMPT = """
     Tu es un assistant spécialiste de l'univers Pokémon.
     Tu réponds en peu de phrases, de manière claire, concise et directe.
 
@@ -58,68 +146,380 @@ def init_rag_chain() -> RunnableParallel:
     Contexte : {context}
 
     Réponse :
-    """,
+    """
+
+
+def init_llm(
+    model: str = LLM_MODEL,
+    temperature: float = LLM_TEMPERATURE,
+    max_output_tokens: int = LLM_MAX_OUTPUT_TOKENS,
+) -> BaseLanguageModel:
+    """Initialize the Gemini chat model used to generate the answers."""
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+    return ChatGoogleGenerativeAI(
+        model=model,
+        temperature=temperature,
+        max_output_tokens=max_output_tokens,
+        model_kwargs={"topP": 0.8, "topK": 60}, # topP and topK for better quality responses
     )
-    retriever_with_filter = RunnableLambda(get_and_filter_docs)
+
+
+def build_rag_chain(
+    llm: BaseLanguageModel,
+    semantic_cache: SemanticCache | None = None,
+    cache_namespace: str = "",
+    retriever_with_filter: Runnable | None = None,
+    context_compressor: ContextCompressor | None = None,
+    query_embedder: Runnable | None = None,
+    retriever: PokemonRetriever | None = None,
+    cache_embedder: Runnable | None = None,
+) -> Runnable:
+    """Build the RAG chain with LangChain around the given language model.
+    The question is embedded once by `query_embedder`, and the embedding is shared by the
+    retrieval step and the semantic cache, if any, which answers questions similar to past
+    ones with the same context without calling the model. A question retrieved without an
+    embedding (routed to its Pokémon) is embedded for the cache by `cache_embedder`. The steps
+    use `retriever` (the process-wide one by default); `query_embedder`, `cache_embedder` and
+    `retriever_with_filter` (which takes {"question", "embedding"}) replace them, e.g. with
+    async ones. The prompt gets the retrieved
+    documents deduplicated and packed into a token budget by `context_compressor` (the
+    process-wide one by default); the "context" output of the chain keeps the retrieved documents.
+    """
+    if context_compressor is None:
+        context_compressor = get_context_compressor()
+    llm_prompt = PromptTemplate.from_template(RAG_PROMPT)
+    if query_embedder is None:
+        query_embedder = RunnableLambda(embed_question if retriever is None else retriever.query_embedding)
+    if cache_embedder is None:
+        cache_embedder = RunnableLambda(embed_text if retriever is None else retriever.embed)
+    if retriever_with_filter is None:
+        retrieve = get_and_filter_docs if retriever is None else retriever.get_and_filter_docs
+        retriever_with_filter = RunnableLambda(lambda x: retrieve(x["question"], x["embedding"]))
     setup_and_retrieval = RunnableParallel(
-        {"context": retriever_with_filter, "question": RunnablePassthrough()},
-    )
+        {"question": RunnablePassthrough(), "embedding": query_embedder},
+    ).assign(context=retriever_with_filter)
 
     answer_generation_chain = (
-        RunnablePassthrough.assign(context=(lambda x: format_docs(x["context"])))
+        RunnablePassthrough.assign(context=(lambda x: context_compressor.assemble(x["context"], x["question"])))
         | llm_prompt
-        | llm
+        | llm.with_config(callbacks=[llm_tracer])
         | StrOutputParser()
     )
+    if semantic_cache is not None:
+        answer_generation_chain = semantic_cache.wrap(answer_generation_chain, cache_embedder, namespace=cache_namespace)
     return setup_and_retrieval.assign(
         answer=answer_generation_chain,
+    ).pick(["context", "question", "answer"])
+
+
+@functools.cache
+def get_rag_chain(
+    model: str = LLM_MODEL,
+    temperature: float = LLM_TEMPERATURE,
+    max_output_tokens: int = LLM_MAX_OUTPUT_TOKENS,
+) -> Runnable:
+    """Return the RAG chain for this model configuration.
+    The chain is compiled once per configuration and then reused by the whole process.
+    """
+    return build_rag_chain(
+        init_llm(model, temperature=temperature, max_output_tokens=max_output_tokens),
+        semantic_cache=get_semantic_cache(),
+        cache_namespace=f"{model}:{temperature}:{max_output_tokens}",
     )
 
 
+def init_rag_chain() -> Runnable:
+    """Initialize the RAG chain with LangChain."""
+    return get_rag_chain()
+
+
+class Flight:
+    """One execution of a question, whose chunks are replayed to every request following it,
+    from threads (`follow`) as well as from async tasks (`afollow`).
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self._condition = threading.Condition()
+        self._async_waiters = []
+
+    def _wake_async_waiters(self):
+        for loop, event in self._async_waiters:
+            loop.call_soon_threadsafe(event.set)
+        self._async_waiters.clear()
+
+    def publish(self, chunk):
+        with self._condition:
+            self.chunks.append(chunk)
+            self._condition.notify_all()
+            self._wake_async_waiters()
+
+    def finish(self, error: BaseException | None = None):
+        with self._condition:
+            self.done = True
+            self.error = error
+            self._condition.notify_all()
+            self._wake_async_waiters()
+
+    def follow(self) -> Iterator:
+        """The chunks of the execution, as they are published. Blocks the calling thread,
+        so an async task must use `afollow` instead.
+        """
+        index = 0
+        while True:
+            with self._condition:
+                while index == len(self.chunks) and not self.done:
+                    self._condition.wait()
+                chunks, done, error = self.chunks[index:], self.done, self.error
+            yield from chunks
+            index += len(chunks)
+            if done and index == len(self.chunks):
+                if error is not None:
+                    raise error
+                return
+
+    async def afollow(self) -> AsyncIterator:
+        """The chunks of the execution, as they are published, without blocking the event loop."""
+        loop = asyncio.get_running_loop()
+        index = 0
+        while True:
+            event = asyncio.Event()
+            with self._condition:
+                chunks, done, error = self.chunks[index:], self.done, self.error
+                if not chunks and not done:
+                    self._async_waiters.append((loop, event))
+            if not chunks and not done:
+                await event.wait()
+                continue
+            for chunk in chunks:
+                yield chunk
+            index += len(chunks)
+            if done and index == len(self.chunks):
+                if error is not None:
+                    raise error
+                return
+
+
+class SingleFlight:
+    """Coalesce the concurrent executions of the same question: the first request starts it,
+    the requests arriving while it runs follow it instead of starting their own, and they all
+    get the same result (or error). Streamed executions are driven to the end by a thread or a
+    task of their own, so a request leaving early does not cut the stream of the others.
+    """
+
+    def __init__(self):
+        self.executions = 0
+        self.coalesced = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._tasks = set()
+
+    def _join(self, key) -> tuple[Flight, bool]:
+        """The flight of the key and whether the caller leads it (a new execution)."""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = Flight()
+                self.executions += 1
+                return flight, True
+            self.coalesced += 1
+            coalesced, total = self.coalesced, self.executions + self.coalesced
+        count("rag_coalesced_requests_total")
+        logger.info(f"Question coalesced with an identical one in flight ({coalesced}/{total} requests so far).")
+        return flight, False
+
+    def _land(self, key, flight: Flight, error: BaseException | None = None):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.finish(error)
+
+    def _drive(self, key, flight: Flight, chunks: Iterator):
+        try:
+            for chunk in chunks:
+                flight.publish(chunk)
+        except Exception as e:  # noqa: BLE001 - raised in every request following the flight
+            self._land(key, flight, e)
+        else:
+            self._land(key, flight)
+
+    async def _adrive(self, key, flight: Flight, chunks: AsyncIterator):
+        try:
+            async for chunk in chunks:
+                flight.publish(chunk)
+        except Exception as e:  # noqa: BLE001 - raised in every request following the flight
+            self._land(key, flight, e)
+        else:
+            self._land(key, flight)
+
+    def invoke(self, key, func: Callable[[], Any]) -> Any:
+        """`func()`, or the result of the call of the same key in flight."""
+        flight, leader = self._join(key)
+        if leader:
+            try:
+                result = func()
+            except Exception as e:
+                self._land(key, flight, e)
+                raise
+            flight.publish(result)
+            self._land(key, flight)
+            return result
+        return next(flight.follow())
+
+    async def ainvoke(self, key, func: Callable[[], Awaitable]) -> Any:
+        """`await func()`, or the result of the call of the same key in flight."""
+        async def result():
+            yield await func()
+
+        async for value in self.astream(key, result):
+            pass
+        return value
+
+    def stream(self, key, func: Callable[[], Iterator]) -> Iterator:
+        """The chunks of `func()`, or of the stream of the same key in flight."""
+        flight, leader = self._join(key)
+        if leader:
+            thread = threading.Thread(
+                target=contextvars.copy_context().run, args=(self._drive, key, flight, func()), daemon=True,
+            )
+            thread.start()
+        yield from flight.follow()
+
+    async def astream(self, key, func: Callable[[], AsyncIterator]) -> AsyncIterator:
+        """The chunks of `func()`, or of the stream of the same key in flight."""
+        flight, leader = self._join(key)
+        if leader:
+            task = asyncio.create_task(self._adrive(key, flight, func()))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        async for chunk in flight.afollow():
+            yield chunk
+
+    def stats(self) -> dict:
+        """Number of executions and of requests coalesced onto them since the start."""
+        with self._lock:
+            total = self.executions + self.coalesced
+            return {
+                "executions": self.executions,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._flights),
+                "coalesced_rate": self.coalesced / total if total else 0.0,
+            }
+
+
+single_flight = SingleFlight()
+
+
+def flight_key(kind: str, query: str, rag_chain: Runnable) -> tuple:
+    """Key of the executions of a chain that give the same result: identical normalized questions."""
+    return kind, id(rag_chain), normalize_question(query)
+
+
+_answer_counts = Counter()
+_answer_counts_lock = threading.Lock()
+
+
+def answer_from_facts(query: str, retriever: PokemonRetriever | None = None) -> str | None:
+    """Answer a factual question about one Pokémon (type, size, base stats...) straight from
+    the fact table built at ingestion, or return None if the question is not one of them.
+    """
+    retriever = retriever or get_retriever()
+    fact_store = retriever.fact_store
+    if fact_store is None:
+        return None
+    pokemon = retriever.entity_index.detect(query)
+    if len(pokemon) != 1:
+        return None
+    return fact_store.answer(pokemon[0], query)
+
+
+def count_answer(source: str):
+    """Count an answer given by the fact table ("facts") or by the RAG chain ("rag")."""
+    count("rag_answers_total", source=source)
+    with _answer_counts_lock:
+        _answer_counts[source] += 1
+        if source == "facts":
+            total = sum(_answer_counts.values())
+            logger.info(f"Answered from the fact table ({_answer_counts['facts']}/{total} questions so far).")
+
+
+def answer_stats() -> dict:
+    """Number of answers given by the fact table and by the RAG chain since the start."""
+    with _answer_counts_lock:
+        total = sum(_answer_counts.values())
+        return {
+            "facts": _answer_counts["facts"],
+            "rag": _answer_counts["rag"],
+            "fast_path_rate": _answer_counts["facts"] / total if total else 0.0,
+        }
+
+
 def app():
     """Initialize the RAG application with LangChain."""
     rag_chain = init_rag_chain()
     while True:
         requete = input("Posez votre question sur l'univers Pokémon : ")
-        print(rag_chain.invoke(requete)["answer"])
+        for token in stream_answer_tokens(requete, rag_chain=rag_chain):
+            print(token, end="", flush=True)
+        print()
 
 
-def get_answer(query: str) -> str:
-    """Retrieve an answer from the RAG system based on the input query."""
-    llm = ChatGoogleGenerativeAI(
-        model="gemini-2.0-flash",
-        temperature=0.1, #low temperature for more deterministic responses
-        max_output_tokens=3000, # high max output tokens to allow for detailed responses
-        model_kwargs={"topP": 0.8, "topK": 60}, # topP and topK for better quality responses
-    )
-    llm_prompt = PromptTemplate.from_template(
-        """
-        Tu es un assistant spécialiste de l'univers Pokémon.
-        Tu réponds en peu de phrases, de manière claire, concise et directe.
+def get_answer(query: str, rag_chain: Runnable | None = None) -> str:
+    """Retrieve an answer from the RAG system based on the input query.
+    Factual questions found in the fact table are answered without calling the chain, and
+    a question already being answered for another session waits for that answer.
+    """
+    with span("answer") as answer_span:
+        with span("facts"):
+            answer = answer_from_facts(query)
+        if answer is not None:
+            answer_span.set(source="facts")
+            count_answer("facts")
+            return answer
+        answer_span.set(source="rag")
+        count_answer("rag")
+        if rag_chain is None:
+            rag_chain = get_rag_chain()
+        result = single_flight.invoke(flight_key("invoke", query, rag_chain), lambda: rag_chain.invoke(query))
+        return result["answer"]
 
-        - Utilise UNIQUEMENT le contexte fourni pour répondre.
-        - Si la question demande une donnée précise, donne une réponse brève et exacte.
-        - Si la question est plus large, essaie de tirer une réponse utile du contexte et développe un peu plus la réponse (quelques phrases).
-        - Si c’est subjectif, tu peux ajouter une touche d’humour, mais toujours avec une réponse.
-        - Si le contexte ne permet pas de répondre, dis simplement : "Je ne sais pas."
 
-        Question : {question}
-        Contexte : {context}
+def stream_answer(query: str, rag_chain: Runnable | None = None) -> Iterator[dict]:
+    """Stream the answer to a query: first {"context": documents} once they are retrieved,
+    then {"answer": text} chunks as the model generates them.
+    Factual questions found in the fact table give a single answer chunk without context.
+    A question already being streamed for another session follows that stream.
+    The time to the first answer chunk and the total time are logged.
+    """
+    start = time.perf_counter()
+    with span("answer") as answer_span:
+        with span("facts"):
+            answer = answer_from_facts(query)
+        if answer is not None:
+            answer_span.set(source="facts")
+            count_answer("facts")
+            yield {"answer": answer}
+            return
+        answer_span.set(source="rag")
+        count_answer("rag")
+        if rag_chain is None:
+            rag_chain = get_rag_chain()
+        first_token = None
+        for chunk in single_flight.stream(flight_key("stream", query, rag_chain), lambda: rag_chain.stream(query)):
+            if "answer" in chunk and first_token is None:
+                first_token = time.perf_counter() - start
+            chunk = {key: value for key, value in chunk.items() if key != "question"}  # shared with the followers
+            if chunk:
+                yield chunk
+    total = time.perf_counter() - start
+    logger.info(f"Answer streamed: first token after {first_token or total:.2f} s, complete after {total:.2f} s.")
 
-        Réponse :
-        """,
-    )
-    retriever_with_filter = RunnableLambda(get_and_filter_docs)
-    setup_and_retrieval = RunnableParallel(
-        {"context": retriever_with_filter, "question": RunnablePassthrough()},
-    )
-    answer_generation_chain = (
-        RunnablePassthrough.assign(context=(lambda x: format_docs(x["context"])))
-        | llm_prompt
-        | llm
-        | StrOutputParser()
-    )
-    rag_chain = setup_and_retrieval.assign(
-        answer=answer_generation_chain,
-    )
-    return rag_chain.invoke(query)["answer"]
+
+def stream_answer_tokens(query: str, rag_chain: Runnable | None = None) -> Iterator[str]:
+    """Stream only the text of the answer to a query, see `stream_answer`."""
+    for chunk in stream_answer(query, rag_chain=rag_chain):
+        if "answer" in chunk:
+            yield chunk["answer"]
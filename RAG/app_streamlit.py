@@ -1,3 +1,4 @@
+import logging
 import os
 import sys
 import zipfile
@@ -5,22 +6,48 @@ import streamlit as st
 
 # Ensure the RAG module is in the Python path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
-from RAG.app import get_answer
+from RAG.app import get_rag_chain, init, stream_answer_tokens
+from RAG.retriever import PERSIST_DIRECTORY, PokemonRetriever, get_retriever, set_retriever
+from RAG.settings import SNAPSHOT_PATH
+from RAG.tracing import span, tracing_enabled
 
 def decompress_if_needed():
-    """Décompresse chroma_db.zip dans chroma_db si besoin."""
-    if not os.path.exists("chroma_db") and os.path.exists("chroma_db.zip"):
+    """Décompresse chroma_db.zip dans chroma_db si besoin (sans snapshot, voir load_retriever)."""
+    if not os.path.exists("chroma_db") and not os.path.exists(SNAPSHOT_PATH) and os.path.exists("chroma_db.zip"):
         with st.spinner("Décompression de la base vectorielle..."):
             with zipfile.ZipFile("chroma_db.zip", "r") as zip_ref:
                 zip_ref.extractall("chroma_db")
         st.success("Base vectorielle décompressée.")
 
+@st.cache_resource
+def load_retriever():
+    """Ouvre la base vectorielle une seule fois pour toutes les sessions.
+    Sans dossier chroma_db, le snapshot chroma_db.snapshot est lu directement (NumPy) ou
+    décompressé en arrière-plan (Chroma), pendant que l'interface s'affiche et répond déjà.
+    """
+    if not os.path.exists(PERSIST_DIRECTORY) and os.path.exists(SNAPSHOT_PATH):
+        set_retriever(PokemonRetriever(SNAPSHOT_PATH, unpack_directory=PERSIST_DIRECTORY))
+        retriever = get_retriever()
+        retriever.warm_up()
+        return retriever
+    retriever = get_retriever()
+    retriever.load()
+    return retriever
+
+@st.cache_resource
+def load_rag_chain():
+    """Compile la chaîne RAG une seule fois pour toutes les sessions."""
+    return get_rag_chain()
+
 def app_streamlit():
     """
         Build the RAG application with Streamlit. 
     """
     st.set_page_config(page_title="Pokémon RAG", page_icon="🧠", layout="wide") # <-- CHANGEMENT ICI
+    init()
     decompress_if_needed()
+    load_retriever()
+    rag_chain = load_rag_chain()
     
     #CSS of the application
     st.markdown("""
@@ -126,11 +153,13 @@ def app_streamlit():
 
     if prompt:
         st.session_state.messages.append({"role": "user", "content": prompt})
+        with chat_container.chat_message("user"):
+            st.markdown(prompt)
 
-        # Display a spinner while waiting for the response
-        with st.spinner("Recherche en cours..."):
+        # Display the response as it is generated
+        with chat_container.chat_message("assistant"):
             try:
-                response = get_answer(prompt)
+                response = st.write_stream(stream_answer_tokens(prompt, rag_chain=rag_chain))
             except Exception as e:
                 response = f"Désolé, une erreur est survenue : {e}"
 
@@ -141,4 +170,7 @@ def app_streamlit():
 
 
 if __name__ == "__main__":
-    app_streamlit()
\ No newline at end of file
+    if tracing_enabled():
+        logging.basicConfig(level=logging.INFO)
+    with span("render"):  # every rerun of the script
+        app_streamlit()
\ No newline at end of file
@@ -0,0 +1,32 @@
+import importlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+BENCHMARKS = {}
+# Modules of the benchmarks, imported when a benchmark is run
+BENCHMARK_MODULES = ("extraction", "retrieval", "serving", "startup", "storage")
+
+
+def benchmark(name):
+    """Register a benchmark so it can be run with `python -m RAG --bench NAME`."""
+    def decorator(func):
+        BENCHMARKS[name] = func
+        return func
+    return decorator
+
+
+def load_benchmarks():
+    """Import the modules of the benchmarks, which registers them."""
+    for module in BENCHMARK_MODULES:
+        importlib.import_module(f"{__name__}.{module}")
+
+
+def run_benchmark(name: str, **options):
+    """Run a registered benchmark by name, with the given keyword arguments."""
+    load_benchmarks()
+    if name not in BENCHMARKS:
+        logger.error(f"Unknown benchmark: {name}. Available: {', '.join(sorted(BENCHMARKS))}.")
+        return
+    logger.info(f"Running benchmark '{name}'...")
+    BENCHMARKS[name](**options)
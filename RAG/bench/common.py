@@ -0,0 +1,103 @@
+import logging
+import os
+import statistics
+import time
+import zlib
+
+import numpy as np
+from langchain.docstore.document import Document
+from langchain_chroma import Chroma
+from langchain_core.embeddings import DeterministicFakeEmbedding, Embeddings
+
+from ..bm25 import tokenize
+from ..download_dataset import pokemon_gen, pokemon_gen2, safe_filename
+
+logger = logging.getLogger(__name__)
+
+# Working directory of the benchmarks run in a new Python process, where RAG can be imported
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BENCH_QUERIES = [
+    "qui est pickachu?",
+    "Quel est le type de sulfura ?",
+    "qui sont les Oiseaux Légendaires de Kanto?",
+    "quel est le nom japonais de Ronflex ?",
+]
+
+
+def fake_embeddings() -> DeterministicFakeEmbedding:
+    """A local embedding function, so the benchmarks need neither network nor API key."""
+    return DeterministicFakeEmbedding(size=768)
+
+
+def time_calls(func, queries: list[str], repeat: int) -> list[float]:
+    """Call `func` on every query `repeat` times and return the durations in milliseconds."""
+    durations = []
+    for _ in range(repeat):
+        for query in queries:
+            start = time.perf_counter()
+            func(query)
+            durations.append((time.perf_counter() - start) * 1000)
+    return durations
+
+
+def report(label: str, durations: list[float]):
+    """Log the mean and median of a list of durations in milliseconds."""
+    logger.info(
+        f"{label}: mean {statistics.mean(durations):.2f} ms, "
+        f"p50 {statistics.median(durations):.2f} ms over {len(durations)} queries",
+    )
+
+
+def build_fake_vectorstore(persist_directory: str, embeddings) -> Chroma:
+    """Build a small store with one document per known Pokémon."""
+    docs = [
+        Document(page_content=f"{name} est un Pokémon.", metadata={"source": name, "pokemon": safe_filename(name)})
+        for name in pokemon_gen[0] + pokemon_gen2[0]
+    ]
+    return Chroma.from_documents(
+        documents=docs,
+        embedding=embeddings,
+        persist_directory=persist_directory,
+    )
+
+
+class HashingEmbeddings(Embeddings):
+    """Deterministic local embedding model: the folded words of a text and their character
+    trigrams are hashed into `size` signed dimensions, then the vector is normalized.
+    It needs no network and gives the same vectors on every machine, so the retrieval
+    benchmark runs offline and its results can be compared between runs.
+    """
+
+    def __init__(self, size: int = 768):
+        self.size = size
+
+    def embed_query(self, text: str) -> list[float]:
+        vector = np.zeros(self.size, dtype=np.float32)
+        for word in tokenize(text):
+            for feature in [word, *(word[i:i + 3] for i in range(len(word) - 2))]:
+                digest = zlib.crc32(feature.encode("utf-8"))
+                vector[digest % self.size] += 1.0 if digest & 0x80000000 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return [self.embed_query(text) for text in texts]
+
+
+def percentiles(durations: list[float]) -> dict:
+    """p50, p95 and p99 of a list of durations in milliseconds."""
+    if len(durations) < 2:
+        value = round(durations[0], 3) if durations else 0.0
+        return {"p50": value, "p95": value, "p99": value, "count": len(durations)}
+    cuts = statistics.quantiles(durations, n=100, method="inclusive")
+    return {f"p{q}": round(cuts[q - 1], 3) for q in (50, 95, 99)} | {"count": len(durations)}
+
+
+def directory_size(path: str) -> int:
+    """Total size in bytes of the files under a directory."""
+    return sum(
+        os.path.getsize(os.path.join(root, filename))
+        for root, _, filenames in os.walk(path)
+        for filename in filenames
+    )
@@ -0,0 +1,46 @@
+import importlib.util
+import logging
+import time
+
+from langchain.docstore.document import Document
+
+from ..create_vectorstore import list_pages
+from ..extract import load_page
+from . import benchmark
+
+logger = logging.getLogger(__name__)
+
+def clean_unstructured_page(doc: Document) -> Document:
+    """The string based cleaning previously applied to the UnstructuredHTMLLoader output."""
+    text_content = doc.page_content.replace("[modifier]", "")
+    text_content = "№" + text_content.split("№")[1]
+    doc.page_content = text_content.split("Dans le Jeu de Cartes à Collectionner")[0]
+    return doc
+
+
+def throughput(label: str, load, paths: list[str]):
+    """Load every page with `load` and log the number of documents per second."""
+    start = time.perf_counter()
+    for path in paths:
+        load(path)
+    elapsed = time.perf_counter() - start
+    logger.info(f"{label}: {len(paths) / elapsed:.1f} docs/s ({len(paths)} docs in {elapsed:.2f} s)")
+
+
+@benchmark("extraction")
+def bench_extraction():
+    """Compare the pages parsed per second by UnstructuredHTMLLoader and by the lxml extractor
+    on the checked-in dataset.
+    """
+    paths = list_pages()
+    throughput("lxml extractor", load_page, paths)
+    if importlib.util.find_spec("unstructured") is None:
+        logger.warning("unstructured is not installed, skipping the UnstructuredHTMLLoader run.")
+        return
+    from langchain_community.document_loaders import UnstructuredHTMLLoader
+
+    throughput(
+        "UnstructuredHTMLLoader",
+        lambda path: clean_unstructured_page(UnstructuredHTMLLoader(path).load()[0]),
+        paths,
+    )
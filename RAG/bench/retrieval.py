@@ -0,0 +1,226 @@
+import json
+import logging
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+from langchain.docstore.document import Document
+from langchain_chroma import Chroma
+
+from ..context import ContextCompressor
+from ..create_vectorstore import create_vectorstore
+from ..download_dataset import safe_filename
+from ..retriever import (
+    LEXICAL_RELEVANCE_THRESHOLD,
+    RELEVANCE_THRESHOLD,
+    RETRIEVAL_STAGES,
+    PokemonRetriever,
+    estimate_tokens,
+)
+from . import benchmark
+from .common import (
+    BENCH_QUERIES,
+    HashingEmbeddings,
+    build_fake_vectorstore,
+    fake_embeddings,
+    percentiles,
+    report,
+    time_calls,
+)
+
+logger = logging.getLogger(__name__)
+
+RETRIEVAL_QUERIES_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "retrieval_queries.json")
+RETRIEVAL_CUTOFFS = (1, 3, 5, 10)
+# Retriever configurations compared by the retrieval benchmark
+RETRIEVAL_CONFIGS = {
+    "dense": {"lexical_weight": 0.0, "entity_routing": False},
+    "hybrid": {"entity_routing": False},
+    "hybrid+entities": {},
+}
+
+
+@benchmark("retriever")
+def bench_retriever(repeat: int = 25):
+    """Compare per-query retrieval time when reopening the store on every query
+    (the previous behaviour) with the shared `PokemonRetriever`.
+    """
+    embeddings = fake_embeddings()
+    persist_directory = tempfile.mkdtemp(prefix="bench_chroma_")
+    try:
+        build_fake_vectorstore(persist_directory, embeddings)
+
+        def reopen_each_query(query):
+            vectorstore = Chroma(
+                persist_directory=persist_directory,
+                embedding_function=fake_embeddings(),
+            )
+            return vectorstore.similarity_search_with_relevance_scores(query, k=10)
+
+        retriever = PokemonRetriever(
+            persist_directory=persist_directory,
+            embedding_function=embeddings,
+        )
+        report("before (store reopened per query)", time_calls(reopen_each_query, BENCH_QUERIES, repeat))
+        report("after (shared retriever)", time_calls(retriever.get_and_filter_docs, BENCH_QUERIES, repeat))
+    finally:
+        shutil.rmtree(persist_directory, ignore_errors=True)
+
+
+def load_retrieval_queries(path: str = RETRIEVAL_QUERIES_PATH) -> list[dict]:
+    """Load the labelled retrieval queries: a JSON list of {"query": "...", "expected": [...]},
+    every expected chunk being given by its Pokémon and, optionally, its section.
+    """
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def is_expected(doc: Document, expected: dict) -> bool:
+    """Whether a retrieved chunk matches an expected {"pokemon": ..., "section": ...}."""
+    return doc.metadata.get("pokemon") == safe_filename(expected["pokemon"]) and (
+        "section" not in expected or doc.metadata.get("section") == expected["section"]
+    )
+
+
+def retrieval_quality(docs: list[Document], expected: list[dict]) -> dict:
+    """Recall at every cutoff (share of the expected chunks found in the first k documents)
+    and reciprocal rank of the first expected chunk.
+    """
+    ranks = [
+        next((rank for rank, doc in enumerate(docs, 1) if is_expected(doc, target)), None)
+        for target in expected
+    ]
+    found = [rank for rank in ranks if rank is not None]
+    return {
+        "recall": {k: sum(rank <= k for rank in found) / len(expected) for k in RETRIEVAL_CUTOFFS},
+        "reciprocal_rank": 1 / min(found) if found else 0.0,
+    }
+
+
+def evaluate_retriever(retriever: PokemonRetriever, queries: list[dict], repeat: int) -> dict:
+    """Recall@k, MRR and per-stage latency percentiles of a retriever on the labelled queries.
+    Stages a query does not go through (e.g. the embedding of a routed query) are not counted.
+    """
+    retriever.get_and_filter_docs(queries[0]["query"])  # open the store and load the indexes
+    durations = {stage: [] for stage in (*RETRIEVAL_STAGES, "total")}
+    qualities = []
+    for iteration in range(repeat):
+        for item in queries:
+            timings = {}
+            start = time.perf_counter()
+            docs = retriever.get_and_filter_docs(item["query"], timings=timings)
+            timings["total"] = time.perf_counter() - start
+            for stage, seconds in timings.items():
+                durations[stage].append(seconds * 1000)
+            if iteration == 0:
+                qualities.append(retrieval_quality(docs, item["expected"]))
+    return {
+        **{
+            f"recall@{k}": round(statistics.mean(quality["recall"][k] for quality in qualities), 4)
+            for k in RETRIEVAL_CUTOFFS
+        },
+        "mrr": round(statistics.mean(quality["reciprocal_rank"] for quality in qualities), 4),
+        "latency_ms": {stage: percentiles(values) for stage, values in durations.items() if values},
+    }
+
+
+@benchmark("retrieval")
+def bench_retrieval(
+    queries_path: str = RETRIEVAL_QUERIES_PATH,
+    output: str | None = None,
+    repeat: int = 5,
+    relevance_threshold: float = RELEVANCE_THRESHOLD,
+) -> dict:
+    """Retrieval-only benchmark, with no LLM call: the whole dataset is indexed with the
+    local `HashingEmbeddings`, then every labelled query is run `repeat` times against the
+    dense, hybrid and hybrid + entity routing retrievers. Reports recall@k, MRR and the
+    p50/p95/p99 latency of every stage (see RETRIEVAL_STAGES) as JSON, printed and written
+    to `output` if given. Every retriever is run with the dense and lexical relevance
+    thresholds of the application ("threshold") and without them ("no_threshold"), since
+    the scores of the hashing embeddings are lower than the ones of the Gemini model.
+    """
+    queries = load_retrieval_queries(queries_path)
+    embeddings = HashingEmbeddings()
+    persist_directory = tempfile.mkdtemp(prefix="bench_chroma_")
+    thresholds = {
+        "threshold": {"relevance_threshold": relevance_threshold, "lexical_threshold": LEXICAL_RELEVANCE_THRESHOLD},
+        "no_threshold": {"relevance_threshold": 0.0, "lexical_threshold": 0.0},
+    }
+    try:
+        start = time.perf_counter()
+        create_vectorstore(persist_directory=persist_directory, embeddings=embeddings, embedding_model="hashing")
+        results = {
+            "embeddings": f"hashing-{embeddings.size}",
+            "queries": len(queries),
+            "repeat": repeat,
+            "relevance_threshold": relevance_threshold,
+            "lexical_threshold": LEXICAL_RELEVANCE_THRESHOLD,
+            "index_seconds": round(time.perf_counter() - start, 2),
+            "configs": {},
+        }
+        for name, options in RETRIEVAL_CONFIGS.items():
+            results["configs"][name] = {}
+            for label, threshold_options in thresholds.items():
+                retriever = PokemonRetriever(
+                    persist_directory=persist_directory,
+                    embedding_function=embeddings,
+                    **threshold_options,
+                    **options,
+                )
+                metrics = results["configs"][name][label] = evaluate_retriever(retriever, queries, repeat)
+                logger.info(
+                    f"{name} ({label.replace('_', ' ')}): "
+                    + ", ".join(f"recall@{k} {metrics[f'recall@{k}']:.2f}" for k in RETRIEVAL_CUTOFFS)
+                    + f", MRR {metrics['mrr']:.2f}, p50 {metrics['latency_ms']['total']['p50']:.2f} ms",
+                )
+    finally:
+        shutil.rmtree(persist_directory, ignore_errors=True)
+    text = json.dumps(results, indent=2, ensure_ascii=False)
+    print(text)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        logger.info(f"Retrieval benchmark results written to {output}")
+    return results
+
+
+@benchmark("context")
+def bench_context(queries_path: str = RETRIEVAL_QUERIES_PATH, budgets: tuple[int, ...] = (1000, 2000, 3000)):
+    """Context compression on the labelled queries: the 10 chunks retrieved for every query
+    (hashing embeddings, no relevance threshold) are packed by the `ContextCompressor`
+    for several budgets. Reports the tokens of the prompt context before and after, the
+    compression time and the recall of the expected chunks still present in the context.
+    """
+    queries = load_retrieval_queries(queries_path)
+    embeddings = HashingEmbeddings()
+    persist_directory = tempfile.mkdtemp(prefix="bench_chroma_")
+    try:
+        create_vectorstore(persist_directory=persist_directory, embeddings=embeddings, embedding_model="hashing")
+        retriever = PokemonRetriever(
+            persist_directory=persist_directory,
+            embedding_function=embeddings,
+            relevance_threshold=0.0,
+            lexical_threshold=0.0,
+        )
+        retrieved = [retriever.get_and_filter_docs(item["query"]) for item in queries]
+        before = [estimate_tokens("\n\n".join(doc.page_content for doc in docs)) for docs in retrieved]
+        recall = statistics.mean(retrieval_quality(docs, item["expected"])["recall"][10] for docs, item in zip(retrieved, queries, strict=True))
+        logger.info(f"retrieved: mean {statistics.mean(before):.0f} tokens, max {max(before)}, recall {recall:.3f}")
+        for budget in budgets:
+            compressor = ContextCompressor(token_budget=budget)
+            durations, after, recalls = [], [], []
+            for docs, item in zip(retrieved, queries, strict=True):
+                start = time.perf_counter()
+                compressed = compressor.compress(docs, item["query"])
+                durations.append((time.perf_counter() - start) * 1000)
+                after.append(estimate_tokens("\n\n".join(doc.page_content for doc in compressed)))
+                recalls.append(retrieval_quality(compressed, item["expected"])["recall"][10])
+            logger.info(
+                f"budget {budget}: mean {statistics.mean(after):.0f} tokens "
+                f"({1 - sum(after) / sum(before):.0%} saved), p50 {statistics.median(durations):.2f} ms, "
+                f"max {max(durations):.2f} ms, recall {statistics.mean(recalls):.3f}",
+            )
+    finally:
+        shutil.rmtree(persist_directory, ignore_errors=True)
@@ -0,0 +1,227 @@
+import asyncio
+import logging
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models import FakeListLLM
+
+from ..retriever import PokemonRetriever
+from ..server import RAGServer
+from ..tracing import enable_tracing, tracing_enabled
+from . import benchmark
+from .common import (
+    BENCH_QUERIES,
+    build_fake_vectorstore,
+    fake_embeddings,
+    report,
+    time_calls,
+)
+
+logger = logging.getLogger(__name__)
+
+class SlowFakeEmbeddings(DeterministicFakeEmbedding):
+    """Fake embeddings taking `latency` seconds per call, like a remote embedding API."""
+
+    latency: float = 0.05
+    calls: int = 0
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        self.calls += 1
+        time.sleep(self.latency)
+        return super().embed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
+
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        return self.embed_documents(texts)
+
+
+class SlowFakeLLM(FakeListLLM):
+    """Fake LLM taking `latency` seconds per answer, like a remote model."""
+
+    latency: float = 0.2
+    calls: int = 0
+
+    def _call(self, *args, **kwargs) -> str:
+        self.calls += 1
+        time.sleep(self.latency)
+        return super()._call(*args, **kwargs)
+
+    async def _acall(self, *args, **kwargs) -> str:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return super()._call(*args, **kwargs)
+
+
+async def load_test(server: RAGServer, questions: list[str], concurrency: int) -> dict:
+    """Send the questions to the /ask endpoint of the server, `concurrency` at a time,
+    and return the latencies of the answered requests and the number of rejected ones.
+    """
+    import aiohttp
+    from aiohttp import web
+
+    runner = web.AppRunner(server.create_app(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    url = f"http://127.0.0.1:{runner.addresses[0][1]}/ask"
+    latencies, rejected, retry_after = [], 0, set()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def ask(session, question):
+        nonlocal rejected
+        async with semaphore:
+            start = time.perf_counter()
+            async with session.post(url, json={"question": question}) as response:
+                await response.read()
+                if response.status == 503:
+                    rejected += 1
+                    retry_after.add(response.headers["Retry-After"])
+                else:
+                    response.raise_for_status()
+                    latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    try:
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=concurrency)) as session:
+            await asyncio.gather(*(ask(session, question) for question in questions))
+    finally:
+        await runner.cleanup()
+    return {
+        "elapsed": time.perf_counter() - start,
+        "latencies": latencies,
+        "rejected": rejected,
+        "retry_after": sorted(retry_after),
+    }
+
+
+def report_load_test(label: str, server: RAGServer, embeddings: SlowFakeEmbeddings, result: dict):
+    """Log the throughput, latencies and embedding calls of a load test."""
+    latencies = sorted(result["latencies"])
+    answered = len(latencies)
+    p95 = latencies[int(0.95 * (answered - 1))] if latencies else 0.0
+    logger.info(
+        f"{label}: {answered / result['elapsed']:.1f} answers/s, "
+        f"p50 {statistics.median(latencies) if latencies else 0.0:.0f} ms, p95 {p95:.0f} ms, "
+        f"{result['rejected']} rejected with 503 (Retry-After {result['retry_after'] or '-'}), "
+        f"{embeddings.calls} embedding calls for {server.batcher.queries} questions",
+    )
+
+
+@benchmark("serve")
+def bench_serve(requests: int = 200, concurrency: int = 50):
+    """Load test the HTTP API, built like `serve` builds it (semantic cache included), against
+    local stub embedding and LLM backends (50 ms per embedding call, 200 ms per answer): without
+    then with embedding micro-batching, and with a small admission queue to show the 503
+    responses under overload.
+    """
+    from ..semantic_cache import SemanticCache
+    from ..server import create_server
+
+    questions = [f"Question {i} : quels Pokémon vivent dans les grottes ?" for i in range(requests)]
+    persist_directory = tempfile.mkdtemp(prefix="bench_chroma_")
+    try:
+        build_fake_vectorstore(persist_directory, fake_embeddings())
+        runs = [
+            ("no batching", {"max_batch_size": 1, "max_in_flight": concurrency, "max_queued": requests}),
+            ("micro-batching", {"max_in_flight": concurrency, "max_queued": requests}),
+            ("overload (4 in flight, 8 queued)", {"max_in_flight": 4, "max_queued": 8}),
+        ]
+        for index, (label, options) in enumerate(runs):
+            embeddings = SlowFakeEmbeddings(size=768)
+            retriever = PokemonRetriever(persist_directory=persist_directory, embedding_function=embeddings)
+            semantic_cache = SemanticCache(
+                path=os.path.join(persist_directory, f"semantic_cache_{index}.sqlite3"),
+                persist_directory=persist_directory,
+            )
+            server = create_server(
+                SlowFakeLLM(responses=["Les Nosferapti."]), retriever=retriever, semantic_cache=semantic_cache, **options,
+            )
+            server.warm_up()
+            result = asyncio.run(load_test(server, questions, concurrency))
+            report_load_test(label, server, embeddings, result)
+    finally:
+        shutil.rmtree(persist_directory, ignore_errors=True)
+
+
+@benchmark("coalescing")
+def bench_coalescing(sessions: int = 32, burst: float = 0.5):
+    """Sessions (threads) asking the same trending question, with small variations of case
+    and punctuation, within `burst` seconds, against stub embedding and LLM backends (50 ms
+    per embedding call, 200 ms per answer): every session running the chain, then the
+    sessions coalesced by `get_answer`.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    from ..app import build_rag_chain, get_answer, single_flight
+
+    questions = ["qui est pikachu ?", "Qui est Pikachu ?", "qui est Pikachu?", "QUI EST PIKACHU"]
+    persist_directory = tempfile.mkdtemp(prefix="bench_chroma_")
+    try:
+        build_fake_vectorstore(persist_directory, fake_embeddings())
+        for label, answer in (
+            ("every session runs the chain", lambda chain, question: chain.invoke(question)["answer"]),
+            ("coalesced", lambda chain, question: get_answer(question, rag_chain=chain)),
+        ):
+            embeddings = SlowFakeEmbeddings(size=768)
+            llm = SlowFakeLLM(responses=["Pikachu est un Pokémon de type Électrik."])
+            retriever = PokemonRetriever(persist_directory=persist_directory, embedding_function=embeddings)
+            retriever.load()
+            chain = build_rag_chain(llm, retriever=retriever)
+            coalesced = single_flight.stats()["coalesced"]
+
+            def session(index, answer=answer, chain=chain):
+                time.sleep(burst * index / sessions)
+                start = time.perf_counter()
+                answer(chain, questions[index % len(questions)])
+                return (time.perf_counter() - start) * 1000
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(sessions) as executor:
+                latencies = list(executor.map(session, range(sessions)))
+            logger.info(
+                f"{label}: {sessions} sessions in {time.perf_counter() - start:.2f} s, "
+                f"p50 {statistics.median(latencies):.0f} ms, max {max(latencies):.0f} ms, "
+                f"{embeddings.calls} embedding calls, {llm.calls} LLM calls, "
+                f"{single_flight.stats()['coalesced'] - coalesced} coalesced",
+            )
+    finally:
+        shutil.rmtree(persist_directory, ignore_errors=True)
+
+
+@benchmark("tracing")
+def bench_tracing(repeat: int = 200):
+    """Cost of the tracing: a question answered by the RAG chain (fake embeddings and LLM,
+    no semantic cache) with tracing off, then on. The trace log lines are not written.
+    """
+    from langchain_core.language_models import FakeListChatModel
+
+    from ..app import build_rag_chain
+
+    persist_directory = tempfile.mkdtemp(prefix="bench_chroma_")
+    was_enabled = tracing_enabled()
+    trace_logger = logging.getLogger("RAG.tracing")
+    level = trace_logger.level
+    try:
+        embeddings = fake_embeddings()
+        build_fake_vectorstore(persist_directory, embeddings)
+        retriever = PokemonRetriever(persist_directory=persist_directory, embedding_function=embeddings)
+        chain = build_rag_chain(
+            FakeListChatModel(responses=["Les Nosferapti."]),
+            retriever=retriever,
+        )
+        chain.invoke(BENCH_QUERIES[0])
+        trace_logger.setLevel(logging.WARNING)
+        for enabled in (False, True):
+            enable_tracing(enabled)
+            durations = time_calls(chain.invoke, BENCH_QUERIES, repeat // len(BENCH_QUERIES))
+            report(f"tracing {'on' if enabled else 'off'}", durations)
+    finally:
+        enable_tracing(was_enabled)
+        trace_logger.setLevel(level)
+        shutil.rmtree(persist_directory, ignore_errors=True)
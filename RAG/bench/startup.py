@@ -0,0 +1,63 @@
+import logging
+import subprocess
+import sys
+import time
+
+from . import BENCHMARK_MODULES, benchmark
+from .common import PROJECT_DIR
+
+logger = logging.getLogger(__name__)
+
+# Modules each command of `python -m RAG` imports before doing its work (the command line itself
+# is imported first), including the Google SDK imported when the clients are created
+STARTUP_COMMANDS = {
+    "--help": [],
+    "--download-dataset": ["RAG.download_dataset"],
+    "--create-vectorstore": ["RAG.create_vectorstore", "langchain_google_genai"],
+    "--app": ["RAG.app", "langchain_google_genai"],
+    "--eval": ["RAG.app", "RAG.eval", "langchain_google_genai"],
+    "--serve": ["RAG.app", "RAG.server", "langchain_google_genai"],
+    "--bench": [f"RAG.bench.{module}" for module in BENCHMARK_MODULES],
+}
+
+
+def import_times(modules: list[str]) -> tuple[float, dict[str, float]]:
+    """Import the command line and `modules` in a new Python process with `-X importtime`.
+    Returns the wall time and the import time spent in every top-level package (the sum of
+    the self times of its modules), in milliseconds.
+    """
+    code = "; ".join(f"import {module}" for module in ["RAG.__main__", *modules])
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=PROJECT_DIR,
+    )
+    wall = (time.perf_counter() - start) * 1000
+    packages = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        own, _, name = line.removeprefix("import time:").split("|")
+        if own.strip().isdigit():
+            package = name.strip().split(".")[0]
+            packages[package] = packages.get(package, 0.0) + int(own) / 1000
+    return wall, packages
+
+
+@benchmark("startup")
+def bench_startup(repeat: int = 3, top: int = 4):
+    """Startup cost of every command of `python -m RAG`: wall time and import time of a
+    fresh interpreter importing what the command needs (see STARTUP_COMMANDS), best of
+    `repeat` runs, with the heaviest packages.
+    """
+    for command, modules in STARTUP_COMMANDS.items():
+        runs = [import_times(modules) for _ in range(repeat)]
+        wall, packages = min(runs, key=lambda run: run[0])
+        heaviest = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+        logger.info(
+            f"{command}: {wall:.0f} ms, imports {sum(packages.values()):.0f} ms ("
+            + ", ".join(f"{package} {ms:.0f} ms" for package, ms in heaviest) + ")",
+        )
@@ -0,0 +1,377 @@
+import json
+import logging
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+
+import numpy as np
+
+from ..create_vectorstore import create_vectorstore
+from ..entities import detect_generations
+from ..retriever import PokemonRetriever, doc_key
+from ..settings import QUANTIZATIONS, SHARDING, VECTOR_BACKENDS
+from ..snapshot import SnapshotReader, export_snapshot
+from ..vector_index import NumpyIndex, open_vector_index
+from . import benchmark
+from .common import PROJECT_DIR, HashingEmbeddings, directory_size, time_calls
+from .retrieval import load_retrieval_queries
+
+logger = logging.getLogger(__name__)
+
+# Run in a fresh interpreter by the backends benchmark: open a vector index, search the query
+# vectors read from stdin and print the timings and the peak memory as JSON
+BACKEND_PROBE = """
+import json, resource, sys, time
+
+def peak_rss_mb():
+    # VmHWM is reset by exec, unlike ru_maxrss which keeps the peak of the forking parent on Linux
+    try:
+        with open("/proc/self/status") as f:
+            return next(int(line.split()[1]) for line in f if line.startswith("VmHWM")) / 1024
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+start = time.perf_counter()
+from RAG.vector_index import open_vector_index
+imported = time.perf_counter()
+job = json.load(sys.stdin)
+index = open_vector_index(job["backend"], job["persist_directory"], sharding=job["sharding"])
+index.count()
+opened = time.perf_counter()
+durations = []
+for vector in job["queries"]:
+    query_start = time.perf_counter()
+    index.search(vector, k=job["k"])
+    durations.append((time.perf_counter() - query_start) * 1000)
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "open_ms": (opened - imported) * 1000,
+    "first_query_ms": durations[0],
+    "queries_ms": durations[1:],
+    "max_rss_mb": peak_rss_mb(),
+}))
+"""
+
+
+def probe_backend(
+    backend: str,
+    persist_directory: str,
+    queries: list[list[float]],
+    k: int,
+    sharding: str = "none",
+) -> dict:
+    """Open the vector index of a store in a new Python process and search it, so the
+    load time and the memory include everything the backend imports and loads.
+    """
+    result = subprocess.run(
+        [sys.executable, "-c", BACKEND_PROBE],
+        input=json.dumps({
+            "backend": backend, "persist_directory": persist_directory, "queries": queries, "k": k, "sharding": sharding,
+        }),
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=PROJECT_DIR,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+@benchmark("backends")
+def bench_backends(repeat: int = 20, k: int = 10):
+    """Compare the vector index backends on the whole dataset embedded with the local
+    `HashingEmbeddings`: disk footprint, cold start (import and open) in a fresh process,
+    query latency, peak memory (RSS, Unix only), and the overlap of their top-k.
+    """
+    embeddings = HashingEmbeddings()
+    queries = [item["query"] for item in load_retrieval_queries()]
+    vectors = embeddings.embed_documents(queries) * repeat
+    directories = {}
+    try:
+        for backend in VECTOR_BACKENDS:
+            directories[backend] = tempfile.mkdtemp(prefix=f"bench_{backend}_")
+            create_vectorstore(
+                persist_directory=directories[backend],
+                embeddings=embeddings,
+                embedding_model="hashing",
+                backend=backend,
+            )
+        for backend, persist_directory in directories.items():
+            result = probe_backend(backend, persist_directory, vectors, k, SHARDING)
+            durations = result["queries_ms"]
+            logger.info(
+                f"{backend}: {directory_size(persist_directory) / 1e6:.1f} MB on disk, "
+                f"import {result['import_ms']:.0f} ms, open {result['open_ms']:.0f} ms, "
+                f"first query {result['first_query_ms']:.2f} ms, then p50 {statistics.median(durations):.2f} ms, "
+                f"p95 {statistics.quantiles(durations, n=20)[-1]:.2f} ms, peak RSS {result['max_rss_mb']:.0f} MB",
+            )
+        indexes = {
+            backend: PokemonRetriever(persist_directory=persist_directory, backend=backend).vector_index
+            for backend, persist_directory in directories.items()
+        }
+        overlaps = []
+        for vector in vectors[:len(queries)]:
+            top = [{doc_key(doc) for doc, _ in index.search(vector, k=k)} for index in indexes.values()]
+            overlaps.append(len(top[0] & top[1]) / k)
+        logger.info(f"Overlap of the top-{k} of {' and '.join(indexes)}: {statistics.mean(overlaps):.2f}")
+    finally:
+        for persist_directory in directories.values():
+            shutil.rmtree(persist_directory, ignore_errors=True)
+
+
+@benchmark("quantization")
+def bench_quantization(repeat: int = 20, k: int = 10, scale: int = 10):
+    """Compare the quantization modes of the NumPy backend on the whole dataset embedded with
+    the local `HashingEmbeddings`: size of the scanned data, query latency and peak memory
+    (RSS, Unix only) in a fresh process, and recall@10 against the exact float32 search.
+    The store is built once; switching the mode only recomputes the codes.
+    The latency and recall are then measured in memory on a store `scale` times bigger
+    (noisy copies of the chunks), as the dataset grows with more generations.
+    """
+    embeddings = HashingEmbeddings()
+    queries = [item["query"] for item in load_retrieval_queries()]
+    vectors = embeddings.embed_documents(queries)
+    persist_directory = tempfile.mkdtemp(prefix="bench_numpy_")
+    exact = None
+    try:
+        for quantization in QUANTIZATIONS:
+            start = time.perf_counter()
+            create_vectorstore(
+                persist_directory=persist_directory,
+                embeddings=embeddings,
+                embedding_model="hashing",
+                backend="numpy",
+                quantization=quantization,
+                sharding="none",
+            )
+            build_seconds = time.perf_counter() - start
+            index = open_vector_index("numpy", persist_directory)
+            top = [[doc_key(doc) for doc, _ in index.search(vector, k=k)] for vector in vectors]
+            exact = exact or top
+            recall = statistics.mean(len(set(a) & set(b)) / k for a, b in zip(top, exact, strict=True))
+            scanned = index.codes if index.codes is not None else index.vectors
+            result = probe_backend("numpy", persist_directory, vectors * repeat, k)
+            durations = result["queries_ms"]
+            logger.info(
+                f"{quantization}: scans {scanned.nbytes / 1e6:.1f} MB ({scanned.dtype}), "
+                f"{'built' if quantization == 'none' else 'encoded'} in {build_seconds:.1f} s, "
+                f"p50 {statistics.median(durations):.2f} ms, p95 {statistics.quantiles(durations, n=20)[-1]:.2f} ms, "
+                f"peak RSS {result['max_rss_mb']:.0f} MB, recall@{k} {recall:.3f}",
+            )
+        bench_quantization_scale(np.asarray(index.vectors, dtype=np.float32), vectors, repeat, k, scale)
+    finally:
+        shutil.rmtree(persist_directory, ignore_errors=True)
+
+
+def bench_quantization_scale(base: np.ndarray, vectors: list[list[float]], repeat: int, k: int, scale: int):
+    """Search latency and recall@k of every quantization mode on `scale` noisy copies of `base`."""
+    rng = np.random.default_rng(0)
+    large = NumpyIndex(tempfile.gettempdir())  # kept in memory, never persisted
+    large.vectors = np.zeros((0, 0), dtype=np.float32)
+    rows = np.concatenate([base + rng.normal(0, 0.01, base.shape).astype(np.float32) for _ in range(scale)])
+    large.upsert(
+        [f"chunk:{row}" for row in range(len(rows))],
+        rows,
+        [""] * len(rows),
+        [{} for _ in range(len(rows))],
+    )
+    exact = None
+    for quantization in QUANTIZATIONS:
+        large.quantization = quantization
+        large.codes = None
+        if quantization != "none":
+            large.quantize()
+        top = [[doc.id for doc, _ in large.search(vector, k=k)] for vector in vectors]
+        exact = exact or top
+        recall = statistics.mean(len(set(a) & set(b)) / k for a, b in zip(top, exact, strict=True))
+        durations = time_calls(lambda vector: large.search(vector, k=k), vectors, repeat)
+        scanned = large.codes if large.codes is not None else large.vectors
+        logger.info(
+            f"{quantization} x{scale} ({len(rows)} chunks): scans {scanned.nbytes / 1e6:.1f} MB, "
+            f"p50 {statistics.median(durations):.2f} ms, p95 {statistics.quantiles(durations, n=20)[-1]:.2f} ms, "
+            f"recall@{k} {recall:.3f}",
+        )
+
+
+# Run in a fresh interpreter by the snapshot benchmark: open a store the way the Streamlit
+# application does, answer a first question (its vector read from stdin), and print the timings
+SNAPSHOT_PROBE = """
+import json, os, sys, time, zipfile
+
+start = time.perf_counter()
+from RAG.retriever import PokemonRetriever
+imported = time.perf_counter()
+job = json.load(sys.stdin)
+if job["mode"] == "zip":
+    with zipfile.ZipFile(job["path"]) as archive:
+        archive.extractall(job["directory"])
+    retriever = PokemonRetriever(job["directory"])
+else:
+    retriever = PokemonRetriever(job["path"], unpack_directory=job["directory"])
+warm_up = retriever.warm_up() if job["mode"] == "background" else None
+if warm_up is None:
+    retriever.vector_index
+docs = retriever.get_and_filter_docs(job["query"], embedding=job["embedding"])
+answered = time.perf_counter()
+if warm_up is not None:
+    warm_up.join()
+opened = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "first_answer_ms": (answered - imported) * 1000,
+    "opened_ms": (opened - imported) * 1000,
+    "documents": len(docs),
+}))
+"""
+
+
+def probe_snapshot(mode: str, path: str, directory: str, query: str, embedding: list[float]) -> dict:
+    """Cold start of the application in a new Python process: `mode` "zip" unpacks a zip of
+    the store then opens it, "snapshot" opens a snapshot (unpacked first for Chroma), and
+    "background" opens a snapshot in the background while answering.
+    """
+    shutil.rmtree(directory, ignore_errors=True)
+    result = subprocess.run(
+        [sys.executable, "-c", SNAPSHOT_PROBE],
+        input=json.dumps({"mode": mode, "path": path, "directory": directory, "query": query, "embedding": embedding}),
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=PROJECT_DIR,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+@benchmark("snapshot")
+def bench_snapshot(repeat: int = 3, query: str = "quel Pokémon crache du feu ?"):
+    """Cold start of the Streamlit application with both backends, on the whole dataset
+    embedded with the local `HashingEmbeddings`: the store shipped as chroma_db.zip and
+    unpacked with `extractall`, against the store shipped as a snapshot, opened in place
+    (NumPy) or unpacked (Chroma), then in the background while answering from BM25.
+    Every cold start runs in a fresh process, best of `repeat`. Also measures the export
+    and the import of the snapshot.
+    """
+    embeddings = HashingEmbeddings()
+    embedding = embeddings.embed_query(query)
+    root = tempfile.mkdtemp(prefix="bench_snapshot_")
+    try:
+        for backend in VECTOR_BACKENDS:
+            persist_directory = os.path.join(root, f"{backend}_db")
+            zip_path = os.path.join(root, f"{backend}_db.zip")
+            snapshot_path = os.path.join(root, f"{backend}_db.snapshot")
+            unpack_directory = os.path.join(root, f"{backend}_unpacked")
+            create_vectorstore(
+                persist_directory=persist_directory,
+                embeddings=embeddings,
+                embedding_model="hashing",
+                backend=backend,
+            )
+            with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as archive:
+                for directory, _, filenames in os.walk(persist_directory):
+                    for filename in filenames:
+                        path = os.path.join(directory, filename)
+                        archive.write(path, os.path.relpath(path, persist_directory))
+            start = time.perf_counter()
+            export_snapshot(persist_directory, snapshot_path, backend)
+            export_ms = (time.perf_counter() - start) * 1000
+            start = time.perf_counter()
+            SnapshotReader(snapshot_path).extract(unpack_directory)
+            import_ms = (time.perf_counter() - start) * 1000
+            logger.info(
+                f"{backend}: store {directory_size(persist_directory) / 1e6:.1f} MB, zip {os.path.getsize(zip_path) / 1e6:.1f} MB, "
+                f"snapshot {os.path.getsize(snapshot_path) / 1e6:.1f} MB exported in {export_ms:.0f} ms, "
+                f"imported in {import_ms:.0f} ms",
+            )
+            for mode, path in (("zip", zip_path), ("snapshot", snapshot_path), ("background", snapshot_path)):
+                runs = [probe_snapshot(mode, path, unpack_directory, query, embedding) for _ in range(repeat)]
+                best = min(runs, key=lambda run: run["first_answer_ms"])
+                logger.info(
+                    f"{backend} {mode}: first answer {best['first_answer_ms']:.0f} ms ({best['documents']} documents), "
+                    f"store opened {best['opened_ms']:.0f} ms, import {best['import_ms']:.0f} ms",
+                )
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+# Number of Pokémon of every generation, for the synthetic corpus of the shards benchmark
+GENERATION_SIZES = (151, 100, 135, 107, 156, 72, 88, 96, 120)
+
+
+def synthetic_generation(
+    generation: int,
+    chunks_per_pokemon: int,
+    rng: np.random.Generator,
+    size: int = 768,
+) -> tuple[list[str], np.ndarray, list[str], list[dict]]:
+    """Chunks of a fake generation: every Pokémon has a random direction and its chunks are
+    noisy copies of it, so the nearest chunks of a query are mostly those of one Pokémon.
+    """
+    pokemon = [f"g{generation}p{number}" for number in range(GENERATION_SIZES[generation - 1])]
+    centers = rng.standard_normal((len(pokemon), size)).astype(np.float32)
+    vectors = np.repeat(centers, chunks_per_pokemon, axis=0)
+    vectors += 1.5 * rng.standard_normal(vectors.shape).astype(np.float32)
+    metadatas = [
+        {"source": name, "pokemon": name, "generation": generation, "chunk": chunk}
+        for name in pokemon for chunk in range(chunks_per_pokemon)
+    ]
+    ids = [f"{metadata['source']}:{metadata['chunk']}" for metadata in metadatas]
+    return ids, vectors, [f"{metadata['pokemon']} - chunk {metadata['chunk']}" for metadata in metadatas], metadatas
+
+
+@benchmark("shards")
+def bench_shards(chunks_per_pokemon: int = 24, queries: int = 50, repeat: int = 3, k: int = 10):
+    """Search latency as generations are added, on a synthetic corpus of 9 generations
+    (GENERATION_SIZES Pokémon of `chunks_per_pokemon` chunks each, random vectors), with
+    both backends: one index for the whole store, against one index per generation with
+    the queries fanned out to every shard, or routed by the generation named in the question
+    ("génération 3"). Also reports the overlap of the top-k of the routed search with the
+    top-k of the whole store. The fan-out runs the shards in parallel threads, so it only
+    gains on a machine with several cores.
+    """
+    rng = np.random.default_rng(0)
+    generations = [synthetic_generation(generation, chunks_per_pokemon, rng) for generation in range(1, 10)]
+    root = tempfile.mkdtemp(prefix="bench_shards_")
+    try:
+        for backend in VECTOR_BACKENDS:
+            flat = open_vector_index(backend, os.path.join(root, f"{backend}_flat"), sharding="none")
+            sharded = open_vector_index(backend, os.path.join(root, f"{backend}_sharded"), sharding="generation")
+            for count, (ids, vectors, documents, metadatas) in enumerate(generations, start=1):
+                for index in (flat, sharded):
+                    for start in range(0, len(ids), 1000):
+                        end = start + 1000
+                        index.upsert(ids[start:end], vectors[start:end].tolist(), documents[start:end], metadatas[start:end])
+                # questions about a random chunk of the generations loaded so far
+                picks = []
+                for _ in range(queries):
+                    generation = int(rng.integers(1, count + 1))
+                    picks.append((generation, int(rng.integers(len(generations[generation - 1][0])))))
+                questions = [
+                    (
+                        f"Pokémon de la génération {generation}",
+                        (generations[generation - 1][1][row] + rng.standard_normal(768).astype(np.float32)).tolist(),
+                    )
+                    for generation, row in picks
+                ]
+                modes = {
+                    "flat": lambda question, index=flat: index.search(question[1], k),
+                    "fan-out": lambda question, index=sharded: index.search(question[1], k),
+                    "routed": lambda question, index=sharded: index.search(
+                        question[1], k, generations=detect_generations(question[0]),
+                    ),
+                }
+                latencies = {mode: statistics.median(time_calls(search, questions, repeat)) for mode, search in modes.items()}
+                overlap = statistics.mean(
+                    len({doc.id for doc, _ in modes["flat"](question)} & {doc.id for doc, _ in modes["routed"](question)}) / k
+                    for question in questions
+                )
+                logger.info(
+                    f"{backend}, {count} generation(s), {flat.count()} chunks: p50 "
+                    + ", ".join(f"{mode} {ms:.2f} ms" for mode, ms in latencies.items())
+                    + f", routed top-{k} overlap {overlap:.2f}",
+                )
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
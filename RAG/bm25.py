@@ -0,0 +1,162 @@
+import json
+import math
+import os
+import re
+import unicodedata
+from collections import Counter, defaultdict
+
+import numpy as np
+from langchain.docstore.document import Document
+
+BM25_FILENAME = "bm25_index.json"
+BM25_K1 = 1.5
+BM25_B = 0.75
+# Query terms found in more than this share of the chunks barely change the ranking and are skipped
+MAX_DOCUMENT_FREQUENCY = 0.5
+
+TOKEN = re.compile(r"\w+")
+STOPWORDS = {
+    "a", "au", "aux", "c", "ce", "ces", "cette", "d", "dans", "de", "des", "du", "elle", "en", "est",
+    "et", "il", "j", "l", "la", "le", "les", "leur", "n", "ne", "nom", "ou", "par", "pas", "plus",
+    "pour", "qu", "que", "quel", "quelle", "quelles", "quels", "qui", "s", "sa", "se", "ses", "son",
+    "sont", "sur", "t", "un", "une", "y",
+}
+
+
+def fold(text: str) -> str:
+    """Case-fold a text and strip its accents, so that "Salamèche" and "salameche" match."""
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def tokenize(text: str) -> list[str]:
+    """Split a French text into folded tokens, without the stopwords."""
+    return [token for token in TOKEN.findall(fold(text)) if token not in STOPWORDS]
+
+
+def bm25_index_path(persist_directory: str) -> str:
+    """Path of the BM25 index, stored next to the vector store it mirrors."""
+    return os.path.join(persist_directory, BM25_FILENAME)
+
+
+class BM25Index:
+    """In-memory BM25 inverted index over the chunks of the vector store."""
+
+    def __init__(
+        self,
+        ids: list[str],
+        documents: list[str],
+        metadatas: list[dict],
+        postings: dict[str, list[list[int]]] | None = None,
+        lengths: list[int] | None = None,
+    ):
+        self.ids = ids
+        self.documents = documents
+        self.metadatas = metadatas
+        if postings is None:
+            postings, lengths = defaultdict(list), []
+            for index, text in enumerate(documents):
+                tokens = tokenize(text)
+                lengths.append(len(tokens))
+                for token, count in Counter(tokens).items():
+                    postings[token].append([index, count])
+        self.postings = dict(postings)
+        self.lengths = lengths
+        self.average_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0.0
+        lengths = np.array(self.lengths, dtype=np.float32)
+        self.norms = BM25_K1 * (1 - BM25_B + BM25_B * lengths / (self.average_length or 1.0))
+        self.idf = {
+            token: math.log(1 + (len(documents) - len(postings) + 0.5) / (len(postings) + 0.5))
+            for token, postings in self.postings.items()
+        }
+        self._impacts_cache = {}
+        chunks = defaultdict(list)
+        for index, metadata in enumerate(metadatas):
+            if "pokemon" in metadata:
+                chunks[metadata["pokemon"]].append(index)
+        self.pokemon_chunks = {
+            pokemon: np.array(sorted(indices, key=lambda index: metadatas[index].get("chunk", 0)), dtype=np.int32)
+            for pokemon, indices in chunks.items()
+        }
+
+    def _impacts(self, token: str) -> tuple[np.ndarray, np.ndarray]:
+        """Chunk indices and BM25 contributions of a token, computed on first use."""
+        impacts = self._impacts_cache.get(token)
+        if impacts is None:
+            postings = np.array(self.postings[token], dtype=np.int32)
+            indices, counts = postings[:, 0], postings[:, 1].astype(np.float32)
+            weights = self.idf[token] * counts * (BM25_K1 + 1) / (counts + self.norms[indices])
+            impacts = self._impacts_cache[token] = (indices, weights)
+        return impacts
+
+    def search(self, query: str, k: int = 10, pokemon: list[str] | None = None) -> list[tuple[Document, float]]:
+        """Return the `k` best chunks for the query with their BM25 score,
+        only among the chunks of the given Pokémon if `pokemon` is set.
+        """
+        scores = np.zeros(len(self.documents), dtype=np.float32)
+        max_postings = MAX_DOCUMENT_FREQUENCY * len(self.documents)
+        matched = False
+        for token in set(tokenize(query)):
+            postings = self.postings.get(token)
+            if not postings or len(postings) > max_postings:
+                continue
+            indices, weights = self._impacts(token)
+            scores[indices] += weights
+            matched = True
+        if not matched:
+            return []
+        if pokemon is not None:
+            allowed = np.zeros(len(self.documents), dtype=bool)
+            for name in pokemon:
+                allowed[self.pokemon_chunks.get(name, [])] = True
+            scores[~allowed] = 0.0
+        k = min(k, int(np.count_nonzero(scores)))
+        if k == 0:
+            return []
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        return [(self.document(index), float(scores[index])) for index in best]
+
+    def max_score(self, query: str) -> float:
+        """Upper bound of the BM25 score of a chunk for the query, every term of the query being
+        found many times; the terms unknown to the corpus count as the rarest ones. The score of
+        a chunk divided by it is the share of the query the chunk covers, between 0 and 1.
+        """
+        max_postings = MAX_DOCUMENT_FREQUENCY * len(self.documents)
+        rarest = math.log(1 + (len(self.documents) + 0.5) / 0.5)
+        total = 0.0
+        for token in set(tokenize(query)):
+            postings = self.postings.get(token)
+            if postings and len(postings) > max_postings:
+                continue
+            total += (self.idf[token] if postings else rarest) * (BM25_K1 + 1)
+        return total
+
+    def document(self, index: int) -> Document:
+        """The chunk at `index` as a LangChain document."""
+        return Document(page_content=self.documents[index], metadata=self.metadatas[index], id=self.ids[index])
+
+    def save(self, path: str):
+        """Write the index, chunks and postings, to a JSON file."""
+        data = {
+            "ids": self.ids,
+            "documents": self.documents,
+            "metadatas": self.metadatas,
+            "postings": self.postings,
+            "lengths": self.lengths,
+        }
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        """Load an index saved with `save`."""
+        with open(path, encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "BM25Index":
+        """Build an index from the content of a file written by `save`."""
+        return cls(data["ids"], data["documents"], data["metadatas"], data["postings"], data["lengths"])
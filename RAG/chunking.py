@@ -0,0 +1,49 @@
+import os
+
+from langchain.docstore.document import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from .download_dataset import pokemon_generation, pokemon_number
+
+CHUNK_SIZE = 1500
+CHUNK_OVERLAP = 150
+INTRO_SECTION = "Présentation"
+# Version of the chunking, recorded in the ingestion manifest: changing it rebuilds the store
+CHUNKING_VERSION = 2
+
+
+def page_pokemon(source: str) -> str:
+    """Name of the Pokémon of a page, as stored in the metadata: the file name without extension."""
+    return os.path.splitext(os.path.basename(source))[0]
+
+
+def chunk_sections(
+    sections: list[tuple[str, str]],
+    source: str,
+    chunk_size: int = CHUNK_SIZE,
+    chunk_overlap: int = CHUNK_OVERLAP,
+) -> list[Document]:
+    """Cut every section into chunks of at most `chunk_size` characters.
+    Each chunk starts with the Pokémon name and the section title, so it can be matched on its own,
+    and carries them in its metadata along with the generation and the national Pokédex number
+    of the Pokémon.
+    """
+    pokemon = page_pokemon(source)
+    generation = pokemon_generation(pokemon)
+    number = pokemon_number(pokemon)
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    chunks = []
+    for section, body in sections:
+        for text in splitter.split_text(body):
+            metadata = {
+                "source": source,
+                "pokemon": pokemon,
+                "section": section,
+                "chunk": len(chunks),
+            }
+            if generation is not None:
+                metadata["generation"] = generation
+            if number is not None:
+                metadata["number"] = number
+            chunks.append(Document(page_content=f"{pokemon} - {section}\n{text}", metadata=metadata))
+    return chunks
@@ -0,0 +1,229 @@
+import logging
+import threading
+import zlib
+
+import numpy as np
+from langchain.docstore.document import Document
+
+from .bm25 import TOKEN, fold, tokenize
+from .retriever import estimate_tokens
+from .tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Tokens of the context of a prompt, the only budget applied to the retrieved chunks
+CONTEXT_TOKEN_BUDGET = 2000
+# Weight of the relevance against the novelty in the MMR selection of the passages
+MMR_LAMBDA = 0.7
+# Share of the relevance given by the rank of the chunk, the rest by the words of the question
+RANK_WEIGHT = 0.5
+# A passage is a near duplicate when this share of its shingles is in a passage already kept
+DUPLICATE_THRESHOLD = 0.8
+SHINGLE_SIZE = 3
+MINHASH_PERMUTATIONS = 64
+MINHASH_SEED = 42
+DOCUMENT_SEPARATOR = "\n\n"
+
+
+def split_passages(doc: Document) -> tuple[str, list[tuple[str, list[str]]]]:
+    """The header of a chunk ("Pokémon - Section", see `chunk_sections`) and its passages:
+    the non-empty lines, which are the paragraphs and table rows of the page, with their
+    folded words.
+    """
+    lines = doc.page_content.splitlines()
+    folded = fold(doc.page_content).splitlines()  # one call for the whole chunk
+    if len(folded) != len(lines):
+        folded = [fold(line) for line in lines]
+    header = lines[0].strip() if doc.metadata.get("section") and lines else ""
+    passages = [(line.strip(), TOKEN.findall(words)) for line, words in zip(lines, folded, strict=True)]
+    return header, [passage for passage in passages[1 if header else 0:] if passage[0]]
+
+
+def shingle_hashes(words: list[str], size: int = SHINGLE_SIZE) -> np.ndarray:
+    """Hashes of the distinct runs of `size` words of a passage (all its words if there are fewer)."""
+    shingles = {" ".join(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+    return np.fromiter((zlib.crc32(shingle.encode("utf-8")) for shingle in shingles), dtype=np.uint64)
+
+
+class MinHasher:
+    """MinHash signatures: the minimum of the shingle hashes under `permutations` random
+    hash functions. Two signatures agree on a share of their values that estimates the
+    Jaccard similarity of the two sets of shingles.
+    """
+
+    def __init__(self, permutations: int = MINHASH_PERMUTATIONS, seed: int = MINHASH_SEED):
+        rng = np.random.default_rng(seed)
+        # multiply-shift hashing: (a * x + b) mod 2^64, keeping the high 32 bits
+        self.a = rng.integers(1, 2**63, size=permutations, dtype=np.uint64) | np.uint64(1)
+        self.b = rng.integers(0, 2**63, size=permutations, dtype=np.uint64)
+
+    def signatures(self, hashes: list[np.ndarray]) -> np.ndarray:
+        """Signature of every non-empty set of shingle hashes, one row per set."""
+        offsets = np.cumsum([0] + [values.size for values in hashes[:-1]])
+        permuted = (np.outer(np.concatenate(hashes), self.a) + self.b) >> np.uint64(32)
+        return np.minimum.reduceat(permuted, offsets, axis=0).astype(np.uint32)
+
+
+def containment(jaccard: np.ndarray, sizes: np.ndarray) -> np.ndarray:
+    """Share of the shingles of every set found in every other set, `[i, j]` for set i in
+    set j, from their estimated Jaccard similarities and their sizes.
+    """
+    rows, columns = sizes[:, None], sizes[None, :]
+    return np.minimum(1.0, jaccard * (rows + columns) / ((1 + jaccard) * rows))
+
+
+class ContextCompressor:
+    """Build the context of the prompt from the retrieved chunks, within a token budget.
+
+    The chunks are split into passages (lines). Near duplicates (overlap between consecutive
+    chunks, navigation and table rows repeated across pages) are dropped using MinHash
+    signatures of their word shingles. The remaining passages are picked by maximal marginal
+    relevance: relevant to the question (rank of their chunk, words of the question) and
+    different from the passages already picked, until `token_budget` is reached. The picked
+    passages are given back in their chunk, in the order of the chunks and of the page.
+    """
+
+    def __init__(
+        self,
+        token_budget: int = CONTEXT_TOKEN_BUDGET,
+        mmr_lambda: float = MMR_LAMBDA,
+        rank_weight: float = RANK_WEIGHT,
+        duplicate_threshold: float = DUPLICATE_THRESHOLD,
+        permutations: int = MINHASH_PERMUTATIONS,
+    ):
+        self.token_budget = token_budget
+        self.mmr_lambda = mmr_lambda
+        self.rank_weight = rank_weight
+        self.duplicate_threshold = duplicate_threshold
+        self.minhasher = MinHasher(permutations)
+        self.requests = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self._lock = threading.Lock()
+
+    def deduplicate(self, words: list[list[str]]) -> tuple[np.ndarray, np.ndarray]:
+        """Indexes of the passages (given by their words) kept after dropping the near
+        duplicates of the ones before them, or of the ones after them when these contain them,
+        and the estimated Jaccard similarities of all the passages.
+        """
+        hashes = [shingle_hashes(passage) for passage in words]
+        signatures = self.minhasher.signatures(hashes)
+        agreements = (signatures[:, None, :] == signatures[None, :, :]).sum(axis=2, dtype=np.uint16)
+        jaccard = agreements / signatures.shape[1]
+        duplicate = containment(jaccard, np.array([values.size for values in hashes])) >= self.duplicate_threshold
+        kept = np.zeros(len(words), dtype=bool)
+        for index in range(len(words)):
+            if not (duplicate[index] & kept).any():
+                kept &= ~duplicate[:, index]
+                kept[index] = True
+        return np.flatnonzero(kept), jaccard
+
+    def select(
+        self,
+        relevance: np.ndarray,
+        similarities: np.ndarray,
+        costs: list[int],
+        groups: list[int],
+        group_costs: list[int],
+    ) -> list[int]:
+        """Pick passages by maximal marginal relevance while they fit in the token budget.
+        The redundancy of a passage is its highest similarity with the ones already picked.
+        A passage costs its tokens, plus `group_costs` for the first one picked in its group
+        (the header of its chunk).
+        """
+        selected, paid = [], set()
+        remaining = np.ones(len(relevance), dtype=bool)
+        redundancy = np.zeros(len(relevance))
+        budget = self.token_budget
+        while remaining.any():
+            scores = self.mmr_lambda * relevance - (1 - self.mmr_lambda) * redundancy
+            scores[~remaining] = -np.inf
+            best = int(np.argmax(scores))
+            remaining[best] = False
+            cost = costs[best] + (group_costs[groups[best]] if groups[best] not in paid else 0)
+            if cost > budget:
+                continue
+            budget -= cost
+            paid.add(groups[best])
+            selected.append(best)
+            redundancy = np.maximum(redundancy, similarities[best])
+        return selected
+
+    def compress(self, docs: list[Document], query: str) -> list[Document]:
+        """The retrieved chunks reduced to their passages selected for the prompt, in the
+        same order. Chunks with no passage left are dropped.
+        """
+        headers, passages, words, owners = [], [], [], []
+        for rank, doc in enumerate(docs):
+            header, doc_passages = split_passages(doc)
+            headers.append(header)
+            for passage, passage_words in doc_passages:
+                passages.append(passage)
+                words.append(passage_words)
+                owners.append(rank)
+        if not passages:
+            return []
+        kept, jaccard = self.deduplicate(words)
+
+        query_words = set(tokenize(query))
+        relevance = np.array([
+            self.rank_weight * (1 - owners[index] / len(docs))
+            + (1 - self.rank_weight) * (
+                len(query_words.intersection(words[index])) / len(query_words) if query_words else 0.0
+            )
+            for index in kept
+        ])
+        selected = self.select(
+            relevance,
+            jaccard[np.ix_(kept, kept)],
+            [estimate_tokens(passages[index]) + 1 for index in kept],  # + 1 for the line break
+            [owners[index] for index in kept],
+            [estimate_tokens(header) + 1 if header else 0 for header in headers],
+        )
+        lines = [[] for _ in docs]
+        for position in sorted(selected):
+            lines[owners[kept[position]]].append(passages[kept[position]])
+        return [
+            Document(page_content="\n".join([header, *doc_lines] if header else doc_lines), metadata=doc.metadata, id=doc.id)
+            for doc, header, doc_lines in zip(docs, headers, lines, strict=True)
+            if doc_lines
+        ]
+
+    def assemble(self, docs: list[Document], query: str) -> str:
+        """The context of the prompt for the question. The tokens it saves are added to `stats`."""
+        with span("context", documents=len(docs)) as context_span:
+            context = DOCUMENT_SEPARATOR.join(doc.page_content for doc in self.compress(docs, query))
+            input_tokens = estimate_tokens(DOCUMENT_SEPARATOR.join(doc.page_content for doc in docs))
+            output_tokens = estimate_tokens(context)
+            context_span.set(input_tokens=input_tokens, output_tokens=output_tokens)
+        with self._lock:
+            self.requests += 1
+            self.input_tokens += input_tokens
+            self.output_tokens += output_tokens
+        logger.debug(f"Context of {len(docs)} chunks compressed from {input_tokens} to {output_tokens} tokens.")
+        return context
+
+    def stats(self) -> dict:
+        """Tokens of the retrieved chunks and of the contexts built from them since the start."""
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "input_tokens": self.input_tokens,
+                "output_tokens": self.output_tokens,
+                "saved_tokens": self.input_tokens - self.output_tokens,
+                "saved_rate": 1 - self.output_tokens / self.input_tokens if self.input_tokens else 0.0,
+            }
+
+
+_context_compressor: ContextCompressor | None = None
+_context_compressor_lock = threading.Lock()
+
+
+def get_context_compressor() -> ContextCompressor:
+    """Return the process-wide context compressor, with the default budget."""
+    global _context_compressor
+    if _context_compressor is None:
+        with _context_compressor_lock:
+            if _context_compressor is None:
+                _context_compressor = ContextCompressor()
+    return _context_compressor
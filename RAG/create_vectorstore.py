@@ -1,26 +1,219 @@
-from dotenv import load_dotenv
-from langchain_chroma import Chroma
-from langchain_community.document_loaders import DirectoryLoader, UnstructuredHTMLLoader
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
+import itertools
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
 
-load_dotenv()
+from langchain.docstore.document import Document
+from langchain_core.embeddings import Embeddings
 
-def create_vectorstore():
-    """Creates a vector store from the downloaded HTML files in the 'pokemon_dataset' directory.
-    The vector store is created using LangChain's Chroma and GoogleGenerativeAIEmbeddings.
+from .bm25 import BM25Index, bm25_index_path
+from .chunking import CHUNKING_VERSION, chunk_sections, page_pokemon
+from .embedding_cache import init_embeddings
+from .embedding_scheduler import EmbeddingScheduler
+from .extract import article_sections, parse_article
+from .facts import FactStore, extract_facts, facts_path, page_facts
+from .manifest import diff_pages, file_hash, load_manifest, save_manifest
+from .retriever import EMBEDDING_MODEL, PERSIST_DIRECTORY
+from .settings import SHARDING, VECTOR_BACKEND
+from .vector_index import ChromaIndex, NumpyIndex, ShardedIndex, open_vector_index
+
+logger = logging.getLogger(__name__)
+
+DATASET_DIR = "pokemon_dataset"
+PAGE_BATCH_SIZE = 16
+STAGES = ("parse", "clean", "embed", "write")
+
+
+def list_pages(dataset_dir: str = DATASET_DIR) -> list[str]:
+    """List the HTML pages of the dataset, in a stable order."""
+    return sorted(
+        os.path.join(dataset_dir, filename)
+        for filename in os.listdir(dataset_dir)
+        if filename.endswith(".html")
+    )
+
+
+def parse_page(path: str) -> tuple[list[Document], dict[str, str], dict[str, float]]:
+    """Parse and chunk one page, returning the chunks, the Pokédex facts of the page and
+    the time spent in each stage.
+    This runs in the worker processes, so it must stay a module-level function.
     """
-    loader = DirectoryLoader("./pokemon_dataset/", loader_cls=UnstructuredHTMLLoader)
-    docs = loader.load()
-    # Extract the text from the website data document
-    for doc in docs:
-        text_content = doc.page_content
-        text_content = text_content.replace("[modifier]", "")
-        text_content = "№" + text_content.split("№")[1]
-        text_content = text_content.split("Dans le Jeu de Cartes à Collectionner")[0]
-        doc.page_content = "".join(text_content)
-    gemini_embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
-    Chroma.from_documents(
-        documents=docs,
-        embedding=gemini_embeddings,
-        persist_directory="./chroma_db",
+    start = time.perf_counter()
+    content = parse_article(path)
+    sections = article_sections(content) if content is not None else []
+    facts = extract_facts(content) if content is not None else {}
+    parsed = time.perf_counter()
+    chunks = chunk_sections(sections, path)
+    return chunks, facts, {"parse": parsed - start, "clean": time.perf_counter() - parsed}
+
+
+def iter_parsed_pages(paths: list[str], workers: int = 1):
+    """Yield the result of `parse_page` for each path, in the order of `paths`
+    whatever the number of worker processes.
+    """
+    if workers <= 1:
+        yield from map(parse_page, paths)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(parse_page, paths, chunksize=4)
+
+
+def chunk_id(chunk: Document) -> str:
+    """Stable id of a chunk in the vector store."""
+    return f"{chunk.metadata['source']}:{chunk.metadata['chunk']}"
+
+
+def build_bm25_index(vector_index: ChromaIndex | NumpyIndex | ShardedIndex, persist_directory: str = PERSIST_DIRECTORY):
+    """Rebuild the BM25 index from every chunk of the vector store and save it next to it."""
+    ids, documents, metadatas = vector_index.get_all()
+    order = sorted(range(len(ids)), key=lambda i: ids[i])
+    index = BM25Index(
+        [ids[i] for i in order],
+        [documents[i] for i in order],
+        [metadatas[i] for i in order],
+    )
+    index.save(bm25_index_path(persist_directory))
+    logger.info(f"BM25 index built over {len(order)} chunks.")
+
+
+def create_vectorstore(
+    workers: int = 1,
+    persist_directory: str = PERSIST_DIRECTORY,
+    dataset_dir: str = DATASET_DIR,
+    embedding_model: str = EMBEDDING_MODEL,
+    embeddings: Embeddings | None = None,
+    backend: str = VECTOR_BACKEND,
+    vector_dtype: str = "float32",
+    quantization: str = "none",
+    sharding: str = SHARDING,
+    **scheduler_options,
+):
+    """Creates or updates the vector store from the downloaded HTML pages of `dataset_dir`.
+    Only new or changed pages are parsed (by `workers` processes) and embedded (through an
+    `EmbeddingScheduler` configured by `scheduler_options`), as recorded by the ingestion manifest; the BM25
+    index and the fact table are kept in sync. The vectors are stored with `backend` and
+    `sharding` (see `open_vector_index`); changing them, the embedding model or the chunking
+    rebuilds the store.
+    """
+    paths = list_pages(dataset_dir)
+    gemini_embeddings = embeddings or init_embeddings(embedding_model)
+    scheduler = EmbeddingScheduler(gemini_embeddings, **scheduler_options)
+
+    manifest = load_manifest(persist_directory)
+    layout = None
+    if manifest is not None:
+        layout = (manifest.get("backend", "chroma"), manifest.get("sharding", "none"))
+        if layout != (backend, sharding):
+            # Remove the index of the previous layout, so it is not left behind in the store
+            logger.warning(
+                f"The store was built with the {layout[0]} backend and sharding {layout[1]}, not {backend} "
+                f"and sharding {sharding}: removing its index, every chunk will be embedded again...",
+            )
+            open_vector_index(layout[0], persist_directory, gemini_embeddings, sharding=layout[1]).drop()
+    vector_index = open_vector_index(
+        backend, persist_directory, gemini_embeddings, vector_dtype, quantization, sharding=sharding,
+    )
+    if (
+        manifest is None
+        or manifest["embedding_model"] != embedding_model
+        or layout != (backend, sharding)
+        or manifest.get("chunking", 1) != CHUNKING_VERSION
+    ):
+        if vector_index.count():
+            logger.info("The vector store has no matching ingestion manifest, rebuilding it from scratch...")
+            vector_index.reset()
+        manifest = {
+            "embedding_model": embedding_model,
+            "backend": backend,
+            "sharding": sharding,
+            "chunking": CHUNKING_VERSION,
+            "pages": {},
+        }
+
+    hashes = {path: file_hash(path) for path in paths}
+    changed, removed = diff_pages(manifest, hashes)
+    facts_missing = not os.path.exists(facts_path(persist_directory))
+    os.makedirs(persist_directory, exist_ok=True)
+    fact_store = FactStore(facts_path(persist_directory))
+    unchanged = [path for path in paths if path not in changed] if facts_missing else []
+    if unchanged:
+        fact_store.upsert({page_pokemon(path): page_facts(path) for path in unchanged})
+        logger.info(f"Fact table built for {len(unchanged)} unchanged page(s).")
+    for path in removed:
+        vector_index.delete(manifest["pages"].pop(path)["chunk_ids"])
+    fact_store.delete([page_pokemon(path) for path in removed])
+    if removed:
+        logger.info(f"Removed the chunks of {len(removed)} deleted page(s).")
+    if not changed:
+        if vector_index.dirty:
+            vector_index.persist()
+            logger.info(f"Vectors stored as {vector_dtype} with {quantization} quantization.")
+        if removed:
+            save_manifest(manifest, persist_directory)
+        if removed or not os.path.exists(bm25_index_path(persist_directory)):
+            build_bm25_index(vector_index, persist_directory)
+        logger.info("The vector store is up to date, no page to embed.")
+        return
+
+    timings = dict.fromkeys(STAGES, 0.0)
+    start = time.perf_counter()
+    pages_done = chunks_done = 0
+
+    logger.info(
+        f"Updating the vector store with {len(changed)}/{len(paths)} new or changed pages "
+        f"using {workers} worker(s)...",
+    )
+    parsed_pages = zip(changed, iter_parsed_pages(changed, workers))
+    for batch in itertools.batched(parsed_pages, PAGE_BATCH_SIZE):
+        chunks = []
+        for path, (page_chunks, _, page_timings) in batch:
+            if not page_chunks:
+                logger.warning(f"No article content found in '{path}', skipping it.")
+            chunks.extend(page_chunks)
+            for stage, seconds in page_timings.items():
+                timings[stage] += seconds
+
+        if chunks:
+            stage_start = time.perf_counter()
+            embeddings = scheduler.embed_documents([chunk.page_content for chunk in chunks])
+            timings["embed"] += time.perf_counter() - stage_start
+
+        stage_start = time.perf_counter()
+        for path, _ in batch:
+            vector_index.delete(manifest["pages"].get(path, {}).get("chunk_ids", []))
+        if chunks:
+            vector_index.upsert(
+                ids=[chunk_id(chunk) for chunk in chunks],
+                embeddings=embeddings,
+                documents=[chunk.page_content for chunk in chunks],
+                metadatas=[chunk.metadata for chunk in chunks],
+            )
+        for path, (page_chunks, _, _) in batch:
+            manifest["pages"][path] = {
+                "hash": hashes[path],
+                "chunk_ids": [chunk_id(chunk) for chunk in page_chunks],
+            }
+        fact_store.upsert({page_pokemon(path): facts for path, (_, facts, _) in batch})
+        vector_index.persist(quantize=False)
+        save_manifest(manifest, persist_directory)
+        timings["write"] += time.perf_counter() - stage_start
+
+        pages_done += len(batch)
+        chunks_done += len(chunks)
+        logger.info(f"{pages_done}/{len(changed)} pages processed, {chunks_done} chunks stored.")
+
+    if vector_index.dirty:
+        vector_index.persist()
+        logger.info(f"Vectors quantized ({quantization}).")
+    build_bm25_index(vector_index, persist_directory)
+    logger.info(f"Fact table: {fact_store.count()} Pokémon.")
+    logger.info(
+        f"Vector store updated in {time.perf_counter() - start:.2f} s. Time per stage "
+        "(parse and clean are summed over the workers): "
+        + ", ".join(f"{stage} {seconds:.2f} s" for stage, seconds in timings.items()),
+    )
+    logger.info(
+        f"Embedding requests: {scheduler.requests} ({scheduler.retries} retried after a rate limit). "
+        f"Embedding cache: {gemini_embeddings.stats() if hasattr(gemini_embeddings, 'stats') else '-'}",
     )
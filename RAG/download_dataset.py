@@ -1,13 +1,15 @@
 import hashlib
+import json
 import logging
 import os
-import shutil
+import re
 import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import quote
 
 import requests
-from bs4 import BeautifulSoup
 
 logger = logging.getLogger(__name__)
 
@@ -209,9 +211,20 @@ pokemon_gen2 = [
     ]
 ]
 
+# Pokémon names indexed by generation number
+POKEMON_BY_GENERATION = {
+    1: pokemon_gen[0],
+    2: pokemon_gen2[0],
+}
+
 BASE_URL = "https://www.pokepedia.fr/"
 HEADERS = {"User-Agent": "Pokebot/1.0 (+pokepedia.fr)"}
 OUTPUT_DIR = "pokemon_dataset"
+VALIDATORS_FILE = ".validators.json"
+MAX_WORKERS = 4
+POLITENESS_DELAY = 0.5  # minimum number of seconds between two requests to Poképédia
+TITLE_PATTERN = re.compile(r"<title>(.*?)</title>", re.IGNORECASE | re.DOTALL)
+DOWNLOAD_STATUSES = ("downloaded", "not_modified", "skipped", "failed")
 
 # Function to create a safe filename from a Pokémon name
 def safe_filename(name):
@@ -228,38 +241,140 @@ def safe_filename(name):
     return decoded
 
 
+# Function to find the generation of a Pokémon from its name or dataset filename
+def pokemon_generation(name):
+    for gen, pokemon_list in POKEMON_BY_GENERATION.items():
+        if name in pokemon_list or name in (safe_filename(p) for p in pokemon_list):
+            return gen
+    return None
+
+
+# Function to find the national Pokédex number of a Pokémon from its name or dataset filename
+# (the lists of POKEMON_BY_GENERATION are in Pokédex order, one generation after the other)
+def pokemon_number(name):
+    offset = 0
+    for _, pokemon_list in sorted(POKEMON_BY_GENERATION.items()):
+        for index, pokemon in enumerate(pokemon_list):
+            if name == pokemon or name == safe_filename(pokemon):
+                return offset + index + 1
+        offset += len(pokemon_list)
+    return None
+
+
+class PoliteLimiter:
+    """Spaces out the requests sent by all the download threads by at least `delay` seconds."""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self._next_request = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next_request - now
+            self._next_request = max(now, self._next_request) + self.delay
+        if wait > 0:
+            time.sleep(wait)
+
+
+# Function to create a pooled HTTP session shared by the download threads
+def create_session(workers=MAX_WORKERS):
+    session = requests.Session()
+    session.headers.update(HEADERS)
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# Functions to load and save the ETag / Last-Modified of the downloaded pages
+def load_validators():
+    path = os.path.join(OUTPUT_DIR, VALIDATORS_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_validators(validators):
+    write_atomically(
+        os.path.join(OUTPUT_DIR, VALIDATORS_FILE),
+        json.dumps(validators, ensure_ascii=False, indent=1),
+    )
+
+
+# Function to write a file through a temporary file, so a page is never left half written
+def write_atomically(filepath, content):
+    tmp_path = filepath + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(tmp_path, filepath)
+
+
 # Function to download a Pokémon page from Poképédia
-def download_pokemon_page(pokemon_name):
+def download_pokemon_page(pokemon_name, session=None, limiter=None, validators=None, refresh=False):
+    """Downloads the page of a Pokémon and returns what happened: "downloaded", "not_modified",
+    "skipped" (already present) or "failed".
+
+    Pages already present are skipped, unless `refresh` is set: a conditional request is then
+    sent with the stored ETag / Last-Modified so an unchanged page is answered with a 304.
+    """
+    session = session or create_session()
+    validators = {} if validators is None else validators
+    filename = safe_filename(pokemon_name)
+    filepath = os.path.join(OUTPUT_DIR, f"{filename}.html")
+    exists = os.path.exists(filepath)
+    if exists and not refresh:
+        return "skipped"
+
     # Encodage du nom pour l'URL
     encoded_name = quote(pokemon_name, safe="")
     url = BASE_URL + encoded_name
 
+    headers = {}
+    known = validators.get(filename, {}) if exists else {}
+    if known.get("etag"):
+        headers["If-None-Match"] = known["etag"]
+    if known.get("last_modified"):
+        headers["If-Modified-Since"] = known["last_modified"]
+
     try:
+        if limiter is not None:
+            limiter.wait()
         print(f"Téléchargement de : {url}")
-        response = requests.get(url, headers=HEADERS, timeout=10)
-        time.sleep(0.5)
+        response = session.get(url, headers=headers, timeout=10)
 
+        if response.status_code == 304:
+            print(f"Page inchangée : {filepath}")
+            return "not_modified"
         if response.status_code != 200:
             print(f"Échec ({response.status_code}) : {url}")
-            return
+            return "failed"
 
-        soup = BeautifulSoup(response.text, "html.parser")
-        page_title = soup.title.string if soup.title else "Sans titre"
+        match = TITLE_PATTERN.search(response.text)
+        page_title = match.group(1).strip() if match else "Sans titre"
         print("Titre de la page :", page_title)
 
-        filename = safe_filename(pokemon_name)
-        filepath = os.path.join(OUTPUT_DIR, f"{filename}.html")
-        with open(filepath, "w", encoding="utf-8") as f:
-            f.write(response.text)
+        write_atomically(filepath, response.text)
+        validators[filename] = {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
         print(f"Page enregistrée : {filepath}")
+        return "downloaded"
 
     except requests.RequestException as e:
         print(f"Erreur pour {pokemon_name} : {e}")
+        return "failed"
 
 
 # Function to download the dataset of Pokémon pages from Poképédia
-def download_dataset(gen=None):
-    """Downloads the dataset of Pokémon pages from Poképédia."""
+def download_dataset(gen=None, refresh=False, workers=MAX_WORKERS, delay=POLITENESS_DELAY):
+    """Downloads the dataset of Pokémon pages from Poképédia.
+    Pages are fetched by `workers` threads sharing one HTTP session, with at least `delay`
+    seconds between two requests. Pages already present are kept, see `download_pokemon_page`.
+    """
 
     if gen is None:
         logger.info("No generation specified, downloading Gen 1 and Gen 2 by default.")
@@ -275,21 +390,27 @@ def download_dataset(gen=None):
             sys.exit(1)
         gens_to_download = [gen]
 
-    if os.path.exists(OUTPUT_DIR):
-        logger.info(f"Clearing existing dataset directory: '{OUTPUT_DIR}'...")
-        shutil.rmtree(OUTPUT_DIR)
     os.makedirs(OUTPUT_DIR, exist_ok=True)
 
+    pokemon_to_download = []
     for gen in gens_to_download:
         logger.info(f"Downloading Pokémon dataset for generation {gen}...")
-        if gen == 1:
-            pokemon_list = pokemon_gen[0]
-        elif gen == 2:
-            pokemon_list = pokemon_gen2[0]
-        else:
+        pokemon_list = POKEMON_BY_GENERATION.get(gen)
+        if pokemon_list is None:
             logger.error(f"Sorry! Generation {gen} is not implemented yet.")
             continue
+        pokemon_to_download.extend(pokemon_list)
 
-        for pokemon in pokemon_list:
-            download_pokemon_page(pokemon)
-
+    session = create_session(workers)
+    limiter = PoliteLimiter(delay)
+    validators = load_validators()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(
+            lambda pokemon: download_pokemon_page(pokemon, session, limiter, validators, refresh),
+            pokemon_to_download,
+        ))
+    save_validators(validators)
+    logger.info(
+        "Dataset download finished: "
+        + ", ".join(f"{results.count(status)} {status}" for status in DOWNLOAD_STATUSES),
+    )
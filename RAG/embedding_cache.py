@@ -0,0 +1,140 @@
+import hashlib
+import sqlite3
+import sys
+import threading
+import time
+from array import array
+
+from langchain_core.embeddings import Embeddings
+
+from .tracing import count
+
+EMBEDDING_CACHE_PATH = "./embedding_cache.sqlite3"
+EMBEDDING_CACHE_MAX_ENTRIES = 200_000
+SQLITE_MAX_VARIABLES = 500
+
+
+def embed_queries(embeddings: Embeddings, texts: list[str]) -> list[list[float]]:
+    """Embed several questions as queries, in a single request when the model allows it."""
+    if hasattr(embeddings, "embed_queries"):
+        return embeddings.embed_queries(texts)
+    google = sys.modules.get("langchain_google_genai")  # only imported if Gemini embeddings were created
+    if google is not None and isinstance(embeddings, google.GoogleGenerativeAIEmbeddings):
+        return embeddings.embed_documents(texts, task_type="retrieval_query")
+    return [embeddings.embed_query(text) for text in texts]
+
+
+class CachedEmbeddings(Embeddings):
+    """Embedding function backed by a persistent SQLite cache.
+
+    Vectors are keyed by the model name, the kind of embedding (document or query) and the
+    SHA-256 of the text, so that the same chunk or the same question is only embedded once.
+    The cache keeps at most `max_entries` vectors and evicts the least recently used ones.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        model_name: str,
+        path: str = EMBEDDING_CACHE_PATH,
+        max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES,
+    ):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)",
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._connection.commit()
+
+    def key(self, text: str, kind: str) -> str:
+        """Cache key of a text for this model."""
+        return hashlib.sha256(f"{self.model_name}\0{kind}\0{text}".encode()).hexdigest()
+
+    def _lookup(self, keys: list[str]) -> dict[str, list[float]]:
+        found = {}
+        for start in range(0, len(keys), SQLITE_MAX_VARIABLES):
+            batch = keys[start:start + SQLITE_MAX_VARIABLES]
+            placeholders = ",".join("?" * len(batch))
+            rows = self._connection.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch,
+            )
+            for key, blob in rows:
+                found[key] = array("f", blob).tolist()
+        if found:
+            now = time.time()
+            self._connection.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, key) for key in found],
+            )
+        return found
+
+    def _store(self, vectors: dict[str, list[float]]):
+        now = time.time()
+        self._connection.executemany(
+            "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+            [(key, array("f", vector).tobytes(), now) for key, vector in vectors.items()],
+        )
+        excess = self._connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0] - self.max_entries
+        if excess > 0:
+            self._connection.execute(
+                "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                (excess,),
+            )
+
+    def _embed(self, texts: list[str], kind: str, embed) -> list[list[float]]:
+        keys = [self.key(text, kind) for text in texts]
+        with self._lock:
+            vectors = self._lookup(list(dict.fromkeys(keys)))
+            self._connection.commit()
+            missing = {key: text for key, text in zip(keys, texts, strict=True) if key not in vectors}
+            hits = sum(key in vectors for key in keys)
+            self.hits += hits
+            self.misses += len(missing)
+        count("rag_cache_requests_total", hits, cache="embedding", result="hit")
+        count("rag_cache_requests_total", len(missing), cache="embedding", result="miss")
+        if missing:
+            new_vectors = dict(zip(missing, embed(list(missing.values())), strict=True))
+            with self._lock:
+                self._store(new_vectors)
+                self._connection.commit()
+            vectors.update(new_vectors)
+        return [vectors[key] for key in keys]
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self._embed(texts, "document", self.embeddings.embed_documents)
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._embed([text], "query", lambda texts: [self.embeddings.embed_query(texts[0])])[0]
+
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        """Embed several questions, with a single request for the ones that are not cached."""
+        return self._embed(texts, "query", lambda missing: embed_queries(self.embeddings, missing))
+
+    def stats(self) -> dict:
+        """Hit and miss counters of the cache since it was opened."""
+        total = self.hits + self.misses
+        with self._lock:
+            size = self._connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": size,
+        }
+
+
+def init_embeddings(model: str, cache_path: str | None = EMBEDDING_CACHE_PATH) -> Embeddings:
+    """Gemini embeddings for `model`, behind the on-disk cache unless `cache_path` is None.
+    The Google client is imported here, so the commands that do not embed anything skip it.
+    """
+    from langchain_google_genai import GoogleGenerativeAIEmbeddings
+
+    embeddings = GoogleGenerativeAIEmbeddings(model=model)
+    if cache_path is None:
+        return embeddings
+    return CachedEmbeddings(embeddings, model, path=cache_path)
@@ -0,0 +1,107 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_BATCH_SIZE = 100
+EMBEDDING_MAX_IN_FLIGHT = 4
+EMBEDDING_REQUESTS_PER_MINUTE = 150
+EMBEDDING_MAX_RETRIES = 6
+EMBEDDING_INITIAL_BACKOFF = 1.0
+EMBEDDING_MAX_BACKOFF = 60.0
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, at most `capacity` in reserve."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take one token, sleeping until one is available."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def is_rate_limited(error: Exception) -> bool:
+    """Whether an error returned by the embedding API means we are sending too many requests."""
+    status = getattr(error, "status_code", None) or getattr(error, "code", None)
+    if status == 429:
+        return True
+    message = str(error)
+    return "429" in message or "RESOURCE_EXHAUSTED" in message or "ResourceExhausted" in message
+
+
+class EmbeddingScheduler:
+    """Send the embedding requests of an ingestion in batches, with a bounded number of
+    requests in flight, a token bucket limiting the request rate and an exponential backoff
+    when the API answers 429.
+
+    Wrap it around `CachedEmbeddings` so every finished batch is saved to the cache right away:
+    an interrupted build then resumes from the cache instead of embedding everything again.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        batch_size: int = EMBEDDING_BATCH_SIZE,
+        max_in_flight: int = EMBEDDING_MAX_IN_FLIGHT,
+        requests_per_minute: float = EMBEDDING_REQUESTS_PER_MINUTE,
+        max_retries: int = EMBEDDING_MAX_RETRIES,
+        initial_backoff: float = EMBEDDING_INITIAL_BACKOFF,
+        max_backoff: float = EMBEDDING_MAX_BACKOFF,
+    ):
+        self.embeddings = embeddings
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.bucket = TokenBucket(requests_per_minute / 60, capacity=max_in_flight)
+        self.requests = 0
+        self.retries = 0
+        self._counters_lock = threading.Lock()
+
+    def _count(self, requests: int = 0, retries: int = 0):
+        with self._counters_lock:
+            self.requests += requests
+            self.retries += retries
+
+    def _embed_batch(self, texts: list[str]) -> list[list[float]]:
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            self._count(requests=1)
+            try:
+                return self.embeddings.embed_documents(texts)
+            except Exception as e:
+                if not is_rate_limited(e) or attempt == self.max_retries:
+                    raise
+                delay = min(self.max_backoff, self.initial_backoff * 2**attempt)
+                delay *= random.uniform(0.5, 1.0)
+                self._count(retries=1)
+                logger.warning(f"Embedding API rate limit hit, retrying in {delay:.1f} s...")
+                time.sleep(delay)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        """Embed the texts, preserving their order."""
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+            results = list(executor.map(self._embed_batch, batches))
+        return [vector for batch in results for vector in batch]
@@ -0,0 +1,145 @@
+import functools
+import re
+from collections.abc import Collection
+
+from .bm25 import STOPWORDS, TOKEN, fold
+from .download_dataset import POKEMON_BY_GENERATION, safe_filename
+
+# Minimum length of a query word for typo-tolerant matching, and the edits allowed by length
+FUZZY_MIN_LENGTH = 5
+FUZZY_LONG_WORD = 8
+# Query words whose fuzzy match is memoized
+FUZZY_CACHE_SIZE = 4096
+# Folded words that name a generation: its region, and its ordinal before "generation"
+GENERATION_REGIONS = {
+    "kanto": 1, "johto": 2, "hoenn": 3, "sinnoh": 4, "unys": 5, "kalos": 6, "alola": 7, "galar": 8, "paldea": 9,
+}
+GENERATION_ORDINALS = {
+    "premiere": 1, "1re": 1, "1ere": 1, "deuxieme": 2, "seconde": 2, "2e": 2, "2eme": 2, "2nde": 2,
+    "troisieme": 3, "3e": 3, "3eme": 3, "quatrieme": 4, "4e": 4, "4eme": 4, "cinquieme": 5, "5e": 5, "5eme": 5,
+    "sixieme": 6, "6e": 6, "6eme": 6, "septieme": 7, "7e": 7, "7eme": 7, "huitieme": 8, "8e": 8, "8eme": 8,
+    "neuvieme": 9, "9e": 9, "9eme": 9,
+}
+GENERATION_WORDS = {"generation", "generations", "gen"}
+GENERATION_TOKEN = re.compile(r"(?:gen|g)([1-9])")
+
+
+def name_tokens(text: str) -> list[str]:
+    """Folded words of a text, stopwords included, as used to match Pokémon names."""
+    return TOKEN.findall(fold(text.replace("_", " ")))
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """Levenshtein distance between two words, or `limit + 1` as soon as it exceeds `limit`."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, start=1):
+        current = [i]
+        for j, char_b in enumerate(b, start=1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+class EntityIndex:
+    """Detects the Pokémon named in a question.
+
+    The names are stored in a trie of folded words, so every name of the question is found
+    in one pass, multi-word names ("M. Mime", "Ho-Oh") included. The words that match no name
+    are then compared to the single-word names with a small edit distance, so that a typo
+    like "pickachu" still resolves to Pikachu. A word of the `vocabulary` (the words of the
+    corpus) is never taken for a typo: "carapace" or "armure" do not name Carapuce or Airmure.
+    Only the names starting with the same letter are compared, and the result is memoized
+    for the last FUZZY_CACHE_SIZE words.
+    """
+
+    def __init__(self, names: list[str], vocabulary: Collection[str] = ()):
+        self.trie = {}
+        self.single_words = {}
+        self.vocabulary = set(vocabulary)
+        self._fuzzy = functools.lru_cache(maxsize=FUZZY_CACHE_SIZE)(self._closest_names)
+        for name in names:
+            tokens = name_tokens(name)
+            if not tokens:
+                continue
+            node = self.trie
+            for token in tokens:
+                node = node.setdefault(token, {})
+            node.setdefault(None, set()).add(safe_filename(name))
+            if len(tokens) == 1:
+                words = self.single_words.setdefault(tokens[0][0], {})
+                words.setdefault(tokens[0], set()).add(safe_filename(name))
+
+    def _closest_names(self, word: str) -> frozenset[str]:
+        if len(word) < FUZZY_MIN_LENGTH or word in STOPWORDS or word in self.vocabulary:
+            return frozenset()
+        limit = 2 if len(word) >= FUZZY_LONG_WORD else 1
+        best, matches = limit + 1, set()
+        for candidate, pokemon in self.single_words.get(word[0], {}).items():
+            distance = edit_distance(word, candidate, limit)
+            if distance < best:
+                best, matches = distance, set(pokemon)
+            elif distance == best and distance <= limit:
+                matches |= pokemon
+        return frozenset(matches) if best <= limit else frozenset()
+
+    def match(self, query: str) -> tuple[list[str], list[str]]:
+        """Return the Pokémon (as stored in the chunk metadata) named in the query, in order of
+        appearance: the names found as written, then the ones only matched through a typo.
+        """
+        tokens = name_tokens(query)
+        found, fuzzy = [], []
+        position = 0
+        while position < len(tokens):
+            node, end, match = self.trie, position, None
+            while end < len(tokens) and tokens[end] in node:
+                node = node[tokens[end]]
+                end += 1
+                if None in node:
+                    match, match_end = node[None], end
+            if match:
+                found.extend(sorted(match))
+                position = match_end
+            else:
+                fuzzy.extend(sorted(self._fuzzy(tokens[position])))
+                position += 1
+        found = list(dict.fromkeys(found))
+        return found, [name for name in dict.fromkeys(fuzzy) if name not in found]
+
+    def detect(self, query: str) -> list[str]:
+        """Return the Pokémon named in the query, the ones found as written first (see `match`)."""
+        found, fuzzy = self.match(query)
+        return found + fuzzy
+
+
+def default_entity_index(extra_names: list[str] = (), vocabulary: Collection[str] = ()) -> EntityIndex:
+    """Entity index over every known Pokémon name and the given page titles, with the words
+    of the corpus as `vocabulary`.
+    """
+    names = [name for pokemon_list in POKEMON_BY_GENERATION.values() for name in pokemon_list]
+    return EntityIndex(names + list(extra_names), vocabulary)
+
+
+def detect_generations(query: str) -> list[int]:
+    """Return the generations the query refers to ("2e génération", "génération 3", "gen4",
+    "Pokémon de Johto"), in order of appearance.
+    """
+    tokens = name_tokens(query)
+    found = []
+    for position, token in enumerate(tokens):
+        match = GENERATION_TOKEN.fullmatch(token)
+        if token in GENERATION_REGIONS:
+            found.append(GENERATION_REGIONS[token])
+        elif match:
+            found.append(int(match.group(1)))
+        elif token in GENERATION_WORDS:
+            before = tokens[position - 1] if position else ""
+            after = tokens[position + 1] if position + 1 < len(tokens) else ""
+            if before in GENERATION_ORDINALS:
+                found.append(GENERATION_ORDINALS[before])
+            elif after.isdigit() and 1 <= int(after) <= 9:
+                found.append(int(after))
+    return list(dict.fromkeys(found))
@@ -1,87 +1,297 @@
+import asyncio
+import hashlib
+import json
 import logging
+import math
+import os
+import re
+import sqlite3
+import statistics
 import time
 
-from langchain_google_genai import ChatGoogleGenerativeAI
-from ragas import EvaluationDataset, evaluate
-from ragas.llms import LangchainLLMWrapper
-from ragas.metrics import FactualCorrectness, Faithfulness, LLMContextRecall
+from langchain_core.language_models import LLM
+from langchain_core.runnables import Runnable
 
-from .app import get_and_filter_docs, init_rag_chain
+from .app import (
+    LLM_MAX_OUTPUT_TOKENS,
+    LLM_MODEL,
+    LLM_TEMPERATURE,
+    build_rag_chain,
+    init_llm,
+)
+from .bm25 import tokenize
+from .embedding_scheduler import is_rate_limited
+from .manifest import vectorstore_version
+from .retriever import PokemonRetriever, get_retriever
+from .settings import EVAL_CONCURRENCY, EVAL_QUESTIONS_PATH, GENERATORS, JUDGES
+from .tracing import span
 
 logger = logging.getLogger(__name__)
 
+EVAL_CACHE_PATH = "./eval_cache.sqlite3"
+EVAL_MAX_RETRIES = 6
+EVAL_INITIAL_RATE = 1.0  # requests per second, adapted to the rate limits of the API
+EVAL_MIN_RATE = 0.05
+EVAL_MAX_RATE = 10.0
+METRICS = ("context_recall", "faithfulness", "factual_correctness")
+PROMPT_CONTEXT = re.compile(r"Contexte :(.*?)Réponse :", re.DOTALL)
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
 
-def eval():
-    """Runs the evaluation on the RAG application.
-    This function initializes the RAG chain, retrieves relevant documents for sample queries,
-    generates responses, and evaluates them against expected responses.
+
+class ExtractiveLLM(LLM):
+    """Offline generator: answers with the first sentences of the context of the prompt,
+    with no model call, so `--generator stub --judge stub` evaluates the retrieval offline.
     """
-    logger.info("Starting evaluation...")
-    llm = ChatGoogleGenerativeAI(
-        model="gemini-2.0-flash",
-        temperature=0.1,
-        max_output_tokens=3000,
-        model_kwargs={"topP": 0.8, "topK": 60},
+
+    sentences: int = 3
+
+    @property
+    def _llm_type(self) -> str:
+        return "extractive"
+
+    def _call(self, prompt: str, stop: list[str] | None = None, run_manager=None, **kwargs) -> str:
+        match = PROMPT_CONTEXT.search(prompt)
+        context = " ".join((match.group(1) if match else "").split())
+        return " ".join(SENTENCE_END.split(context)[: self.sentences]) or "Je ne sais pas."
+
+
+def load_questions(path: str = EVAL_QUESTIONS_PATH) -> list[dict]:
+    """Load the evaluation set: a JSON list of {"question": "...", "reference": "..."}."""
+    with open(path, encoding="utf-8") as f:
+        questions = json.load(f)
+    for item in questions:
+        if not item.get("question") or not item.get("reference"):
+            raise ValueError(f"Every evaluation item needs a question and a reference: {item}")
+    return questions
+
+
+def cache_key(*parts: str) -> str:
+    """Key of a cached evaluation result, from everything the result depends on."""
+    return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+
+class EvalCache:
+    """Results of the previous evaluation runs (answers and scores), stored in SQLite, so a
+    rerun only recomputes the questions whose answer or scores depend on something that changed.
+    """
+
+    def __init__(self, path: str = EVAL_CACHE_PATH):
+        self._connection = sqlite3.connect(path)
+        self._connection.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._connection.commit()
+
+    def get(self, key: str) -> dict | None:
+        row = self._connection.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key: str, value: dict):
+        self._connection.execute(
+            "INSERT OR REPLACE INTO results (key, value) VALUES (?, ?)", (key, json.dumps(value, ensure_ascii=False)),
+        )
+        self._connection.commit()
+
+
+class AdaptiveRateLimiter:
+    """Space the requests to the API at `rate` per second. The rate slowly grows while the
+    requests succeed and is halved every time the API answers 429.
+    """
+
+    def __init__(
+        self,
+        rate: float = EVAL_INITIAL_RATE,
+        min_rate: float = EVAL_MIN_RATE,
+        max_rate: float = EVAL_MAX_RATE,
+        increase: float = 0.1,
+    ):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        """Wait for the next request slot."""
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + 1 / self.rate
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def success(self):
+        self.rate = min(self.max_rate, self.rate + self.increase)
+
+    def rate_limited(self):
+        self.rate = max(self.min_rate, self.rate / 2)
+
+
+async def answer_question(rag_chain: Runnable, question: str, limiter: AdaptiveRateLimiter) -> dict:
+    """Run the chain on a question, retrying when rate limited. The retrieved context is the
+    one the chain used to answer, so the retrieval runs only once.
+    """
+    for attempt in range(EVAL_MAX_RETRIES + 1):
+        await limiter.wait()
+        try:
+            with span("answer", attempt=attempt):
+                result = await rag_chain.ainvoke(question)
+        except Exception as e:
+            if not is_rate_limited(e) or attempt == EVAL_MAX_RETRIES:
+                raise
+            limiter.rate_limited()
+            logger.warning(f"Rate limited, slowing down to {limiter.rate:.2f} requests/s...")
+            continue
+        limiter.success()
+        return {
+            "response": result["answer"],
+            "retrieved_contexts": [doc.page_content for doc in result["context"]],
+        }
+
+
+async def answer_questions(
+    rag_chain: Runnable,
+    questions: list[dict],
+    cache: EvalCache,
+    namespace: str,
+    concurrency: int,
+) -> list[dict]:
+    """Answer every question, at most `concurrency` at a time, reusing the cached answers
+    of the same question with the same model and vector store.
+    """
+    limiter = AdaptiveRateLimiter()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def answer(item: dict) -> dict:
+        key = cache_key("answer", namespace, item["question"])
+        cached = cache.get(key)
+        if cached is None:
+            async with semaphore:
+                cached = await answer_question(rag_chain, item["question"], limiter)
+            cache.set(key, cached)
+        return {"user_input": item["question"], "reference": item["reference"], **cached}
+
+    return await asyncio.gather(*(answer(item) for item in questions))
+
+
+def stub_scores(record: dict) -> dict:
+    """Offline judge: lexical overlap versions of the metrics, with no model call.
+
+    - context_recall: share of the reference words found in the contexts
+    - faithfulness: share of the response words found in the contexts
+    - factual_correctness: F1 of the words of the response against the reference
+    """
+    reference = set(tokenize(record["reference"]))
+    response = set(tokenize(record["response"]))
+    contexts = set(tokenize(" ".join(record["retrieved_contexts"])))
+    common = len(response & reference)
+    precision = common / len(response) if response else 0.0
+    recall = common / len(reference) if reference else 0.0
+    return {
+        "context_recall": len(reference & contexts) / len(reference) if reference else 0.0,
+        "faithfulness": len(response & contexts) / len(response) if response else 0.0,
+        "factual_correctness": 2 * precision * recall / (precision + recall) if common else 0.0,
+    }
+
+
+def ragas_scores(records: list[dict], concurrency: int) -> list[dict]:
+    """Score the records with the Ragas metrics and Gemini as the judge, in a single pass."""
+    from ragas import EvaluationDataset, evaluate
+    from ragas.llms import LangchainLLMWrapper
+    from ragas.metrics import FactualCorrectness, Faithfulness, LLMContextRecall
+    from ragas.run_config import RunConfig
+
+    result = evaluate(
+        dataset=EvaluationDataset.from_list(records),
+        metrics=[LLMContextRecall(), Faithfulness(), FactualCorrectness()],
+        llm=LangchainLLMWrapper(init_llm()),
+        run_config=RunConfig(max_workers=concurrency, max_retries=EVAL_MAX_RETRIES),
     )
+    scores = []
+    for row in result.scores:
+        by_metric = {}
+        for name, value in row.items():
+            metric = next((metric for metric in METRICS if name.startswith(metric)), name)
+            by_metric[metric] = value
+        scores.append(by_metric)
+    return scores
 
-    sample_queries = [
-        "qui est pickachu?",
-        "Quel est le type de sulfura ?",
-        "qui sont les Oiseaux Légendaires de Kanto?",
-        "Quel est le Pokémon le plus célèbre ?",
-        "Quels sont les Pokémons de type spectre ?",
-        "quel pokemon a le plus d'evolution ?",
-        "quel est la particularité de Métamorph?",
-        "quel est le nom japonais de Ronflex ?",
-    ]
-    expected_responses = [
-        "Pikachu est un Pokémon de type Électrik, ressemblant à une souris, apparu dès la première génération. C'est le plus célèbre des Pokémon et la mascotte officielle de la licence, notamment en tant que partenaire de Sacha dans le dessin animé. Il est l'évolution de Pichu et peut évoluer en Raichu grâce à une Pierre Foudre."
-        "Sulfura est de type Feu et Vol.",
-        "Pikachu est le Pokémon le plus célèbre.",
-        "Les oiseaux légendaires de kanto sont Artikodin, Électhor et Sulfura.",
-        "les Pokémons de type spectre sont: Spectrum, Ectoplasma, Fantominus",
-        "D'après le contexte, Évoli est le Pokémon avec le plus d'évolutions possibles, avec un total de 8.",
-        "La particularité de Métamorph est sa capacité à se transformer en n'importe quel objet ou créature.",
-        "Le nom japonais de Ronflex est カビゴン Kabigon.",
+
+def score_records(records: list[dict], cache: EvalCache, judge: str, concurrency: int) -> list[dict]:
+    """Score the records, reusing the cached scores of the same answer with the same judge."""
+    keys = [
+        cache_key("scores", judge, record["user_input"], record["reference"], record["response"],
+                  *record["retrieved_contexts"])
+        for record in records
     ]
+    scores = [cache.get(key) for key in keys]
+    missing = [index for index, score in enumerate(scores) if score is None]
+    if missing:
+        logger.info(f"Scoring {len(missing)}/{len(records)} answers with the {judge} judge...")
+        if judge == "stub":
+            new_scores = [stub_scores(records[index]) for index in missing]
+        else:
+            new_scores = ragas_scores([records[index] for index in missing], concurrency)
+        for index, score in zip(missing, new_scores, strict=True):
+            cache.set(keys[index], score)
+            scores[index] = score
+    return scores
 
-    dataset = []
 
-    rag_chain = init_rag_chain()
+def eval(
+    questions_path: str = EVAL_QUESTIONS_PATH,
+    judge: str = "gemini",
+    concurrency: int = EVAL_CONCURRENCY,
+    cache_path: str = EVAL_CACHE_PATH,
+    rag_chain: Runnable | None = None,
+    chain_name: str | None = None,
+    generator: str = "gemini",
+    retriever: PokemonRetriever | None = None,
+) -> dict:
+    """Runs the evaluation on the RAG application.
+    Every question of the evaluation set is answered by the RAG chain, with bounded
+    concurrency and a rate adapted to the API, then the answers are scored on context recall,
+    faithfulness and factual correctness in a single pass. Answers and scores are cached on
+    disk, so a rerun only recomputes what changed (questions, references, model, vector store
+    or judge). `judge="stub"` scores the answers offline with lexical overlap metrics and
+    `generator="stub"` answers with the retrieved context instead of Gemini.
+    The answers come from `rag_chain` if given (identified by `chain_name` in the cache),
+    otherwise from a chain built around `retriever` (the process-wide one by default).
+    `retriever` must be the one of `rag_chain`: its store is part of the cache key.
+    Returns the mean of every metric.
+    """
+    if judge not in JUDGES:
+        raise ValueError(f"Unknown judge: {judge}. Available: {', '.join(JUDGES)}.")
+    if generator not in GENERATORS:
+        raise ValueError(f"Unknown generator: {generator}. Available: {', '.join(GENERATORS)}.")
+    logger.info("Starting evaluation...")
+    start = time.perf_counter()
+    questions = load_questions(questions_path)
+    cache = EvalCache(cache_path)
+    if retriever is None:
+        retriever = get_retriever()
+    if rag_chain is None:
+        if generator == "stub":
+            llm, chain_name = ExtractiveLLM(), "extractive"
+        else:
+            llm, chain_name = init_llm(), f"{LLM_MODEL}:{LLM_TEMPERATURE}:{LLM_MAX_OUTPUT_TOKENS}"
+        rag_chain = build_rag_chain(llm, retriever=retriever)
+    elif chain_name is None:
+        raise ValueError("An injected rag_chain needs a chain_name to identify its answers in the cache.")
+    persist_directory = os.path.abspath(retriever.persist_directory)
+    namespace = f"{chain_name}:{persist_directory}:{vectorstore_version(persist_directory)}"
+    records = asyncio.run(answer_questions(rag_chain, questions, cache, namespace, concurrency))
+    scores = score_records(records, cache, judge, concurrency)
 
-    for query, reference in zip(
-        sample_queries[:2],
-        expected_responses[:2],
-        strict=False,
-    ):
-        relevant_docs = get_and_filter_docs(query)
-        response = rag_chain.invoke(query)["answer"]
-        dataset.append(
-            {
-                "user_input": query,
-                "retrieved_contexts": [doc.page_content for doc in relevant_docs],
-                "response": response,
-                "reference": reference,
-            },
+    for record, score in zip(records, scores, strict=True):
+        logger.info(
+            f"{record['user_input']!r}: " + ", ".join(f"{metric} {score.get(metric, math.nan):.2f}" for metric in METRICS),
         )
-        time.sleep(20)
-    evaluation_dataset = EvaluationDataset.from_list(dataset)
-    evaluator_llm = LangchainLLMWrapper(llm)
-    result1 = evaluate(
-        dataset=evaluation_dataset,
-        metrics=[LLMContextRecall()], # Evaluates how well the LLM recalls the context provided
-        llm=evaluator_llm,
-    )
-    time.sleep(20)
-    result2 = evaluate(
-        dataset=evaluation_dataset,
-        metrics=[Faithfulness()], # Evaluates how faithful the LLM's response is to the provided context
-        llm=evaluator_llm,
-    )
-    time.sleep(20)
-    result3 = evaluate(
-        dataset=evaluation_dataset,
-        metrics=[FactualCorrectness()], # Evaluates the factual correctness of the LLM's responses
-        llm=evaluator_llm,
+    summary = {}
+    for metric in METRICS:
+        values = [score[metric] for score in scores if not math.isnan(score.get(metric, math.nan))]
+        summary[metric] = statistics.mean(values) if values else math.nan
+    logger.info(
+        f"Evaluation of {len(records)} questions done in {time.perf_counter() - start:.1f} s: "
+        + ", ".join(f"{metric} {value:.3f}" for metric, value in summary.items()),
     )
-    print(result1, result2, result3)
+    return summary
@@ -0,0 +1,139 @@
+import re
+
+from langchain.docstore.document import Document
+from lxml import html
+
+from .chunking import INTRO_SECTION
+
+# Main content region of a Poképédia (MediaWiki) article
+CONTENT_XPATH = '//div[@id="mw-content-text"]/div[contains(@class, "mw-parser-output")]'
+
+# Elements that are navigation or page furniture rather than content
+NOISE_XPATHS = (
+    './/span[contains(@class, "mw-editsection")]',
+    ".//button",
+    ".//style",
+    ".//script",
+    './/table[contains(@class, "ruban")]',
+    './/table[contains(@class, "permuter")]',
+    './/div[contains(@class, "bandeau")]',
+    './/div[contains(@class, "renvoi-article")]',
+    './/div[contains(@class, "mw-references-wrap")]',
+    './/sup[contains(@class, "reference")]',
+)
+NOISE_XPATH = " | ".join(NOISE_XPATHS)
+
+SECTION_TAGS = {"h2", "h3"}
+SUBSECTION_TAGS = {"h4", "h5", "h6"}
+
+# Level 2 sections that are left out of the dataset
+SKIPPED_SECTIONS = {
+    "Dans le Jeu de Cartes à Collectionner",
+    "Notes et références",
+    "Références",
+}
+
+WHITESPACE = re.compile(r"\s+")
+TYPE_LINK_XPATH = './/a[substring(@title, string-length(@title) - 6) = " (type)"][.//img]'
+
+
+def clean_text(text: str) -> str:
+    """Collapse the whitespace of a text."""
+    return WHITESPACE.sub(" ", text).strip()
+
+
+def inline_images_and_breaks(content):
+    """Replace the type icons by the name of the type and the line breaks by spaces,
+    so that they are not lost when the text is extracted.
+    """
+    for link in content.xpath(TYPE_LINK_XPATH):
+        for child in list(link):
+            link.remove(child)
+        link.text = " " + link.get("title").removesuffix(" (type)") + " "
+    for br in content.iter("br"):
+        br.tail = " " + (br.tail or "")
+
+
+def table_text(table) -> str:
+    """Render a table row by row, with the cells separated by ' | '."""
+    rows = []
+    for row in table.iter("tr"):
+        if row.find(".//table") is not None:
+            continue  # the rows of the nested table are rendered on their own
+        cells = [clean_text(cell.text_content()) for cell in row.xpath("./th | ./td")]
+        cells = [cell for cell in cells if cell]
+        if cells:
+            rows.append(" | ".join(cells))
+    return "\n".join(rows)
+
+
+def block_text(element) -> str:
+    """Render a block element of the article as plain text."""
+    if element.tag == "table":
+        return table_text(element)
+    if element.tag in ("ul", "ol"):
+        return "\n".join(clean_text(item.text_content()) for item in element.iter("li"))
+    if element.find(".//table") is not None:
+        parts = [clean_text(element.text or "")]
+        parts += [block_text(child) for child in element if isinstance(child.tag, str)]
+        return "\n".join(part for part in parts if part)
+    return clean_text(element.text_content())
+
+
+def parse_article(path: str):
+    """Parse the article content of a Poképédia page, or return None if it has none.
+    Navigation, edit links and the other noise are removed from the HTML tree itself.
+    """
+    tree = html.parse(path)
+    content = tree.xpath(CONTENT_XPATH)
+    if not content:
+        return None
+    content = content[0]
+    for element in content.xpath(NOISE_XPATH):
+        element.drop_tree()
+    inline_images_and_breaks(content)
+    return content
+
+
+def article_sections(content) -> list[tuple[str, str]]:
+    """Split a parsed article into (section title, section text) pairs, without the skipped sections."""
+    sections = []
+    title, parts, skipping = INTRO_SECTION, [], False
+    for element in content:
+        if not isinstance(element.tag, str):
+            continue  # comments
+        if element.tag in SECTION_TAGS:
+            if not skipping:
+                sections.append((title, "\n".join(parts)))
+            heading = clean_text(element.text_content())
+            if element.tag == "h2":
+                skipping = heading in SKIPPED_SECTIONS
+            title, parts = heading, []
+        elif skipping:
+            continue
+        elif element.tag in SUBSECTION_TAGS:
+            parts.append(clean_text(element.text_content()))
+        else:
+            text = block_text(element)
+            if text:
+                parts.append(text)
+    if not skipping:
+        sections.append((title, "\n".join(parts)))
+    return [(title, text) for title, text in sections if text]
+
+
+def extract_sections(path: str) -> list[tuple[str, str]]:
+    """Extract the (section title, section text) pairs of a Poképédia page.
+    Returns an empty list if the page has no article content.
+    """
+    content = parse_article(path)
+    return article_sections(content) if content is not None else []
+
+
+def load_page(path: str, content=None) -> Document:
+    """Load a Poképédia page as a document, with one line per section heading.
+    `content` is the article already parsed by `parse_article`, if any.
+    """
+    sections = extract_sections(path) if content is None else article_sections(content)
+    text = "\n\n".join(f"{title}\n{body}" for title, body in sections)
+    return Document(page_content=text, metadata={"source": path})
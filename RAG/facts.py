@@ -0,0 +1,260 @@
+import os
+import re
+import sqlite3
+import threading
+
+from .bm25 import fold
+from .entities import FUZZY_LONG_WORD, FUZZY_MIN_LENGTH, edit_distance, name_tokens
+from .extract import clean_text, parse_article
+
+FACTS_FILENAME = "facts.sqlite3"
+
+# Rows of the infobox ("ficheinfo") kept in the fact table, by folded label
+INFOBOX_FIELDS = {
+    "nom japonais": "japanese_name",
+    "nom anglais": "english_name",
+    "type": "types",
+    "types": "types",
+    "categorie": "category",
+    "taille": "height",
+    "poids": "weight",
+    "talent": "abilities",
+    "talents": "abilities",
+    "groupe d'œuf": "egg_groups",
+    "groupes d'œuf": "egg_groups",
+    "eclosion": "hatch_cycles",
+    "points effort": "effort_points",
+    "points exp.": "base_experience",
+    "sexe": "gender_ratio",
+    "couleur": "color",
+    "taux de capture": "capture_rate",
+}
+
+# Rows of the base statistics table, by folded label
+STAT_FIELDS = {
+    "pv": "hp",
+    "attaque": "attack",
+    "defense": "defense",
+    "attaque speciale": "special_attack",
+    "defense speciale": "special_defense",
+    "vitesse": "speed",
+    "special": "special",
+    "somme des statistiques de base": "base_stat_total",
+}
+
+FACT_COLUMNS = list(dict.fromkeys(["number", "name", *INFOBOX_FIELDS.values(), *STAT_FIELDS.values()]))
+
+# French label of every fact, used to phrase the answers
+FACT_LABELS = {
+    "number": "Numéro du Pokédex national",
+    "name": "Nom",
+    "japanese_name": "Nom japonais",
+    "english_name": "Nom anglais",
+    "types": "Type",
+    "category": "Catégorie",
+    "height": "Taille",
+    "weight": "Poids",
+    "abilities": "Talents",
+    "egg_groups": "Groupe d'Œuf",
+    "hatch_cycles": "Éclosion",
+    "effort_points": "Points effort",
+    "base_experience": "Points d'expérience",
+    "gender_ratio": "Répartition des sexes",
+    "color": "Couleur",
+    "capture_rate": "Taux de capture",
+    "hp": "PV",
+    "attack": "Attaque",
+    "defense": "Défense",
+    "special_attack": "Attaque Spéciale",
+    "special_defense": "Défense Spéciale",
+    "speed": "Vitesse",
+    "special": "Spécial",
+    "base_stat_total": "Total",
+}
+
+# Facts asked by a question, by the folded noun naming them (the most specific first)
+FACT_NOUNS = [
+    (r"nom (?:en )?japonais", ["japanese_name"]),
+    (r"nom (?:en )?anglais", ["english_name"]),
+    (r"types?", ["types"]),
+    (r"categorie", ["category"]),
+    (r"taille", ["height"]),
+    (r"poids", ["weight"]),
+    (r"talents?", ["abilities"]),
+    (r"groupes? d (?:œ|oe)ufs?", ["egg_groups"]),
+    (r"couleur", ["color"]),
+    (r"taux de capture", ["capture_rate"]),
+    (r"(?:numero|n°)(?: du pokedex)?(?: national)?", ["number"]),
+    (r"(?:(?:stats?|statistiques?) (?:de |d )?)?(?:pv|points de vie)(?: de base)?", ["hp"]),
+    (r"(?:(?:stats?|statistiques?) (?:de |d )?)?attaque speciale(?: de base)?", ["special_attack"]),
+    (r"(?:(?:stats?|statistiques?) (?:de |d )?)?attaque(?: de base)?", ["attack"]),
+    (r"(?:(?:stats?|statistiques?) (?:de |d )?)?defense speciale(?: de base)?", ["special_defense"]),
+    (r"(?:(?:stats?|statistiques?) (?:de |d )?)?defense(?: de base)?", ["defense"]),
+    (r"(?:(?:stats?|statistiques?) (?:de |d )?)?vitesse(?: de base)?", ["speed"]),
+    (r"(?:stats?|statistiques?)(?: de base)?", list(STAT_FIELDS.values())),
+]
+FACT_VERBS = [(r"pese", ["weight"]), (r"mesure", ["height"])]
+ARTICLE = r"(?:(?:le|la|les|l|son|sa|ses) )?"
+FACT_NOUN = "(?:" + "|".join(noun for noun, _ in FACT_NOUNS) + ")"
+# Whole questions answered from the fact table, matched on the folded question without
+# punctuation: any other word makes the question go through the RAG chain
+FACT_QUESTIONS = [
+    re.compile(
+        rf"(?:(?:quel|quelle|quels|quelles) (?:est|sont) |c est quoi |donne moi )?{ARTICLE}"
+        rf"(?P<facts>{FACT_NOUN}(?: et {ARTICLE}{FACT_NOUN})*) (?:de|d|du) (?P<pokemon>.+)",
+    ),
+    re.compile(r"(?P<pokemon>.+) est de quels? (?P<facts>types?)"),
+    re.compile(r"de quels? (?P<facts>types?) est (?P<pokemon>.+)"),
+    re.compile(r"combien (?P<facts>pese|mesure) (?P<pokemon>.+)"),
+    re.compile(r"(?P<pokemon>.+) (?P<facts>pese|mesure) combien"),
+]
+FACT_SEPARATOR = re.compile(rf" et {ARTICLE}")
+QUESTION_NOISE = re.compile(r"[^\w°]+")
+
+
+def facts_path(persist_directory: str) -> str:
+    """Path of the fact table, stored next to the vector store."""
+    return os.path.join(persist_directory, FACTS_FILENAME)
+
+
+def label_key(text: str) -> str:
+    """Folded label of a table row, without footnote marks ("PV ²" -> "pv")."""
+    return re.sub(r"[\d¹²³⁴*]+$", "", fold(clean_text(text))).strip()
+
+
+def extract_facts(content) -> dict[str, str]:
+    """Extract the facts of the infobox and of the base statistics table of a parsed article."""
+    facts = {}
+    infobox = content.xpath('.//table[contains(@class, "ficheinfo")]')
+    if infobox:
+        header = [clean_text(cell.text_content()) for cell in infobox[0].xpath(".//tr[1]/th")]
+        if len(header) >= 2:
+            facts["number"] = header[0].removeprefix("№").strip()
+            facts["name"] = header[1]
+        for row in infobox[0].iter("tr"):
+            cells = row.xpath("./th | ./td")
+            if len(cells) != 2 or cells[0].tag != "th":
+                continue
+            field = INFOBOX_FIELDS.get(label_key(cells[0].text_content()))
+            value = clean_text(cells[1].text_content())
+            if field and value and field not in facts:
+                facts[field] = value.split(", soit")[0]
+    for table in content.xpath('.//table[.//th[starts-with(normalize-space(.), "Statistiques indicatives")]]'):
+        for row in table.iter("tr"):
+            cells = row.xpath("./th | ./td")
+            if len(cells) < 2:
+                continue
+            field = STAT_FIELDS.get(label_key(cells[0].text_content()))
+            value = clean_text(cells[1].text_content())
+            if field and value:
+                facts.setdefault(field, value)
+        break  # the first table is the one of the default form
+    return facts
+
+
+def page_facts(path: str) -> dict[str, str]:
+    """Facts of a Poképédia page, or an empty dict if it has no article content."""
+    content = parse_article(path)
+    return extract_facts(content) if content is not None else {}
+
+
+def names_pokemon(text: str, pokemon: str) -> bool:
+    """Whether the text is the name of the Pokémon, with the typos tolerated by `EntityIndex`."""
+    words, name = name_tokens(text), name_tokens(pokemon)
+    if len(words) != len(name):
+        return False
+    for word, expected in zip(words, name):
+        limit = 2 if len(expected) >= FUZZY_LONG_WORD else 1
+        if word != expected and (len(word) < FUZZY_MIN_LENGTH or edit_distance(word, expected, limit) > limit):
+            return False
+    return True
+
+
+def match_fact_question(question: str, pokemon: str) -> list[str]:
+    """Facts asked by a question about the Pokémon, or an empty list if the question is not
+    one of FACT_QUESTIONS as a whole, naming only this Pokémon.
+    """
+    question = QUESTION_NOISE.sub(" ", fold(question)).strip()
+    for template in FACT_QUESTIONS:
+        match = template.fullmatch(question)
+        if match and names_pokemon(match["pokemon"], pokemon):
+            fields = []
+            for noun in FACT_SEPARATOR.split(match["facts"]):
+                fields += next(fields for pattern, fields in FACT_NOUNS + FACT_VERBS if re.fullmatch(pattern, noun))
+            return list(dict.fromkeys(fields))
+    return []
+
+
+def format_facts(facts: dict[str, str], fields: list[str]) -> str:
+    """Phrase the answer to a factual question from the facts of one Pokémon."""
+    name = facts.get("name") or facts["pokemon"].replace("_", " ")
+    stats = [field for field in fields if field in STAT_FIELDS.values()]
+    lines = [f"{FACT_LABELS[field]} de {name} : {facts[field]}." for field in fields if field not in stats]
+    if len(stats) > 1:
+        values = ", ".join(f"{FACT_LABELS[field]} {facts[field]}" for field in stats if facts.get(field))
+        lines.append(f"Statistiques de base de {name} : {values}.")
+    elif stats:
+        lines.append(f"{FACT_LABELS[stats[0]]} de base de {name} : {facts[stats[0]]}.")
+    return "\n".join(lines)
+
+
+class FactStore:
+    """Table of the Pokédex facts of every page, one row per Pokémon and one column per fact,
+    stored in SQLite next to the vector store.
+    """
+
+    def __init__(self, path: str, content: bytes | None = None):
+        """Open the table at `path`, or a read-only copy in memory of the database file `content`
+        (e.g. read from a snapshot).
+        """
+        self._lock = threading.Lock()
+        if content is not None:
+            self._connection = sqlite3.connect(":memory:", check_same_thread=False)
+            self._connection.deserialize(content)
+            self._connection.execute("PRAGMA query_only = ON")
+            return
+        self._connection = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        columns = ", ".join(f"{column} TEXT" for column in FACT_COLUMNS)
+        self._connection.execute(f"CREATE TABLE IF NOT EXISTS facts (pokemon TEXT PRIMARY KEY, {columns})")
+        self._connection.commit()
+
+    def upsert(self, rows: dict[str, dict[str, str]]):
+        """Store the facts of the given Pokémon, replacing their previous row."""
+        columns = ["pokemon", *FACT_COLUMNS]
+        placeholders = ", ".join("?" for _ in columns)
+        with self._lock:
+            self._connection.executemany(
+                f"INSERT OR REPLACE INTO facts ({', '.join(columns)}) VALUES ({placeholders})",
+                [[pokemon, *(facts.get(column) for column in FACT_COLUMNS)] for pokemon, facts in rows.items()],
+            )
+            self._connection.commit()
+
+    def delete(self, pokemon: list[str]):
+        """Remove the rows of the given Pokémon."""
+        with self._lock:
+            self._connection.executemany("DELETE FROM facts WHERE pokemon = ?", [(name,) for name in pokemon])
+            self._connection.commit()
+
+    def get(self, pokemon: str) -> dict[str, str] | None:
+        """The known facts of a Pokémon, or None if it has no row."""
+        with self._lock:
+            cursor = self._connection.execute("SELECT * FROM facts WHERE pokemon = ?", (pokemon,))
+            row = cursor.fetchone()
+        if row is None:
+            return None
+        return {column[0]: value for column, value in zip(cursor.description, row, strict=True) if value is not None}
+
+    def count(self) -> int:
+        """Number of Pokémon in the table."""
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM facts").fetchone()[0]
+
+    def answer(self, pokemon: str, question: str) -> str | None:
+        """Answer a factual question about a Pokémon from its row, or None if the question
+        matches no template or the facts it asks for are unknown.
+        """
+        fields = match_fact_question(question, pokemon)
+        facts = self.get(pokemon) if fields else None
+        if not facts or not all(field in facts for field in fields if field != "special"):
+            return None
+        return format_facts(facts, [field for field in fields if field in facts])
@@ -0,0 +1,65 @@
+import hashlib
+import json
+import os
+
+from .snapshot import SnapshotReader, is_snapshot
+
+MANIFEST_FILENAME = "ingestion_manifest.json"
+
+
+def manifest_path(persist_directory: str) -> str:
+    """Path of the ingestion manifest, stored next to the vector store it describes."""
+    return os.path.join(persist_directory, MANIFEST_FILENAME)
+
+
+def file_hash(path: str) -> str:
+    """SHA-256 of the content of a file."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_manifest(persist_directory: str) -> dict | None:
+    """Load the manifest of a vector store, or None if the store has none.
+
+    The manifest looks like:
+        {"embedding_model": "...", "pages": {"pokemon_dataset/Abo.html": {"hash": "...", "chunk_ids": [...]}}}
+    """
+    if is_snapshot(persist_directory):
+        snapshot = SnapshotReader(persist_directory)
+        return snapshot.read_json(MANIFEST_FILENAME) if MANIFEST_FILENAME in snapshot else None
+    path = manifest_path(persist_directory)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(manifest: dict, persist_directory: str):
+    """Write the manifest atomically, so an interrupted build never leaves it half written."""
+    path = manifest_path(persist_directory)
+    os.makedirs(persist_directory, exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+
+
+def vectorstore_version(persist_directory: str) -> str:
+    """A value that changes every time the vector store is updated: the modification time of
+    its manifest, or of the snapshot file it is read from.
+    """
+    path = persist_directory if os.path.isfile(persist_directory) else manifest_path(persist_directory)
+    return str(os.stat(path).st_mtime_ns) if os.path.exists(path) else ""
+
+
+def diff_pages(manifest: dict, hashes: dict[str, str]) -> tuple[list[str], list[str]]:
+    """Compare the current page hashes with the manifest.
+    Returns the pages that are new or changed, and the pages that were removed from the dataset.
+    """
+    known = manifest["pages"]
+    changed = [path for path, digest in hashes.items() if known.get(path, {}).get("hash") != digest]
+    removed = [path for path in known if path not in hashes]
+    return changed, removed
@@ -0,0 +1,465 @@
+import contextlib
+import logging
+import os
+import threading
+import time
+
+from langchain.docstore.document import Document
+from langchain_core.embeddings import Embeddings
+
+from .bm25 import BM25_FILENAME, BM25Index, bm25_index_path
+from .embedding_cache import init_embeddings
+from .entities import EntityIndex, default_entity_index, detect_generations
+from .facts import FACTS_FILENAME, FactStore, facts_path
+from .manifest import load_manifest
+from .settings import VECTOR_BACKEND
+from .snapshot import SnapshotReader, is_snapshot
+from .tracing import count, span, tracing_enabled
+from .vector_index import ChromaIndex, NumpyIndex, ShardedIndex, open_vector_index
+
+logger = logging.getLogger(__name__)
+
+PERSIST_DIRECTORY = "./chroma_db"
+EMBEDDING_MODEL = "models/embedding-001"
+TOP_K = 10
+RELEVANCE_THRESHOLD = 0.55
+# Share of the query a chunk must cover to be returned by the BM25 search (see `BM25Index.max_score`)
+LEXICAL_RELEVANCE_THRESHOLD = 0.25
+VECTOR_WEIGHT = 1.0
+LEXICAL_WEIGHT = 1.0
+# Weight, in the fusion, of the chunks of the Pokémon only matched through a typo
+ENTITY_WEIGHT = 1.0
+RRF_K = 60
+# Stages of `PokemonRetriever.get_and_filter_docs`: entity routing, query embedding,
+# nearest neighbour search, BM25 search, and threshold, fusion and token budget
+RETRIEVAL_STAGES = ("route", "embed", "search", "lexical", "filter")
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count of a text, about 4 characters per token."""
+    return len(text) // 4
+
+
+def doc_key(doc: Document) -> str:
+    """Id of a chunk, from the vector store or from its metadata."""
+    return doc.id or f"{doc.metadata.get('source')}:{doc.metadata.get('chunk')}"
+
+
+@contextlib.contextmanager
+def timed(timings: dict[str, float] | None, stage: str):
+    """Add the seconds spent in the block to `timings[stage]`, if `timings` is given,
+    and trace it as a span when tracing is on.
+    """
+    with span(stage):
+        if timings is None:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+
+
+def reciprocal_rank_fusion(
+    rankings: list[list[Document]],
+    weights: list[float],
+    rrf_k: int = RRF_K,
+) -> list[Document]:
+    """Merge several rankings of the same chunks: a chunk scores weight / (rrf_k + rank)
+    in every ranking where it appears, and the chunks are sorted by their total score.
+    """
+    scores, docs = {}, {}
+    for ranking, weight in zip(rankings, weights, strict=True):
+        for rank, doc in enumerate(ranking, start=1):
+            key = doc_key(doc)
+            docs.setdefault(key, doc)
+            scores[key] = scores.get(key, 0.0) + weight / (rrf_k + rank)
+    return [docs[key] for key in sorted(scores, key=scores.get, reverse=True)]
+
+
+class PokemonRetriever:
+    """Long-lived retriever over the vector store.
+
+    The embeddings client and the vector index are opened lazily on the first query
+    and then reused for the lifetime of the object, so a process pays the cost of
+    opening the store only once. Opening is guarded by a lock so that concurrent
+    sessions share the same store.
+
+    The vector index is a Chroma collection or a NumPy matrix (see `open_vector_index`):
+    `backend` defaults to the one the store was built with, as recorded in its manifest.
+
+    When the BM25 index built by `create_vectorstore` is available, the dense results are
+    fused with the lexical ones by reciprocal rank fusion, weighted by `vector_weight`
+    and `lexical_weight`. Like the dense results below `relevance_threshold`, the lexical ones
+    covering less than `lexical_threshold` of the query are dropped before the fusion, so an
+    off-topic question gets no context.
+
+    With `entity_routing`, a question naming Pokémon ("nom japonais de Ronflex") is answered
+    from their chunks only: their introduction first, then their chunks ranked by BM25,
+    without any embedding call. Without a BM25 index, the dense search is filtered on the
+    `pokemon` metadata instead. In a store sharded by generation (see `ShardedIndex`), the
+    dense search only scans the shards of these Pokémon, or of the generations named in the
+    question ("2e génération", "Johto"). A Pokémon only matched through a typo ("pickachu")
+    does not restrict the search: its chunks are fused with the others, weighted by
+    `entity_weight`.
+
+    The chunks are not truncated to a token budget: the `ContextCompressor` (see context.py)
+    packs them into the budget of the prompt after its deduplication and MMR selection.
+    `max_context_tokens` only caps the chunks returned to callers that do not compress them.
+
+    `persist_directory` can also be a snapshot file (see snapshot.py). A NumPy store is then
+    read from it in place; a Chroma store is unpacked to `unpack_directory` (by default the
+    path of the snapshot without its extension) the first time the vector index is needed,
+    unless that directory already exists. While another thread unpacks it (see `warm_up`),
+    the questions are answered from the BM25 index alone instead of waiting.
+    """
+
+    def __init__(
+        self,
+        persist_directory: str = PERSIST_DIRECTORY,
+        embedding_model: str = EMBEDDING_MODEL,
+        k: int = TOP_K,
+        relevance_threshold: float = RELEVANCE_THRESHOLD,
+        lexical_threshold: float = LEXICAL_RELEVANCE_THRESHOLD,
+        max_context_tokens: int | None = None,
+        vector_weight: float = VECTOR_WEIGHT,
+        lexical_weight: float = LEXICAL_WEIGHT,
+        entity_weight: float = ENTITY_WEIGHT,
+        rrf_k: int = RRF_K,
+        embedding_function: Embeddings | None = None,
+        entity_routing: bool = True,
+        backend: str | None = None,
+        unpack_directory: str | None = None,
+    ):
+        self.persist_directory = persist_directory
+        self.embedding_model = embedding_model
+        self.k = k
+        self.relevance_threshold = relevance_threshold
+        self.lexical_threshold = lexical_threshold
+        self.max_context_tokens = max_context_tokens
+        self.vector_weight = vector_weight
+        self.lexical_weight = lexical_weight
+        self.entity_weight = entity_weight
+        self.rrf_k = rrf_k
+        self._embedding_function = embedding_function
+        self.entity_routing = entity_routing
+        self.backend = backend
+        self.unpack_directory = unpack_directory or os.path.splitext(persist_directory)[0]
+        self._snapshot = None
+        self._snapshot_loaded = False
+        self._unpacking = False
+        self._entity_index = None
+        self._vector_index = None
+        self._lexical_index = None
+        self._lexical_index_loaded = False
+        self._fact_store = None
+        self._fact_store_loaded = False
+        self._lock = threading.Lock()
+        self._vector_lock = threading.Lock()  # held while the vector index is opened, maybe unpacked
+
+    @property
+    def embeddings(self) -> Embeddings:
+        """The embedding function, created on first access."""
+        if self._embedding_function is None:
+            with self._lock:
+                if self._embedding_function is None:
+                    self._embedding_function = init_embeddings(self.embedding_model)
+        return self._embedding_function
+
+    @property
+    def snapshot(self) -> SnapshotReader | None:
+        """The snapshot the store is read from, opened on first access, or None if the store is a directory."""
+        if not self._snapshot_loaded:
+            with self._lock:
+                if not self._snapshot_loaded:
+                    if is_snapshot(self.persist_directory):
+                        self._snapshot = SnapshotReader(self.persist_directory)
+                    self._snapshot_loaded = True
+        return self._snapshot
+
+    @property
+    def vector_index(self) -> ChromaIndex | NumpyIndex | ShardedIndex:
+        """The vector index of the store, opened on first access."""
+        if self._vector_index is None:
+            with self._vector_lock:
+                if self._vector_index is None:
+                    self._vector_index = self._open_vector_index()
+        return self._vector_index
+
+    def store_backend(self) -> str:
+        """The backend of the vector index: `backend`, or the one the store was built with."""
+        if self.backend is not None:
+            return self.backend
+        if self.snapshot is not None:
+            return self.snapshot.backend
+        manifest = load_manifest(self.persist_directory) or {}
+        return manifest.get("backend", VECTOR_BACKEND)
+
+    def needs_unpacking(self) -> bool:
+        """Whether opening the vector index unpacks the snapshot first (a Chroma store)."""
+        return (
+            self.snapshot is not None and self.store_backend() == "chroma" and not os.path.isdir(self.unpack_directory)
+        )
+
+    def _open_vector_index(self) -> ChromaIndex | NumpyIndex | ShardedIndex:
+        snapshot = self.snapshot
+        backend = self.store_backend()
+        sharding = (load_manifest(self.persist_directory) or {}).get("sharding", "none")
+        if snapshot is None or backend != "chroma":
+            return open_vector_index(backend, self.persist_directory, snapshot=snapshot, sharding=sharding)
+        if self.needs_unpacking():
+            self._unpacking = True
+            try:
+                with span("unpack"):
+                    snapshot.extract(self.unpack_directory)
+            finally:
+                self._unpacking = False
+        return open_vector_index(backend, self.unpack_directory, sharding=sharding)
+
+    def load(self):
+        """Open the store and load its indexes now instead of on the first question."""
+        _ = self.lexical_index, self.fact_store, self.entity_index, self.vector_index
+
+    def warm_up(self) -> threading.Thread:
+        """Open the store in a background thread (unpacking its snapshot if needed), so the
+        first question does not wait for it. Returns the started thread.
+        """
+        def open_store():
+            try:
+                self.load()
+            except Exception:
+                logger.exception("The vector store could not be opened.")
+            finally:
+                self._unpacking = False
+
+        # set before the thread starts, so the questions asked meanwhile never wait for the unpacking
+        self._unpacking = self._vector_index is None and self.needs_unpacking()
+        thread = threading.Thread(target=open_store, name="warm-up", daemon=True)
+        thread.start()
+        return thread
+
+    @property
+    def lexical_index(self) -> BM25Index | None:
+        """The BM25 index saved next to the store, loaded on first access, or None if there is none."""
+        if not self._lexical_index_loaded:
+            snapshot = self.snapshot
+            with self._lock:
+                if not self._lexical_index_loaded:
+                    path = bm25_index_path(self.persist_directory)
+                    if snapshot is not None:
+                        if BM25_FILENAME in snapshot:
+                            self._lexical_index = BM25Index.from_dict(snapshot.read_json(BM25_FILENAME))
+                    elif os.path.exists(path):
+                        self._lexical_index = BM25Index.load(path)
+                    self._lexical_index_loaded = True
+        return self._lexical_index
+
+    @property
+    def fact_store(self) -> FactStore | None:
+        """The fact table saved next to the store, opened on first access, or None if there is none."""
+        if not self._fact_store_loaded:
+            snapshot = self.snapshot
+            with self._lock:
+                if not self._fact_store_loaded:
+                    path = facts_path(self.persist_directory)
+                    if snapshot is not None:
+                        if FACTS_FILENAME in snapshot:
+                            self._fact_store = FactStore(path, content=snapshot.read_bytes(FACTS_FILENAME))
+                    elif os.path.exists(path):
+                        self._fact_store = FactStore(path)
+                    self._fact_store_loaded = True
+        return self._fact_store
+
+    @property
+    def entity_index(self) -> EntityIndex:
+        """Index of the Pokémon names, with the pages of the BM25 index, built on first access."""
+        if self._entity_index is None:
+            lexical_index = self.lexical_index
+            with self._lock:
+                if self._entity_index is None:
+                    pages = lexical_index.pokemon_chunks if lexical_index is not None else ()
+                    vocabulary = lexical_index.postings if lexical_index is not None else ()
+                    self._entity_index = default_entity_index(extra_names=list(pages), vocabulary=vocabulary)
+        return self._entity_index
+
+    def entity_matches(self, query: str) -> tuple[list[str], list[str]]:
+        """The Pokémon named in the query that have chunks in the store, if entity routing is on:
+        the ones named as written, and the ones only matched through a typo (see `EntityIndex.match`).
+        """
+        if not self.entity_routing:
+            return [], []
+        matches = self.entity_index.match(query)
+        lexical_index = self.lexical_index
+        if lexical_index is not None:
+            matches = tuple([name for name in names if name in lexical_index.pokemon_chunks] for names in matches)
+        return matches
+
+    def entity_pokemon(self, query: str) -> list[str]:
+        """The Pokémon named as written in the query, whose chunks answer it alone."""
+        return self.entity_matches(query)[0]
+
+    def needs_embedding(self, query: str) -> bool:
+        """Whether retrieving the documents of this query calls the embedding model."""
+        if self.lexical_index is None:
+            return True
+        return not (self._unpacking or self.entity_pokemon(query))
+
+    def query_embedding(self, query: str) -> list[float] | None:
+        """The embedding of the query, or None if retrieving its documents needs none
+        (e.g. a question routed to its Pokémon). The chain computes it once and passes it to
+        `get_and_filter_docs` and to the semantic cache.
+        """
+        if not self.needs_embedding(query):
+            return None
+        return self.embed(query)
+
+    def embed(self, text: str) -> list[float]:
+        """Embed a text with the embedding model of the store."""
+        with span("embed"):
+            return self.embeddings.embed_query(text)
+
+    def dense_search(
+        self,
+        query: str,
+        embedding: list[float] | None = None,
+        pokemon: list[str] | None = None,
+    ) -> list[tuple[Document, float]]:
+        """Nearest chunks of the query with their relevance score, among the chunks of the
+        given Pokémon if any. `embedding` is the vector of the query, if it was already computed.
+        With entity routing, the generations named in the query route the search of a sharded store.
+        """
+        if embedding is None:
+            embedding = self.embeddings.embed_query(query)
+        generations = detect_generations(query) if self.entity_routing else None
+        return self.vector_index.search(embedding, k=self.k, pokemon=pokemon, generations=generations)
+
+    def get_entity_docs(
+        self,
+        query: str,
+        pokemon: list[str],
+        embedding: list[float] | None = None,
+    ) -> list[Document]:
+        """Retrieve the documents among the chunks of the given Pokémon only."""
+        lexical_index = self.lexical_index
+        if lexical_index is None:
+            return [doc for doc, _ in self.dense_search(query, embedding, pokemon=pokemon)]
+        intros = [lexical_index.document(lexical_index.pokemon_chunks[name][0]) for name in pokemon]
+        ranked = [doc for doc, _ in lexical_index.search(query, k=self.k, pokemon=pokemon)]
+        docs = {doc_key(doc): doc for doc in intros + ranked}
+        return list(docs.values())[:self.k]
+
+    def lexical_search(self, query: str) -> list[Document]:
+        """Best chunks of the query by BM25, among those covering `lexical_threshold` of it."""
+        lexical_index = self.lexical_index
+        floor = self.lexical_threshold * lexical_index.max_score(query)
+        return [doc for doc, score in lexical_index.search(query, k=self.k) if score >= floor]
+
+    def get_and_filter_docs(
+        self,
+        query: str,
+        embedding: list[float] | None = None,
+        timings: dict[str, float] | None = None,
+    ) -> list[Document]:
+        """Retrieve the documents and filter them directly based on their relevance score.
+        With `max_context_tokens`, the most relevant chunks are kept until it is reached.
+        `embedding` is the vector of the query, if it was already computed (e.g. in a batch).
+        `timings`, if given, receives the seconds spent in each stage (see RETRIEVAL_STAGES).
+        """
+        with span("retrieve") as retrieve_span:
+            docs = self._get_and_filter_docs(query, embedding, timings)
+            if tracing_enabled():
+                context_tokens = sum(estimate_tokens(doc.page_content) for doc in docs)
+                retrieve_span.set(documents=len(docs), context_tokens=context_tokens)
+                count("rag_retrieved_documents_total", len(docs))
+                count("rag_context_tokens_total", context_tokens)
+        return docs
+
+    def _get_and_filter_docs(
+        self,
+        query: str,
+        embedding: list[float] | None,
+        timings: dict[str, float] | None,
+    ) -> list[Document]:
+        with timed(timings, "route"):
+            pokemon, fuzzy_pokemon = self.entity_matches(query)
+            routed = bool(pokemon) and self.lexical_index is not None
+            docs = self.get_entity_docs(query, pokemon) if routed else []
+        if not docs and self._unpacking and self.lexical_index is not None:
+            # the snapshot is being unpacked: BM25 only rather than waiting for the vector index
+            with timed(timings, "lexical"):
+                docs = self.lexical_search(query)
+            with timed(timings, "filter"):
+                return self.fit_token_budget(docs)
+        if not docs:
+            if embedding is None:
+                with timed(timings, "embed"):
+                    embedding = self.embeddings.embed_query(query)
+            with timed(timings, "search"):
+                if pokemon and not routed:
+                    docs = self.get_entity_docs(query, pokemon, embedding)
+                docs_with_scores = self.dense_search(query, embedding) if not docs else []
+        if not docs:
+            with timed(timings, "filter"):
+                docs = [doc for doc, score in docs_with_scores if score >= self.relevance_threshold]
+            rankings, weights = [docs], [self.vector_weight]
+            if self.lexical_weight > 0 and self.lexical_index is not None:
+                with timed(timings, "lexical"):
+                    rankings.append(self.lexical_search(query))
+                weights.append(self.lexical_weight)
+            if fuzzy_pokemon and self.entity_weight > 0:
+                with timed(timings, "route"):
+                    rankings.append(self.get_entity_docs(query, fuzzy_pokemon, embedding))
+                weights.append(self.entity_weight)
+            if len(rankings) > 1:
+                with timed(timings, "filter"):
+                    docs = reciprocal_rank_fusion(rankings, weights, self.rrf_k)[:self.k]
+        with timed(timings, "filter"):
+            return self.fit_token_budget(docs)
+
+    def fit_token_budget(self, docs: list[Document]) -> list[Document]:
+        """Keep the documents, in order, whose total size fits in the per-prompt token budget."""
+        if self.max_context_tokens is None:
+            return docs
+        kept, used = [], 0
+        for doc in docs:
+            tokens = estimate_tokens(doc.page_content)
+            if used + tokens <= self.max_context_tokens:
+                kept.append(doc)
+                used += tokens
+        return kept
+
+    def reset(self):
+        """Drop the opened store so the next query reopens it (e.g. after a rebuild)."""
+        with self._vector_lock, self._lock:
+            self._vector_index = None
+            self._snapshot = None
+            self._snapshot_loaded = False
+            self._lexical_index = None
+            self._lexical_index_loaded = False
+            self._entity_index = None
+            self._fact_store = None
+            self._fact_store_loaded = False
+
+
+_retriever: PokemonRetriever | None = None
+_retriever_lock = threading.Lock()
+
+
+def get_retriever() -> PokemonRetriever:
+    """Return the process-wide retriever, creating it with the default settings if needed."""
+    global _retriever
+    if _retriever is None:
+        with _retriever_lock:
+            if _retriever is None:
+                _retriever = PokemonRetriever()
+    return _retriever
+
+
+def set_retriever(retriever: PokemonRetriever | None):
+    """Inject the process-wide retriever (e.g. another store path, model or threshold).
+    Passing None resets it to the default on next use.
+    """
+    global _retriever
+    with _retriever_lock:
+        _retriever = retriever
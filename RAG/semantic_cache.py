@@ -0,0 +1,239 @@
+import asyncio
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections.abc import AsyncIterator, Iterator
+
+import numpy as np
+from langchain.docstore.document import Document
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda
+
+from .manifest import vectorstore_version
+from .retriever import PERSIST_DIRECTORY, doc_key, get_retriever
+from .tracing import count, span
+
+SEMANTIC_CACHE_PATH = "./semantic_cache.sqlite3"
+SEMANTIC_CACHE_THRESHOLD = 0.92
+SEMANTIC_CACHE_MAX_ENTRIES = 2000
+SEMANTIC_CACHE_TTL = 7 * 24 * 3600  # seconds
+
+PUNCTUATION = re.compile(r"[^\w\s]")
+WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_question(question: str) -> str:
+    """Lower-case the question and remove its punctuation and extra whitespace."""
+    question = unicodedata.normalize("NFC", question).casefold()
+    return WHITESPACE.sub(" ", PUNCTUATION.sub(" ", question)).strip()
+
+
+def context_key(docs: list[Document], namespace: str = "") -> str:
+    """Key of the retrieved context: the sorted ids of the documents, in a namespace
+    (e.g. the LLM model) since the same context gives a different answer with another model.
+    """
+    ids = sorted(doc_key(doc) for doc in docs)
+    return hashlib.sha256("\0".join([namespace, *ids]).encode("utf-8")).hexdigest()
+
+
+class SemanticCache:
+    """Persistent cache of the answers, looked up by meaning rather than by exact prompt.
+
+    A stored answer is returned when a past question is similar enough to the new one
+    (cosine similarity of their embeddings above `threshold`) and the retrieval returned
+    the same documents. Entries expire after `ttl` seconds, the least recently used ones are
+    evicted beyond `max_entries`, and the whole cache is dropped when the vector store changes.
+
+    The cache reuses the query embedding computed for the retrieval. The questions retrieved
+    without one (routed to their Pokémon) are embedded for the cache alone, from their
+    normalized text, so their paraphrases are found too.
+    """
+
+    def __init__(
+        self,
+        path: str = SEMANTIC_CACHE_PATH,
+        threshold: float = SEMANTIC_CACHE_THRESHOLD,
+        max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES,
+        ttl: float = SEMANTIC_CACHE_TTL,
+        persist_directory: str = PERSIST_DIRECTORY,
+    ):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.persist_directory = persist_directory
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS answers (
+                id INTEGER PRIMARY KEY, question TEXT NOT NULL, embedding BLOB NOT NULL,
+                context_key TEXT NOT NULL, answer TEXT NOT NULL, created REAL NOT NULL, last_used REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+            """,
+        )
+        self._load()
+
+    def _load(self):
+        """Load the entries in memory, after dropping them if the vector store was rebuilt."""
+        version = vectorstore_version(self.persist_directory)
+        row = self._connection.execute("SELECT value FROM meta WHERE key = 'vectorstore_version'").fetchone()
+        if row is None or row[0] != version:
+            self._connection.execute("DELETE FROM answers")
+            self._connection.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('vectorstore_version', ?)", (version,),
+            )
+        self._connection.execute("DELETE FROM answers WHERE created < ?", (time.time() - self.ttl,))
+        self._connection.commit()
+        self._version = version
+        rows = self._connection.execute(
+            "SELECT id, embedding, context_key, answer, created FROM answers WHERE length(embedding) > 0",
+        ).fetchall()
+        self._ids = [row[0] for row in rows]
+        self._context_keys = [row[2] for row in rows]
+        self._answers = [row[3] for row in rows]
+        self._created = [row[4] for row in rows]
+        if rows:
+            self._matrix = np.stack([np.frombuffer(row[1], dtype=np.float32) for row in rows])
+        else:
+            self._matrix = np.empty((0, 0), dtype=np.float32)
+
+    @staticmethod
+    def vector(embedding: list[float]) -> np.ndarray:
+        """The query embedding, normalized."""
+        vector = np.asarray(embedding, dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def _find(self, vector: np.ndarray, key: str) -> tuple[int, str] | None:
+        """The id and the answer of the entry matching the question and the context, if any."""
+        if not self._ids or self._matrix.shape[1] != vector.size:
+            return None
+        expiry = time.time() - self.ttl
+        scores = self._matrix @ vector
+        for index in np.argsort(-scores):
+            if scores[index] < self.threshold:
+                break
+            if self._context_keys[index] == key and self._created[index] >= expiry:
+                return self._ids[index], self._answers[index]
+        return None
+
+    def lookup(self, vector: np.ndarray, key: str) -> str | None:
+        """Return the cached answer for a question similar to this one with the same context, if any.
+        `vector` is the normalized embedding of the question (see `vector`).
+        """
+        with self._lock:
+            if vectorstore_version(self.persist_directory) != self._version:
+                self._load()
+            match = self._find(vector, key)
+            answer = None
+            if match is not None:
+                entry_id, answer = match
+                self._connection.execute("UPDATE answers SET last_used = ? WHERE id = ?", (time.time(), entry_id))
+                self._connection.commit()
+                self.hits += 1
+            else:
+                self.misses += 1
+        count("rag_cache_requests_total", cache="semantic", result="miss" if answer is None else "hit")
+        return answer
+
+    def store(self, question: str, vector: np.ndarray, key: str, answer: str):
+        """Store the answer given to a question with this context."""
+        now = time.time()
+        with self._lock:
+            cursor = self._connection.execute(
+                "INSERT INTO answers (question, embedding, context_key, answer, created, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (normalize_question(question), vector.tobytes(), key, answer, now, now),
+            )
+            entries = self._connection.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+            if entries > self.max_entries:
+                self._connection.execute(
+                    "DELETE FROM answers WHERE id IN (SELECT id FROM answers ORDER BY last_used LIMIT ?)",
+                    (entries - self.max_entries,),
+                )
+                self._connection.commit()
+                self._load()
+                return
+            self._connection.commit()
+            self._ids.append(cursor.lastrowid)
+            self._context_keys.append(key)
+            self._answers.append(answer)
+            self._created.append(now)
+            self._matrix = np.vstack([self._matrix.reshape(-1, vector.size), vector])
+
+    def clear(self):
+        """Drop every cached answer."""
+        with self._lock:
+            self._connection.execute("DELETE FROM answers")
+            self._connection.commit()
+            self._load()
+
+    def stats(self) -> dict:
+        """Hit and miss counters of the cache since it was opened."""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self._ids),
+        }
+
+    def wrap(self, answer_chain: Runnable, embedder: Runnable, namespace: str = "") -> Runnable:
+        """Put the cache in front of a chain taking {"question", "embedding", "context"} and returning the answer.
+        `embedder` embeds the normalized question when the retrieval computed no embedding.
+        On a miss, the answer of the chain is streamed as it is generated and stored once complete.
+        """
+        def cached_answer(inputs: dict, config: RunnableConfig) -> Iterator[str]:
+            with span("semantic_cache") as cache_span:
+                key = context_key(inputs["context"], namespace)
+                embedding = inputs.get("embedding")
+                if embedding is None:
+                    embedding = embedder.invoke(normalize_question(inputs["question"]), config)
+                vector = self.vector(embedding)
+                answer = self.lookup(vector, key)
+                cache_span.set(hit=answer is not None)
+            if answer is not None:
+                yield answer
+                return
+            chunks = []
+            for chunk in answer_chain.stream(inputs, config):
+                chunks.append(chunk)
+                yield chunk
+            self.store(inputs["question"], vector, key, "".join(chunks))
+
+        async def acached_answer(inputs: dict, config: RunnableConfig) -> AsyncIterator[str]:
+            with span("semantic_cache") as cache_span:
+                key = context_key(inputs["context"], namespace)
+                embedding = inputs.get("embedding")
+                if embedding is None:
+                    embedding = await embedder.ainvoke(normalize_question(inputs["question"]), config)
+                vector = self.vector(embedding)
+                answer = await asyncio.to_thread(self.lookup, vector, key)
+                cache_span.set(hit=answer is not None)
+            if answer is not None:
+                yield answer
+                return
+            chunks = []
+            async for chunk in answer_chain.astream(inputs, config):
+                chunks.append(chunk)
+                yield chunk
+            await asyncio.to_thread(self.store, inputs["question"], vector, key, "".join(chunks))
+        return RunnableLambda(cached_answer, afunc=acached_answer)
+
+
+_semantic_cache: SemanticCache | None = None
+_semantic_cache_lock = threading.Lock()
+
+
+def get_semantic_cache() -> SemanticCache:
+    """Return the process-wide semantic cache, following the store of the shared retriever."""
+    global _semantic_cache
+    if _semantic_cache is None:
+        with _semantic_cache_lock:
+            if _semantic_cache is None:
+                _semantic_cache = SemanticCache(persist_directory=get_retriever().persist_directory)
+    return _semantic_cache
@@ -0,0 +1,398 @@
+import asyncio
+import contextlib
+import json
+import logging
+import math
+import time
+
+from aiohttp import web
+from langchain.docstore.document import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseLanguageModel
+from langchain_core.runnables import RunnableLambda
+
+from .app import (
+    LLM_MAX_OUTPUT_TOKENS,
+    LLM_MODEL,
+    LLM_TEMPERATURE,
+    answer_from_facts,
+    answer_stats,
+    build_rag_chain,
+    count_answer,
+    flight_key,
+    init_llm,
+    single_flight,
+)
+from .context import get_context_compressor
+from .embedding_cache import embed_queries
+from .retriever import PokemonRetriever, doc_key, get_retriever
+from .semantic_cache import SemanticCache, get_semantic_cache
+from .settings import SERVER_HOST, SERVER_PORT
+from .tracing import render_metrics, span
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_BATCH_MAX_SIZE = 32
+EMBEDDING_BATCH_MAX_WAIT = 0.005  # seconds
+LLM_MAX_IN_FLIGHT = 8
+LLM_MAX_QUEUED = 32
+
+
+class QueryEmbeddingBatcher:
+    """Group the query embeddings of concurrent requests into batches.
+
+    A batch is sent as soon as it holds `max_batch_size` questions, or `max_wait` seconds
+    after its first question, so a lone request waits at most `max_wait` while a burst of
+    requests costs one embedding call per batch instead of one per request.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        max_batch_size: int = EMBEDDING_BATCH_MAX_SIZE,
+        max_wait: float = EMBEDDING_BATCH_MAX_WAIT,
+    ):
+        self.embeddings = embeddings
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queries = 0
+        self.batches = 0
+        self._pending = []
+        self._timer = None
+        self._tasks = set()
+
+    async def embed_query(self, text: str) -> list[float]:
+        """Embed a question, together with the other questions asked in the meantime."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.create_task(self._embed_batch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _embed_batch(self, batch: list[tuple[str, asyncio.Future]]):
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        self.queries += len(batch)
+        self.batches += 1
+        try:
+            vectors = await asyncio.to_thread(embed_queries, self.embeddings, texts)
+        except Exception as e:  # noqa: BLE001 - raised in every request of the batch
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        vectors = dict(zip(texts, vectors, strict=True))
+        for text, future in batch:
+            if not future.done():  # the request may have been cancelled
+                future.set_result(vectors[text])
+
+    def stats(self) -> dict:
+        """Number of questions embedded and of embedding calls since the start."""
+        return {
+            "queries": self.queries,
+            "batches": self.batches,
+            "average_batch_size": self.queries / self.batches if self.batches else 0.0,
+        }
+
+
+class Overloaded(Exception):
+    """Raised when a request cannot even be queued; `retry_after` is in seconds."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Server overloaded, retry after {retry_after} s")
+        self.retry_after = retry_after
+
+
+class AdmissionQueue:
+    """Bound the LLM calls: at most `max_in_flight` run at once and at most `max_queued`
+    wait for a slot. Beyond that, `slot` raises `Overloaded` instead of queuing, with a
+    retry delay estimated from the recent call durations.
+    """
+
+    def __init__(self, max_in_flight: int = LLM_MAX_IN_FLIGHT, max_queued: int = LLM_MAX_QUEUED):
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.running = 0
+        self.queued = 0
+        self.rejected = 0
+        self.average_duration = 1.0  # seconds, moving average of the calls
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+
+    def retry_after(self) -> int:
+        """Seconds until the queue is expected to have room again."""
+        return max(1, math.ceil(self.average_duration * (self.queued + 1) / self.max_in_flight))
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        """Wait for a free slot, or raise `Overloaded` if the queue is full."""
+        if self._semaphore.locked() and self.queued >= self.max_queued:
+            self.rejected += 1
+            raise Overloaded(self.retry_after())
+        self.queued += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.queued -= 1
+        self.running += 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.running -= 1
+            self._semaphore.release()
+            self.average_duration = 0.8 * self.average_duration + 0.2 * (time.perf_counter() - start)
+
+    def stats(self) -> dict:
+        """Current load of the queue and number of rejected requests."""
+        return {
+            "in_flight": self.running,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "max_in_flight": self.max_in_flight,
+            "max_queued": self.max_queued,
+        }
+
+
+def document_json(doc: Document) -> dict:
+    """A retrieved chunk as returned by the API."""
+    return {"id": doc_key(doc), "content": doc.page_content, "metadata": doc.metadata}
+
+
+async def read_question(request: web.Request) -> tuple[str, dict]:
+    """The question of a JSON request body {"question": "..."}, and the whole body."""
+    try:
+        payload = await request.json()
+    except json.JSONDecodeError:
+        raise web.HTTPBadRequest(reason="The body must be JSON")
+    question = payload.get("question") if isinstance(payload, dict) else None
+    if not isinstance(question, str) or not question.strip():
+        raise web.HTTPBadRequest(reason="Missing 'question'")
+    return question, payload
+
+
+async def write_lines(request: web.Request, lines) -> web.StreamResponse:
+    """Stream JSON objects to the client, one per line, as they are produced."""
+    response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+    await response.prepare(request)
+    async for line in lines:
+        await response.write((json.dumps(line, ensure_ascii=False) + "\n").encode("utf-8"))
+    await response.write_eof()
+    return response
+
+
+async def prepend(first, rest):
+    """An async iterator of `first` then of the items of `rest`."""
+    yield first
+    async for item in rest:
+        yield item
+
+
+class RAGServer:
+    """HTTP API of the RAG application, served with aiohttp:
+
+        POST /ask       {"question": "...", "stream": false} -> {"answer": "...", "documents": [...]}
+        POST /retrieve  {"question": "..."} -> {"documents": [...]}
+        GET  /health    -> load and counters of the server
+        GET  /metrics   -> the same counters and, with tracing on, the stage durations,
+                           tokens and cache hits, in the Prometheus text format
+
+    With "stream": true, /ask answers with JSON lines: the documents first, then the answer
+    chunks as they are generated. The chain runs with the async LangChain interfaces, the
+    query embeddings of concurrent requests are batched by a `QueryEmbeddingBatcher` and the
+    LLM calls are bounded by an `AdmissionQueue` (503 with Retry-After when it is full).
+    Identical questions asked while one is being answered share its execution (`single_flight`).
+    """
+
+    def __init__(
+        self,
+        llm: BaseLanguageModel,
+        retriever: PokemonRetriever | None = None,
+        semantic_cache: SemanticCache | None = None,
+        cache_namespace: str = "",
+        max_batch_size: int = EMBEDDING_BATCH_MAX_SIZE,
+        max_wait: float = EMBEDDING_BATCH_MAX_WAIT,
+        max_in_flight: int = LLM_MAX_IN_FLIGHT,
+        max_queued: int = LLM_MAX_QUEUED,
+    ):
+        self.retriever = retriever or get_retriever()
+        self.batcher = QueryEmbeddingBatcher(self.retriever.embeddings, max_batch_size, max_wait)
+        self.admission = AdmissionQueue(max_in_flight, max_queued)
+        self.rag_chain = build_rag_chain(
+            llm,
+            semantic_cache=semantic_cache,
+            cache_namespace=cache_namespace,
+            retriever_with_filter=RunnableLambda(
+                lambda inputs: self.retriever.get_and_filter_docs(inputs["question"], inputs["embedding"]),
+                afunc=self.aretrieve_step,
+            ),
+            query_embedder=RunnableLambda(self.retriever.query_embedding, afunc=self.aembed),
+            cache_embedder=RunnableLambda(self.retriever.embed, afunc=self.aembed_text),
+        )
+
+    def warm_up(self):
+        """Open the store and load the indexes before serving the first request."""
+        self.retriever.load()
+
+    async def aembed(self, query: str) -> list[float] | None:
+        """Embed a query in a batch with the concurrent queries, if its retrieval needs an embedding."""
+        if not self.retriever.needs_embedding(query):
+            return None
+        return await self.aembed_text(query)
+
+    async def aembed_text(self, text: str) -> list[float]:
+        """Embed a text in a batch with the concurrent ones."""
+        with span("embed", batched=True):
+            return await self.batcher.embed_query(text)
+
+    async def aretrieve(self, query: str, embedding: list[float] | None = None) -> list[Document]:
+        """Retrieve the documents of a query, embedding it in a batch with the concurrent queries."""
+        if embedding is None:
+            embedding = await self.aembed(query)
+        return await asyncio.to_thread(self.retriever.get_and_filter_docs, query, embedding)
+
+    async def aretrieve_step(self, inputs: dict) -> list[Document]:
+        """The retrieval step of the chain, with the embedding shared with the semantic cache."""
+        return await self.aretrieve(inputs["question"], inputs["embedding"])
+
+    async def health(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "status": "ok",
+            "llm": self.admission.stats(),
+            "embeddings": self.batcher.stats(),
+            "answers": answer_stats(),
+            "context": get_context_compressor().stats(),
+            "coalescing": single_flight.stats(),
+        })
+
+    async def metrics(self, request: web.Request) -> web.Response:
+        llm, embeddings, answers = self.admission.stats(), self.batcher.stats(), answer_stats()
+        context, coalescing = get_context_compressor().stats(), single_flight.stats()
+        gauges = {
+            "rag_llm_in_flight": llm["in_flight"],
+            "rag_llm_queued": llm["queued"],
+            "rag_llm_rejected_total": llm["rejected"],
+            "rag_embedding_queries_total": embeddings["queries"],
+            "rag_embedding_batches_total": embeddings["batches"],
+            "rag_fact_answers_total": answers["facts"],
+            "rag_chain_answers_total": answers["rag"],
+            "rag_context_input_tokens_total": context["input_tokens"],
+            "rag_context_output_tokens_total": context["output_tokens"],
+            "rag_chain_executions_total": coalescing["executions"],
+            "rag_coalesced_requests_total": coalescing["coalesced"],
+        }
+        return web.Response(text=render_metrics(gauges), content_type="text/plain", charset="utf-8")
+
+    @web.middleware
+    async def trace_request(self, request: web.Request, handler) -> web.StreamResponse:
+        """Trace every request, from its reception to the end of its (possibly streamed) response."""
+        with span("request", method=request.method, path=request.path) as request_span:
+            response = await handler(request)
+            request_span.set(status=response.status)
+            return response
+
+    async def retrieve(self, request: web.Request) -> web.Response:
+        question, _ = await read_question(request)
+        docs = await self.aretrieve(question)
+        return web.json_response({"documents": [document_json(doc) for doc in docs]})
+
+    async def run_chain(self, question: str) -> dict:
+        """Answer with the chain once a slot of the admission queue is free."""
+        async with self.admission.slot():
+            return await self.rag_chain.ainvoke(question)
+
+    async def stream_chain(self, question: str):
+        """Stream the chunks of the chain once a slot of the admission queue is free."""
+        async with self.admission.slot():
+            async for chunk in self.rag_chain.astream(question):
+                yield chunk
+
+    async def answer_lines(self, first: dict, chunks):
+        """The JSON lines of a streamed answer, from its chunks."""
+        async for chunk in prepend(first, chunks):
+            if "context" in chunk:
+                yield {"documents": [document_json(doc) for doc in chunk["context"]]}
+            if "answer" in chunk:
+                yield {"answer": chunk["answer"]}
+
+    async def ask(self, request: web.Request) -> web.StreamResponse:
+        question, payload = await read_question(request)
+        stream = bool(payload.get("stream"))
+        answer = answer_from_facts(question, retriever=self.retriever)
+        if answer is not None:
+            count_answer("facts")
+            result = {"answer": answer, "documents": []}
+            if stream:
+                async def single_line():
+                    yield result
+                return await write_lines(request, single_line())
+            return web.json_response(result)
+        # identical questions in flight share one execution, and one slot of the admission queue
+        try:
+            if stream:
+                chunks = single_flight.astream(
+                    flight_key("stream", question, self.rag_chain), lambda: self.stream_chain(question),
+                )
+                first = await anext(chunks)
+                count_answer("rag")
+                return await write_lines(request, self.answer_lines(first, chunks))
+            result = await single_flight.ainvoke(
+                flight_key("invoke", question, self.rag_chain), lambda: self.run_chain(question),
+            )
+            count_answer("rag")
+            return web.json_response({
+                "answer": result["answer"],
+                "documents": [document_json(doc) for doc in result["context"]],
+            })
+        except Overloaded as e:
+            return web.json_response(
+                {"error": str(e)}, status=503, headers={"Retry-After": str(e.retry_after)},
+            )
+
+    def create_app(self) -> web.Application:
+        """The aiohttp application serving this RAG server."""
+        application = web.Application(middlewares=[self.trace_request])
+        application.add_routes([
+            web.post("/ask", self.ask),
+            web.post("/retrieve", self.retrieve),
+            web.get("/health", self.health),
+            web.get("/metrics", self.metrics),
+        ])
+        return application
+
+
+def create_server(
+    llm: BaseLanguageModel | None = None,
+    retriever: PokemonRetriever | None = None,
+    semantic_cache: SemanticCache | None = None,
+    **options,
+) -> RAGServer:
+    """The RAG server as `serve` runs it, with the default model, store and semantic cache
+    unless they are given.
+    """
+    return RAGServer(
+        llm or init_llm(),
+        retriever=retriever,
+        semantic_cache=semantic_cache or get_semantic_cache(),
+        cache_namespace=f"{LLM_MODEL}:{LLM_TEMPERATURE}:{LLM_MAX_OUTPUT_TOKENS}",
+        **options,
+    )
+
+
+def serve(host: str = SERVER_HOST, port: int = SERVER_PORT, **options):
+    """Serve the RAG application over HTTP with the default model, store and caches."""
+    server = create_server(**options)
+    server.warm_up()
+    logger.info(f"Serving the RAG API on http://{host}:{port} (POST /ask, POST /retrieve, GET /health, GET /metrics)")
+    web.run_app(server.create_app(), host=host, port=port, print=None)
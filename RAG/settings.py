@@ -0,0 +1,26 @@
+"""Settings read by the command line as well as by the modules that use them.
+This module must stay free of heavy imports, so that `python -m RAG --help` stays fast.
+"""
+import os
+
+# Vector index of the store, see vector_index.py
+VECTOR_BACKENDS = ("chroma", "numpy")
+VECTOR_BACKEND = "chroma"
+NUMPY_DTYPES = ("float32", "float16")
+# Quantized codes scanned instead of the vectors by the NumPy backend
+QUANTIZATIONS = ("none", "int8", "pq")
+# Layout of the store: one index, or one index per generation searched only when relevant
+SHARDINGS = ("none", "generation")
+SHARDING = "none"
+# Single-file copy of the vector store shipped with the application, see snapshot.py
+SNAPSHOT_PATH = "./chroma_db.snapshot"
+
+# HTTP API, see server.py
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8000
+
+# Evaluation, see eval.py
+EVAL_QUESTIONS_PATH = os.path.join(os.path.dirname(__file__), "eval_questions.json")
+EVAL_CONCURRENCY = 4
+JUDGES = ("gemini", "stub")
+GENERATORS = ("gemini", "stub")
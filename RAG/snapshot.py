@@ -0,0 +1,220 @@
+"""Single-file snapshots of a vector store, to ship it with the application.
+
+A snapshot holds every file of the store directory (vectors or Chroma database, BM25 index,
+fact table, manifest) one after the other, after a header listing them:
+
+    preamble   magic b"RAGSNAP\\0", format version, header size, CRC-32 of the header
+    header     JSON: format version, creation time, backend, and the name, offset, size and
+               SHA-256 of every file
+    files      the content of every file, each starting on a SNAPSHOT_ALIGNMENT boundary
+
+Nothing is compressed, so a snapshot can be read in place: the .npy matrices of the NumPy
+backend are memory-mapped from it and the small files read directly, with no unpacking.
+A Chroma store needs real files and is unpacked to a directory, streaming the files and
+checking their checksums.
+"""
+import copy
+import hashlib
+import json
+import logging
+import os
+import shutil
+import struct
+import time
+import zlib
+from collections.abc import Iterator
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_MAGIC = b"RAGSNAP\0"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_ALIGNMENT = 4096
+SNAPSHOT_BLOCK_SIZE = 1 << 20
+# magic, format version, header size, CRC-32 of the header
+PREAMBLE = struct.Struct("<8sIII")
+
+
+def is_snapshot(path: str) -> bool:
+    """Whether the path is a snapshot file (rather than a store directory)."""
+    if not os.path.isfile(path):
+        return False
+    with open(path, "rb") as f:
+        return f.read(len(SNAPSHOT_MAGIC)) == SNAPSHOT_MAGIC
+
+
+def aligned(offset: int) -> int:
+    return -(-offset // SNAPSHOT_ALIGNMENT) * SNAPSHOT_ALIGNMENT
+
+
+def store_files(persist_directory: str) -> list[str]:
+    """Files of a store directory, as sorted relative paths with "/" separators."""
+    names = []
+    for root, _, files in os.walk(persist_directory):
+        for filename in files:
+            if not filename.endswith(".tmp"):
+                path = os.path.relpath(os.path.join(root, filename), persist_directory)
+                names.append(path.replace(os.sep, "/"))
+    return sorted(names)
+
+
+def export_snapshot(persist_directory: str, path: str, backend: str) -> dict:
+    """Write the store directory to a snapshot file, atomically, and return its header.
+    The store must not be written to meanwhile.
+    """
+    if not os.path.isdir(persist_directory):
+        raise ValueError(f"There is no vector store at '{persist_directory}'.")
+    names = store_files(persist_directory)
+    files, offset = [], 0
+    for name in names:
+        size = os.path.getsize(os.path.join(persist_directory, name))
+        files.append({"name": name, "offset": offset, "size": size, "sha256": "0" * 64})
+        offset = aligned(offset + size)
+    header = {"version": SNAPSHOT_VERSION, "created": time.time(), "backend": backend, "files": files}
+    # The checksums are filled in while copying: their placeholders have the same size,
+    # so the offsets (relative to the end of the header) do not move
+    header_size = len(json.dumps(header).encode("utf-8"))
+    start = aligned(PREAMBLE.size + header_size)
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as out:
+        for entry in files:
+            out.seek(start + entry["offset"])
+            digest = hashlib.sha256()
+            with open(os.path.join(persist_directory, entry["name"]), "rb") as f:
+                for block in iter(lambda: f.read(SNAPSHOT_BLOCK_SIZE), b""):
+                    digest.update(block)
+                    out.write(block)
+            entry["sha256"] = digest.hexdigest()
+        out.truncate(max(out.tell(), start))
+        data = json.dumps(header).encode("utf-8")
+        out.seek(0)
+        out.write(PREAMBLE.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(data), zlib.crc32(data)) + data)
+    os.replace(tmp_path, path)
+    logger.info(f"Snapshot of '{persist_directory}' written to '{path}' ({len(files)} files, {os.path.getsize(path) / 1e6:.1f} MB).")
+    return header
+
+
+class SnapshotReader:
+    """Read the files of a snapshot in place. The header is checked when the snapshot is
+    opened, the content of a file when it is read whole, streamed or unpacked, and the
+    memory-mapped arrays only by `verify`.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            preamble = f.read(PREAMBLE.size)
+            if len(preamble) < PREAMBLE.size or preamble[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+                raise ValueError(f"'{path}' is not a vector store snapshot.")
+            _, version, header_size, crc = PREAMBLE.unpack(preamble)
+            if version > SNAPSHOT_VERSION:
+                raise ValueError(f"The snapshot '{path}' has the format {version}, this version reads up to {SNAPSHOT_VERSION}.")
+            data = f.read(header_size)
+        if len(data) != header_size or zlib.crc32(data) != crc:
+            raise ValueError(f"The header of the snapshot '{path}' is corrupted.")
+        self.header = json.loads(data)
+        self.backend = self.header["backend"]
+        self.files = {entry["name"]: entry for entry in self.header["files"]}
+        self._start = aligned(PREAMBLE.size + header_size)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.files
+
+    def subdirectory(self, directory: str) -> "SnapshotReader":
+        """The files of a subdirectory of the store, named relative to it."""
+        view = copy.copy(self)
+        prefix = directory.rstrip("/") + "/"
+        view.files = {name[len(prefix):]: entry for name, entry in self.files.items() if name.startswith(prefix)}
+        return view
+
+    def entry(self, name: str) -> dict:
+        if name not in self.files:
+            raise FileNotFoundError(f"There is no '{name}' in the snapshot '{self.path}'.")
+        return self.files[name]
+
+    def offset(self, name: str) -> int:
+        """Position of the content of a file in the snapshot."""
+        return self._start + self.entry(name)["offset"]
+
+    def iter_blocks(self, name: str) -> Iterator[bytes]:
+        """The content of a file, in blocks of at most SNAPSHOT_BLOCK_SIZE bytes, checked
+        against its checksum once read whole.
+        """
+        entry = self.entry(name)
+        digest = hashlib.sha256()
+        with open(self.path, "rb") as f:
+            f.seek(self.offset(name))
+            remaining = entry["size"]
+            while remaining:
+                block = f.read(min(remaining, SNAPSHOT_BLOCK_SIZE))
+                if not block:
+                    raise ValueError(f"The snapshot '{self.path}' is truncated.")
+                remaining -= len(block)
+                digest.update(block)
+                yield block
+        if digest.hexdigest() != entry["sha256"]:
+            raise ValueError(f"The file '{name}' of the snapshot '{self.path}' is corrupted.")
+
+    def read_bytes(self, name: str) -> bytes:
+        return b"".join(self.iter_blocks(name))
+
+    def read_json(self, name: str):
+        return json.loads(self.read_bytes(name))
+
+    def open_array(self, name: str) -> np.ndarray:
+        """A .npy file of the snapshot, memory-mapped (read only)."""
+        with open(self.path, "rb") as f:
+            f.seek(self.offset(name))
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            data_offset = f.tell()
+        if not np.prod(shape):
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(
+            self.path, dtype=dtype, mode="r", offset=data_offset, shape=shape, order="F" if fortran_order else "C",
+        )
+
+    def verify(self) -> list[str]:
+        """Names of the files whose content does not match their checksum."""
+        corrupted = []
+        for name in self.files:
+            try:
+                for _ in self.iter_blocks(name):
+                    pass
+            except ValueError:
+                corrupted.append(name)
+        return corrupted
+
+    def extract(self, directory: str):
+        """Unpack the files to a directory, replacing it atomically if it exists."""
+        start = time.perf_counter()
+        tmp_directory = f"{directory.rstrip('/' + os.sep)}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp_directory, ignore_errors=True)
+        try:
+            for name in self.files:
+                path = os.path.join(tmp_directory, *name.split("/"))
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, "wb") as f:
+                    f.writelines(self.iter_blocks(name))
+            old_directory = None
+            if os.path.exists(directory):
+                old_directory = f"{tmp_directory}.old"
+                os.replace(directory, old_directory)
+            os.replace(tmp_directory, directory)
+            if old_directory is not None:
+                shutil.rmtree(old_directory, ignore_errors=True)
+        finally:
+            shutil.rmtree(tmp_directory, ignore_errors=True)
+        logger.info(f"Snapshot '{self.path}' unpacked to '{directory}' in {time.perf_counter() - start:.1f} s.")
+
+
+def import_snapshot(path: str, persist_directory: str) -> SnapshotReader:
+    """Unpack a snapshot to the store directory, replacing the store there if any."""
+    snapshot = SnapshotReader(path)
+    snapshot.extract(persist_directory)
+    return snapshot
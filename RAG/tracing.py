@@ -0,0 +1,251 @@
+"""Opt-in tracing and metrics of the RAG pipeline.
+
+A question opens a trace made of spans (retrieval stages, context assembly, generation,
+caches...) with their timings and attributes. When the root span ends, the trace is logged
+(one line, structured with `JsonFormatter`) and the durations and counters feed the
+metrics of the process, rendered in the Prometheus text format by `render_metrics`.
+
+Tracing is off unless the RAG_TRACING environment variable is set or `enable_tracing` is
+called: `span` then returns a shared no-op object, so the instrumentation costs a function call.
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Self
+
+logger = logging.getLogger(__name__)
+
+TRACING_ENV = "RAG_TRACING"
+# Upper bounds of the duration histograms, in seconds
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRIC_HELP = {
+    "rag_stage_duration_seconds": "Duration of the stages of the RAG pipeline.",
+    "rag_llm_tokens_total": "Tokens sent to and generated by the LLM.",
+    "rag_retrieved_documents_total": "Documents passed to the LLM as context.",
+    "rag_context_tokens_total": "Estimated tokens of the context passed to the LLM.",
+    "rag_cache_requests_total": "Lookups of the embedding and semantic caches.",
+    "rag_answers_total": "Answers given by the fact table and by the RAG chain.",
+}
+
+_enabled = os.environ.get(TRACING_ENV, "").lower() not in ("", "0", "false", "no")
+_current_span: ContextVar["Span | None"] = ContextVar("rag_current_span", default=None)
+
+
+def enable_tracing(enabled: bool = True):
+    """Turn the tracing and the metrics on or off for the whole process."""
+    global _enabled
+    _enabled = enabled
+
+
+def tracing_enabled() -> bool:
+    return _enabled
+
+
+class Metrics:
+    """Counters and duration histograms, labelled like the Prometheus metrics."""
+
+    def __init__(self, buckets: tuple[float, ...] = DURATION_BUCKETS):
+        self.buckets = buckets
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1.0, **labels: str):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, **labels: str):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram["buckets"][index] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def render(self, gauges: dict[str, float] | None = None) -> str:
+        """The metrics in the Prometheus text format, with the given gauges (name -> value)."""
+        lines = []
+        declared = set()
+
+        def declare(name, kind):
+            if name not in declared:
+                declared.add(name)
+                if name in METRIC_HELP:
+                    lines.append(f"# HELP {name} {METRIC_HELP[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items())
+        for (name, labels), value in counters:
+            declare(name, "counter")
+            lines.append(f"{name}{format_labels(labels)} {value:g}")
+        for (name, labels), histogram in histograms:
+            declare(name, "histogram")
+            for bound, count in zip(self.buckets, histogram["buckets"], strict=True):
+                lines.append(f"{name}_bucket{format_labels(labels + (('le', f'{bound:g}'),))} {count}")
+            lines.append(f"{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {histogram['count']}")
+            lines.append(f"{name}_sum{format_labels(labels)} {histogram['sum']:g}")
+            lines.append(f"{name}_count{format_labels(labels)} {histogram['count']}")
+        for name, value in sorted((gauges or {}).items()):
+            declare(name, "counter" if name.endswith("_total") else "gauge")
+            lines.append(f"{name} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels: tuple[tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+metrics = Metrics()
+
+
+def count(name: str, value: float = 1.0, **labels: str):
+    """Add `value` to a counter of the process, if tracing is on."""
+    if _enabled:
+        metrics.inc(name, value, **labels)
+
+
+def render_metrics(gauges: dict[str, float] | None = None) -> str:
+    """The metrics of the process in the Prometheus text format, see `Metrics.render`."""
+    return metrics.render(gauges)
+
+
+class Trace:
+    """The spans of one question (or request), logged when its root span ends."""
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex[:16]
+        self.start = time.perf_counter()
+        self.spans = []
+
+    def to_dict(self) -> dict:
+        spans = sorted(self.spans, key=lambda span: span.start)
+        return {"trace_id": self.id, "spans": [span.to_dict() for span in spans]}
+
+
+class Span:
+    """A timed stage of a trace. Used as a context manager it becomes the parent of the
+    spans opened inside it, in the same thread or task and in the ones it starts.
+    Otherwise it is ended by calling `end` (e.g. from LangChain callbacks).
+    """
+
+    def __init__(self, name: str, attributes: dict, parent: "Span | None" = None):
+        self.name = name
+        self.attributes = attributes
+        self.parent = parent
+        self.trace = parent.trace if parent is not None else Trace()
+        self.id = uuid.uuid4().hex[:8]
+        self.start = time.perf_counter()
+        self.duration = None
+        self._token = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def end(self):
+        if self.duration is not None:
+            return
+        self.duration = time.perf_counter() - self.start
+        self.trace.spans.append(self)
+        metrics.observe("rag_stage_duration_seconds", self.duration, stage=self.name)
+        if self.parent is None:
+            log_trace(self)
+
+    def __enter__(self) -> Self:
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if isinstance(exc_value, Exception):
+            self.attributes["error"] = type(exc_value).__name__
+        try:
+            _current_span.reset(self._token)
+        except ValueError:  # ended in another context, e.g. a generator closed elsewhere
+            _current_span.set(self.parent)
+        self.end()
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "span_id": self.id,
+            "parent_id": self.parent.id if self.parent is not None else None,
+            "start_ms": round((self.start - self.trace.start) * 1000, 3),
+            "duration_ms": round(self.duration * 1000, 3),
+            **self.attributes,
+        }
+
+
+class NoopSpan:
+    """Span returned while tracing is off."""
+
+    def set(self, **attributes):
+        pass
+
+    def end(self):
+        pass
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+NOOP_SPAN = NoopSpan()
+
+
+def span(name: str, **attributes) -> Span | NoopSpan:
+    """A started span of the current trace (a new trace if there is none), to use with
+    `with` or to end explicitly.
+    """
+    if not _enabled:
+        return NOOP_SPAN
+    return Span(name, attributes, _current_span.get())
+
+
+def log_trace(root: Span):
+    """Log a finished trace: the duration of every stage in the message, and the whole
+    trace in the `trace` attribute of the record, written out by `JsonFormatter`.
+    """
+    trace = root.trace.to_dict()
+    trace["name"] = root.name
+    trace["duration_ms"] = round(root.duration * 1000, 3)
+    stages = ", ".join(f"{span['name']} {span['duration_ms']:.1f} ms" for span in trace["spans"] if span["span_id"] != root.id)
+    logger.info(f"Trace {root.name} {trace['duration_ms']:.1f} ms" + (f": {stages}" if stages else ""), extra={"trace": trace})
+
+
+class JsonFormatter(logging.Formatter):
+    """Log records as JSON objects, one per line, with the trace of the traced records."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if hasattr(record, "trace"):
+            entry["trace"] = record.trace
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
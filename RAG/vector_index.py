@@ -0,0 +1,623 @@
+import io
+import json
+import math
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from langchain.docstore.document import Document
+from langchain_core.embeddings import Embeddings
+
+from .settings import QUANTIZATIONS, SHARDINGS, VECTOR_BACKENDS
+from .snapshot import SnapshotReader
+
+NUMPY_VECTORS_FILENAME = "vectors.npy"
+NUMPY_METADATA_FILENAME = "vectors_meta.json"
+NUMPY_CODES_FILENAME = "vectors_codes.npy"
+NUMPY_QUANTIZER_FILENAME = "vectors_quantizer.npz"
+SHARDS_FILENAME = "shards.json"
+CHROMA_COLLECTION = "langchain"
+# Shards searched at the same time by a query that is not routed to a few of them
+SHARD_WORKERS = 8
+# Rows scored at once when the matrix is not float32, to bound the memory of the conversion
+NUMPY_BLOCK_ROWS = 512
+# Candidates of the quantized scan re-ranked with the exact vectors, per result
+RERANK_FACTOR = 4
+PQ_SUBSPACES = 96
+PQ_CENTROIDS = 256
+PQ_ITERATIONS = 10
+PQ_TRAIN_SIZE = 20000
+
+
+def euclidean_relevance(similarities: np.ndarray) -> np.ndarray:
+    """Relevance score of unit vectors from their cosine similarity, on the same scale as
+    Chroma's default (1 - squared L2 distance / sqrt(2)), so the relevance threshold means
+    the same thing with both backends.
+    """
+    return 1.0 - (2.0 - 2.0 * similarities) / math.sqrt(2)
+
+
+def train_int8(vectors: np.ndarray) -> dict[str, np.ndarray]:
+    """Scale of every dimension for a symmetric int8 quantization: its largest absolute value / 127."""
+    scale = np.abs(vectors).max(axis=0).astype(np.float32) / 127
+    return {"scale": np.where(scale > 0, scale, 1.0).astype(np.float32)}
+
+
+def encode_int8(vectors: np.ndarray, quantizer: dict[str, np.ndarray]) -> np.ndarray:
+    return np.clip(np.rint(vectors / quantizer["scale"]), -127, 127).astype(np.int8)
+
+
+def pq_subspaces(dimensions: int) -> int:
+    """Number of subspaces of the product quantization, dividing the vector size."""
+    return math.gcd(dimensions, PQ_SUBSPACES)
+
+
+def train_pq(vectors: np.ndarray, seed: int = 0) -> dict[str, np.ndarray]:
+    """Product quantization codebooks: the vectors are cut into `pq_subspaces` slices and
+    every slice is clustered into PQ_CENTROIDS centroids by k-means, on at most
+    PQ_TRAIN_SIZE vectors.
+    """
+    rng = np.random.default_rng(seed)
+    if len(vectors) > PQ_TRAIN_SIZE:
+        vectors = vectors[rng.choice(len(vectors), PQ_TRAIN_SIZE, replace=False)]
+    subspaces = pq_subspaces(vectors.shape[1])
+    slices = vectors.reshape(len(vectors), subspaces, -1)
+    centroids = min(PQ_CENTROIDS, len(vectors))
+    codebooks = np.empty((subspaces, centroids, slices.shape[2]), dtype=np.float32)
+    for m in range(subspaces):
+        points = slices[:, m]
+        codebook = points[rng.choice(len(points), centroids, replace=False)].copy()
+        for _ in range(PQ_ITERATIONS):
+            assignment = nearest_centroids(points, codebook)
+            counts = np.bincount(assignment, minlength=centroids)[:, None]
+            sums = np.stack([np.bincount(assignment, weights=column, minlength=centroids) for column in points.T], axis=1)
+            codebook = np.where(counts > 0, sums / np.maximum(counts, 1), codebook).astype(np.float32)
+        codebooks[m] = codebook
+    return {"codebooks": codebooks}
+
+
+def nearest_centroids(points: np.ndarray, codebook: np.ndarray) -> np.ndarray:
+    """Index of the nearest centroid of every point."""
+    return np.argmin((codebook * codebook).sum(axis=1) - 2 * points @ codebook.T, axis=1)
+
+
+def encode_pq(vectors: np.ndarray, quantizer: dict[str, np.ndarray]) -> np.ndarray:
+    """Centroid of every vector in every subspace, one row per subspace (subspaces x vectors),
+    so the scan reads each subspace contiguously.
+    """
+    codebooks = quantizer["codebooks"]
+    slices = vectors.reshape(len(vectors), len(codebooks), -1)
+    return np.stack(
+        [nearest_centroids(slices[:, m], codebook) for m, codebook in enumerate(codebooks)],
+    ).astype(np.uint8)
+
+
+QUANTIZERS = {"int8": (train_int8, encode_int8), "pq": (train_pq, encode_pq)}
+
+
+class ChromaIndex:
+    """The chunks and their vectors in a persistent Chroma collection (approximate HNSW search)."""
+
+    backend = "chroma"
+    dirty = False
+
+    def __init__(
+        self,
+        persist_directory: str,
+        embeddings: Embeddings | None = None,
+        collection_name: str = CHROMA_COLLECTION,
+    ):
+        from langchain_chroma import Chroma
+
+        self.persist_directory = persist_directory
+        self.vectorstore = Chroma(
+            collection_name=collection_name, persist_directory=persist_directory, embedding_function=embeddings,
+        )
+
+    def count(self) -> int:
+        return self.vectorstore._collection.count()
+
+    def get_all(self) -> tuple[list[str], list[str], list[dict]]:
+        """Ids, texts and metadata of every chunk, in no particular order."""
+        stored = self.vectorstore._collection.get(include=["documents", "metadatas"])
+        return stored["ids"], stored["documents"], stored["metadatas"]
+
+    def upsert(self, ids: list[str], embeddings: list[list[float]], documents: list[str], metadatas: list[dict]):
+        self.vectorstore._collection.upsert(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+
+    def delete(self, ids: list[str]):
+        if ids:
+            self.vectorstore.delete(ids=ids)
+
+    def reset(self):
+        self.vectorstore.reset_collection()
+
+    def drop(self):
+        """Delete the collection from the store."""
+        self.vectorstore.delete_collection()
+
+    def persist(self, quantize: bool = True):
+        """Chroma writes every change to disk as it is made."""
+
+    def search(
+        self,
+        embedding: list[float],
+        k: int,
+        pokemon: list[str] | None = None,
+        generations: list[int] | None = None,
+    ) -> list[tuple[Document, float]]:
+        """Nearest chunks of a query vector with their relevance score, among the chunks
+        of the given Pokémon if any. `generations` only routes the search of a `ShardedIndex`.
+        """
+        where = None
+        if pokemon:
+            where = {"pokemon": pokemon[0]} if len(pokemon) == 1 else {"pokemon": {"$in": pokemon}}
+        relevance = self.vectorstore._select_relevance_score_fn()
+        docs_with_distances = self.vectorstore.similarity_search_by_vector_with_relevance_scores(
+            embedding, k=k, filter=where,
+        )
+        return [(doc, relevance(distance)) for doc, distance in docs_with_distances]
+
+
+class NumpyIndex:
+    """The chunks and their vectors in two flat files: a matrix of unit vectors (.npy, float32
+    or float16, memory-mapped when read) and a JSON sidecar with the ids, texts and metadata.
+    The search is an exact cosine top-k, one matrix-vector product per query.
+
+    With a `quantization` ("int8" or "pq", see QUANTIZATIONS), the search scans compact codes
+    of the vectors instead (a quarter of the float32 size with int8, one byte per
+    PQ_SUBSPACES dimensions with product quantization), then re-ranks the best
+    RERANK_FACTOR * k candidates with their exact vectors, so only those rows of the matrix
+    are read. The codes are rebuilt from the vectors by `persist`, so the quantization can
+    be changed without embedding the chunks again.
+
+    Changes are made in memory and written by `persist`. With a `snapshot` (see snapshot.py),
+    the files are read from it, the matrices memory-mapped in place, and cannot be written.
+    """
+
+    backend = "numpy"
+
+    def __init__(
+        self,
+        persist_directory: str,
+        dtype: str | None = None,
+        quantization: str | None = None,
+        snapshot: SnapshotReader | None = None,
+    ):
+        if quantization is not None and quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization: {quantization}. Available: {', '.join(QUANTIZATIONS)}.")
+        self.persist_directory = persist_directory
+        self.snapshot = snapshot
+        sidecar = {}
+        if self._stored(NUMPY_VECTORS_FILENAME) and self._stored(NUMPY_METADATA_FILENAME):
+            self.vectors = self._load_array(NUMPY_VECTORS_FILENAME)
+            sidecar = self._load_sidecar()
+            self.ids, self.documents, self.metadatas = sidecar["ids"], sidecar["documents"], sidecar["metadatas"]
+            if len(self.ids) != len(self.vectors):
+                raise ValueError(f"The vectors and the metadata of '{persist_directory}' do not match.")
+        else:
+            self.vectors = np.zeros((0, 0), dtype=np.float32)
+            self.ids, self.documents, self.metadatas = [], [], []
+        converted = dtype is not None and len(self.ids) and self.vectors.dtype != np.dtype(dtype)
+        if converted:
+            self.vectors = self.vectors.astype(dtype)
+        self.dtype = np.dtype(dtype) if dtype is not None else self.vectors.dtype
+        self.quantization = quantization or sidecar.get("quantization", "none")
+        self.codes, self.quantizer = None, None
+        if self.quantization != "none" and sidecar.get("codes") == self.quantization:
+            self.codes = self._load_array(NUMPY_CODES_FILENAME)
+            self.quantizer = self._load_quantizer()
+        self._rows = {chunk_id: row for row, chunk_id in enumerate(self.ids)}
+        self._pokemon_rows = None
+        # Whether the vectors or the codes differ from the files
+        self.dirty = bool(self.ids) and (
+            bool(converted)
+            or self.quantization != sidecar.get("quantization", "none")
+            or (self.quantization != "none" and self.codes is None)
+        )
+
+    def _stored(self, filename: str) -> bool:
+        if self.snapshot is not None:
+            return filename in self.snapshot
+        return os.path.exists(os.path.join(self.persist_directory, filename))
+
+    def _load_array(self, filename: str) -> np.ndarray:
+        if self.snapshot is not None:
+            return self.snapshot.open_array(filename)
+        return np.load(os.path.join(self.persist_directory, filename), mmap_mode="r")
+
+    def _load_sidecar(self) -> dict:
+        if self.snapshot is not None:
+            return self.snapshot.read_json(NUMPY_METADATA_FILENAME)
+        with open(os.path.join(self.persist_directory, NUMPY_METADATA_FILENAME), encoding="utf-8") as f:
+            return json.load(f)
+
+    def _load_quantizer(self) -> dict[str, np.ndarray]:
+        if self.snapshot is not None:
+            source = io.BytesIO(self.snapshot.read_bytes(NUMPY_QUANTIZER_FILENAME))
+        else:
+            source = os.path.join(self.persist_directory, NUMPY_QUANTIZER_FILENAME)
+        with np.load(source) as quantizer:
+            return dict(quantizer)
+
+    def count(self) -> int:
+        return len(self.ids)
+
+    def get_all(self) -> tuple[list[str], list[str], list[dict]]:
+        """Ids, texts and metadata of every chunk, in the order of the matrix."""
+        return list(self.ids), list(self.documents), list(self.metadatas)
+
+    def changed(self):
+        """Drop what depends on the rows, after a change."""
+        self.codes, self.quantizer = None, None
+        self._pokemon_rows = None
+        self.dirty = True
+
+    def upsert(self, ids: list[str], embeddings: list[list[float]], documents: list[str], metadatas: list[dict]):
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = (vectors / np.where(norms > 0, norms, 1.0)).astype(self.dtype)
+        if not len(self.ids):
+            self.vectors = np.zeros((0, vectors.shape[1]), dtype=self.dtype)
+        new_rows = []
+        self.vectors = np.array(self.vectors)  # a writable copy of the memory-mapped matrix
+        for chunk_id, vector, document, metadata in zip(ids, vectors, documents, metadatas, strict=True):
+            row = self._rows.get(chunk_id)
+            if row is None:
+                self._rows[chunk_id] = len(self.ids)
+                self.ids.append(chunk_id)
+                self.documents.append(document)
+                self.metadatas.append(metadata)
+                new_rows.append(vector)
+            else:
+                self.vectors[row] = vector
+                self.documents[row] = document
+                self.metadatas[row] = metadata
+        if new_rows:
+            self.vectors = np.vstack([self.vectors, np.stack(new_rows)])
+        self.changed()
+
+    def delete(self, ids: list[str]):
+        rows = {self._rows[chunk_id] for chunk_id in ids if chunk_id in self._rows}
+        if not rows:
+            return
+        keep = [row for row in range(len(self.ids)) if row not in rows]
+        self.vectors = np.array(self.vectors[keep])
+        self.ids = [self.ids[row] for row in keep]
+        self.documents = [self.documents[row] for row in keep]
+        self.metadatas = [self.metadatas[row] for row in keep]
+        self._rows = {chunk_id: row for row, chunk_id in enumerate(self.ids)}
+        self.changed()
+
+    def reset(self):
+        self.vectors = np.zeros((0, 0), dtype=self.dtype)
+        self.ids, self.documents, self.metadatas = [], [], []
+        self._rows = {}
+        self.changed()
+
+    def drop(self):
+        """Delete the files of the index from the store."""
+        if self.snapshot is not None:
+            raise ValueError(f"The snapshot '{self.snapshot.path}' is read only, import it to update the store.")
+        self.reset()
+        self.dirty = False
+        for filename in (NUMPY_VECTORS_FILENAME, NUMPY_METADATA_FILENAME, NUMPY_CODES_FILENAME, NUMPY_QUANTIZER_FILENAME):
+            path = os.path.join(self.persist_directory, filename)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def quantize(self):
+        """Train the quantizer on the vectors and encode them."""
+        train, encode = QUANTIZERS[self.quantization]
+        vectors = np.asarray(self.vectors, dtype=np.float32)
+        self.quantizer = train(vectors)
+        self.codes = encode(vectors, self.quantizer)
+
+    def persist(self, quantize: bool = True):
+        """Write the matrix, the codes and the sidecar, each atomically. With `quantize=False`
+        (e.g. between two batches of a build) the codes are left out and marked as stale.
+        """
+        if self.snapshot is not None:
+            raise ValueError(f"The snapshot '{self.snapshot.path}' is read only, import it to update the store.")
+        os.makedirs(self.persist_directory, exist_ok=True)
+        codes = None
+        if self.quantization != "none" and quantize and self.ids:
+            if self.codes is None:
+                self.quantize()
+            codes = self.quantization
+        self._save_array(NUMPY_VECTORS_FILENAME, np.ascontiguousarray(self.vectors, dtype=self.dtype))
+        quantizer_path = os.path.join(self.persist_directory, NUMPY_QUANTIZER_FILENAME)
+        if codes:
+            self._save_array(NUMPY_CODES_FILENAME, np.ascontiguousarray(self.codes))
+            with open(quantizer_path + ".tmp", "wb") as f:
+                np.savez(f, **self.quantizer)
+            os.replace(quantizer_path + ".tmp", quantizer_path)
+        elif self.quantization == "none":
+            for path in (os.path.join(self.persist_directory, NUMPY_CODES_FILENAME), quantizer_path):
+                if os.path.exists(path):
+                    os.remove(path)
+        metadata_path = os.path.join(self.persist_directory, NUMPY_METADATA_FILENAME)
+        with open(metadata_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({
+                "quantization": self.quantization,
+                "codes": codes,
+                "ids": self.ids,
+                "documents": self.documents,
+                "metadatas": self.metadatas,
+            }, f, ensure_ascii=False)
+        os.replace(metadata_path + ".tmp", metadata_path)
+        self.dirty = self.quantization != "none" and not codes and bool(self.ids)
+
+    def _save_array(self, filename: str, array: np.ndarray):
+        path = os.path.join(self.persist_directory, filename)
+        with open(path + ".tmp", "wb") as f:
+            np.save(f, array)
+        os.replace(path + ".tmp", path)
+
+    def rows_of(self, pokemon: list[str]) -> np.ndarray:
+        """Rows of the chunks of the given Pokémon."""
+        if self._pokemon_rows is None:
+            by_pokemon = {}
+            for row, metadata in enumerate(self.metadatas):
+                by_pokemon.setdefault(metadata.get("pokemon"), []).append(row)
+            self._pokemon_rows = {name: np.array(rows, dtype=np.int64) for name, rows in by_pokemon.items()}
+        rows = [self._pokemon_rows[name] for name in pokemon if name in self._pokemon_rows]
+        return np.sort(np.concatenate(rows)) if rows else np.zeros(0, dtype=np.int64)
+
+    def similarities(self, query: np.ndarray, rows: np.ndarray | None = None) -> np.ndarray:
+        """Cosine similarity of the unit query vector with the chunks (all, or the given rows)."""
+        vectors = self.vectors if rows is None else self.vectors[rows]
+        return blocked_dot(vectors, query)
+
+    def approximate_similarities(self, query: np.ndarray) -> np.ndarray:
+        """Similarity of the query with every chunk, estimated from the quantized codes."""
+        if self.quantization == "int8":
+            return blocked_dot(self.codes, query * self.quantizer["scale"])
+        # Product quantization: the similarity is the sum, over the subspaces, of the
+        # similarity of the query slice with the centroid of the chunk in that subspace
+        codebooks = self.quantizer["codebooks"]
+        table = np.einsum("mcs,ms->mc", codebooks, query.reshape(len(codebooks), -1))
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        for similarities, codes in zip(table, self.codes, strict=True):
+            scores += np.take(similarities, codes)
+        return scores
+
+    def top_rows(self, scores: np.ndarray, k: int) -> np.ndarray:
+        """Indices of the `k` highest scores, best first."""
+        k = min(k, len(scores))
+        if k == 0:
+            return np.zeros(0, dtype=np.int64)
+        best = np.argpartition(-scores, k - 1)[:k]
+        return best[np.argsort(-scores[best])]
+
+    def document(self, row: int) -> Document:
+        return Document(page_content=self.documents[row], metadata=self.metadatas[row], id=self.ids[row])
+
+    def search(
+        self,
+        embedding: list[float],
+        k: int,
+        pokemon: list[str] | None = None,
+        generations: list[int] | None = None,
+    ) -> list[tuple[Document, float]]:
+        """Nearest chunks of a query vector with their relevance score, among the chunks
+        of the given Pokémon if any. The quantized codes, if any, are only used to scan the
+        whole store; the chunks of a few Pokémon are scored exactly. `generations` only
+        routes the search of a `ShardedIndex`.
+        """
+        if not self.ids or k <= 0:
+            return []
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        query = query / norm if norm else query
+        if pokemon:
+            rows = self.rows_of(pokemon)
+        elif self.codes is not None:
+            rows = np.sort(self.top_rows(self.approximate_similarities(query), RERANK_FACTOR * k))
+        else:
+            rows = None
+        scores = self.similarities(query, rows)
+        best = self.top_rows(scores, k)
+        relevance = euclidean_relevance(scores[best])
+        return [
+            (self.document(int(rows[i] if rows is not None else i)), float(score))
+            for i, score in zip(best, relevance, strict=True)
+        ]
+
+
+def shard_name(generation: int | None) -> str:
+    """Name of the shard of the chunks of a generation (its collection or subdirectory)."""
+    return f"gen{generation}" if generation is not None else "other"
+
+
+class ShardedIndex:
+    """The chunks split by the generation of their Pokémon (the `generation` metadata), with
+    one index per generation: a Chroma collection per generation in the store, or a NumPy
+    store per generation in a subdirectory. A chunk with no generation goes to the "other" shard.
+
+    A search is routed to the shards of the given Pokémon, or else of the given generations,
+    and otherwise fans out to every shard in parallel; the results are merged by relevance.
+    So the queries naming a Pokémon or a generation scan the same amount of vectors whatever
+    the number of generations in the store. The shard of every Pokémon and the list of the
+    shards are kept in a small JSON file, SHARDS_FILENAME.
+    """
+
+    def __init__(
+        self,
+        backend: str,
+        persist_directory: str,
+        embeddings: Embeddings | None = None,
+        dtype: str | None = None,
+        quantization: str | None = None,
+        snapshot: SnapshotReader | None = None,
+    ):
+        self.backend = backend
+        self.persist_directory = persist_directory
+        self.embeddings = embeddings
+        self.dtype = dtype
+        self.quantization = quantization
+        self.snapshot = snapshot
+        layout = {"shards": {}, "pokemon": {}}
+        layout_path = os.path.join(persist_directory, SHARDS_FILENAME)
+        if snapshot is not None:
+            if SHARDS_FILENAME in snapshot:
+                layout = snapshot.read_json(SHARDS_FILENAME)
+        elif os.path.exists(layout_path):
+            with open(layout_path, encoding="utf-8") as f:
+                layout = json.load(f)
+        self.generations = {name: shard["generation"] for name, shard in layout["shards"].items()}
+        self.pokemon_shards = layout["pokemon"]
+        self.shards = {name: self.open_shard(name) for name in self.generations}
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def open_shard(self, name: str) -> ChromaIndex | NumpyIndex:
+        if self.backend == "chroma":
+            return ChromaIndex(self.persist_directory, self.embeddings, collection_name=name)
+        snapshot = self.snapshot.subdirectory(name) if self.snapshot is not None else None
+        return NumpyIndex(os.path.join(self.persist_directory, name), self.dtype, self.quantization, snapshot)
+
+    @property
+    def dirty(self) -> bool:
+        return any(shard.dirty for shard in self.shards.values())
+
+    def count(self) -> int:
+        return sum(shard.count() for shard in self.shards.values())
+
+    def get_all(self) -> tuple[list[str], list[str], list[dict]]:
+        """Ids, texts and metadata of every chunk, shard after shard."""
+        ids, documents, metadatas = [], [], []
+        for shard in self.shards.values():
+            shard_ids, shard_documents, shard_metadatas = shard.get_all()
+            ids.extend(shard_ids)
+            documents.extend(shard_documents)
+            metadatas.extend(shard_metadatas)
+        return ids, documents, metadatas
+
+    def upsert(self, ids: list[str], embeddings: list[list[float]], documents: list[str], metadatas: list[dict]):
+        batches = {}
+        for chunk_id, embedding, document, metadata in zip(ids, embeddings, documents, metadatas, strict=True):
+            name = shard_name(metadata.get("generation"))
+            batch = batches.setdefault(name, ([], [], [], []))
+            for values, value in zip(batch, (chunk_id, embedding, document, metadata), strict=True):
+                values.append(value)
+            if metadata.get("pokemon") is not None:
+                self.pokemon_shards[metadata["pokemon"]] = name
+            self.generations.setdefault(name, metadata.get("generation"))
+        for name, batch in batches.items():
+            if name not in self.shards:
+                self.shards[name] = self.open_shard(name)
+            self.shards[name].upsert(*batch)
+
+    def delete(self, ids: list[str]):
+        """Delete the chunks from every shard: the ids do not tell the generation."""
+        for shard in self.shards.values():
+            shard.delete(ids)
+
+    def reset(self):
+        for shard in self.shards.values():
+            shard.reset()
+        self.pokemon_shards = {}
+
+    def drop(self):
+        """Delete every shard and the list of the shards from the store."""
+        for shard in self.shards.values():
+            shard.drop()
+            if self.backend == "numpy":
+                shutil.rmtree(shard.persist_directory, ignore_errors=True)
+        self.shards, self.generations, self.pokemon_shards = {}, {}, {}
+        path = os.path.join(self.persist_directory, SHARDS_FILENAME)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def persist(self, quantize: bool = True):
+        """Write every shard, then the list of the shards."""
+        if self.snapshot is not None:
+            raise ValueError(f"The snapshot '{self.snapshot.path}' is read only, import it to update the store.")
+        for shard in self.shards.values():
+            shard.persist(quantize)
+        os.makedirs(self.persist_directory, exist_ok=True)
+        path = os.path.join(self.persist_directory, SHARDS_FILENAME)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({
+                "shards": {name: {"generation": self.generations[name]} for name in self.shards},
+                "pokemon": self.pokemon_shards,
+            }, f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+
+    def route(self, pokemon: list[str] | None = None, generations: list[int] | None = None) -> list[str]:
+        """Shards to search: those of the Pokémon, else those of the generations, else all of them."""
+        if pokemon:
+            return list(dict.fromkeys(self.pokemon_shards[name] for name in pokemon if name in self.pokemon_shards))
+        routed = [shard_name(generation) for generation in generations or () if shard_name(generation) in self.shards]
+        return list(dict.fromkeys(routed)) if routed else list(self.shards)
+
+    def search(
+        self,
+        embedding: list[float],
+        k: int,
+        pokemon: list[str] | None = None,
+        generations: list[int] | None = None,
+    ) -> list[tuple[Document, float]]:
+        """Nearest chunks of a query vector with their relevance score, among the chunks
+        of the given Pokémon if any, from the shards chosen by `route`.
+        """
+        names = self.route(pokemon, generations)
+        if len(names) <= 1:
+            return self.shards[names[0]].search(embedding, k, pokemon) if names else []
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=SHARD_WORKERS, thread_name_prefix="shard")
+        results = self._executor.map(lambda name: self.shards[name].search(embedding, k, pokemon), names)
+        return sorted((result for shard_results in results for result in shard_results), key=lambda item: -item[1])[:k]
+
+
+def blocked_dot(matrix: np.ndarray, vector: np.ndarray) -> np.ndarray:
+    """`matrix @ vector` in float32. A matrix of another type is converted NUMPY_BLOCK_ROWS
+    rows at a time, to bound the memory of the conversion.
+    """
+    if matrix.dtype == np.float32:
+        return matrix @ vector
+    if not len(matrix):
+        return np.zeros(0, dtype=np.float32)
+    return np.concatenate([
+        matrix[start:start + NUMPY_BLOCK_ROWS].astype(np.float32) @ vector
+        for start in range(0, len(matrix), NUMPY_BLOCK_ROWS)
+    ])
+
+
+def open_vector_index(
+    backend: str,
+    persist_directory: str,
+    embeddings: Embeddings | None = None,
+    dtype: str | None = None,
+    quantization: str | None = None,
+    snapshot: SnapshotReader | None = None,
+    sharding: str = "none",
+) -> ChromaIndex | NumpyIndex | ShardedIndex:
+    """Open the vector index of a store with the given backend (see VECTOR_BACKENDS): a
+    Chroma collection, or a NumPy matrix with exact search (see `NumpyIndex`).
+    `dtype` is the type of the vectors written by the NumPy backend and `quantization` the
+    codes it scans (see QUANTIZATIONS); by default they are kept as stored. Changing the
+    quantization of a store only recomputes its codes, from the stored vectors. A NumPy store
+    can also be read in place from a `snapshot`; a Chroma one must be unpacked first.
+    With `sharding="generation"` the store has one index per generation (see `ShardedIndex`).
+    The backend and the sharding a store was built with are recorded in its manifest.
+    """
+    if backend not in VECTOR_BACKENDS:
+        raise ValueError(f"Unknown vector backend: {backend}. Available: {', '.join(VECTOR_BACKENDS)}.")
+    if sharding not in SHARDINGS:
+        raise ValueError(f"Unknown sharding: {sharding}. Available: {', '.join(SHARDINGS)}.")
+    if backend == "chroma":
+        if quantization not in (None, "none"):
+            raise ValueError("Quantized vectors are only supported by the numpy backend.")
+        if snapshot is not None:
+            raise ValueError("A Chroma store is opened from a directory, unpack its snapshot first.")
+    if sharding == "generation":
+        return ShardedIndex(backend, persist_directory, embeddings, dtype, quantization, snapshot)
+    if backend == "chroma":
+        return ChromaIndex(persist_directory, embeddings)
+    return NumpyIndex(persist_directory, dtype, quantization, snapshot)
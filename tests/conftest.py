@@ -0,0 +1,17 @@
+import pytest
+
+from RAG.create_vectorstore import create_vectorstore
+
+from .test_create_vectorstore import CountingEmbeddings, make_dataset
+
+
+@pytest.fixture(scope="session")
+def store(tmp_path_factory):
+    """A small NumPy store of three checked-in pages, with fake embeddings."""
+    root = tmp_path_factory.mktemp("store")
+    dataset = make_dataset(root / "dataset")
+    store = str(root / "store")
+    create_vectorstore(
+        persist_directory=store, dataset_dir=str(dataset), embeddings=CountingEmbeddings(size=16), backend="numpy",
+    )
+    return store
@@ -0,0 +1,34 @@
+from langchain.docstore.document import Document
+from langchain_core.language_models import FakeListLLM
+
+from RAG import app
+
+
+def test_chain_built_once_per_configuration(monkeypatch):
+    llm = FakeListLLM(responses=["Ronflex est de type Normal."])
+    builds = []
+    build_rag_chain = app.build_rag_chain
+
+    def counting_build_rag_chain(*args, **kwargs):
+        builds.append(kwargs.get("cache_namespace"))
+        return build_rag_chain(*args, **kwargs)
+
+    monkeypatch.setattr(app, "init_llm", lambda *args, **kwargs: llm)
+    monkeypatch.setattr(app, "build_rag_chain", counting_build_rag_chain)
+    monkeypatch.setattr(app, "get_semantic_cache", lambda: None)
+    monkeypatch.setattr(app, "answer_from_facts", lambda query: None)
+    monkeypatch.setattr(app, "embed_question", lambda query: None)
+    monkeypatch.setattr(
+        app, "get_and_filter_docs", lambda query, embedding=None: [Document(page_content="Ronflex est de type Normal.")],
+    )
+    app.get_rag_chain.cache_clear()
+    try:
+        for question in ("Qui est Ronflex ?", "Quel est le type de Ronflex ?", "Qui est Ronflex ?"):
+            assert app.get_answer(question) == "Ronflex est de type Normal."
+        assert len(builds) == 1
+
+        app.get_rag_chain(temperature=0.5)
+        app.get_rag_chain(temperature=0.5)
+        assert len(builds) == 2
+    finally:
+        app.get_rag_chain.cache_clear()
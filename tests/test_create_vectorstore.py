@@ -0,0 +1,98 @@
+import shutil
+
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from RAG.create_vectorstore import create_vectorstore
+from RAG.manifest import load_manifest
+
+PAGES = ("Bulbizarre.html", "Pikachu.html", "Germignon.html")
+
+
+class CountingEmbeddings(DeterministicFakeEmbedding):
+    """Fake embeddings counting the texts they are asked to embed."""
+
+    calls: int = 0
+    texts: int = 0
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        self.calls += 1
+        self.texts += len(texts)
+        return super().embed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        self.calls += 1
+        self.texts += 1
+        return super().embed_query(text)
+
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        self.calls += 1
+        self.texts += len(texts)
+        return [super(CountingEmbeddings, self).embed_query(text) for text in texts]
+
+
+def make_dataset(directory, pages=PAGES):
+    directory.mkdir()
+    for page in pages:
+        shutil.copy(f"pokemon_dataset/{page}", directory / page)
+    return directory
+
+
+def test_unchanged_dataset_makes_no_embedding_call(tmp_path):
+    dataset = make_dataset(tmp_path / "dataset")
+    store = str(tmp_path / "store")
+    embeddings = CountingEmbeddings(size=16)
+
+    create_vectorstore(persist_directory=store, dataset_dir=str(dataset), embeddings=embeddings, backend="numpy")
+    assert embeddings.calls > 0
+    embeddings.calls = embeddings.texts = 0
+
+    create_vectorstore(persist_directory=store, dataset_dir=str(dataset), embeddings=embeddings, backend="numpy")
+    assert embeddings.calls == 0
+
+
+def test_only_changed_pages_are_embedded(tmp_path):
+    dataset = make_dataset(tmp_path / "dataset")
+    store = str(tmp_path / "store")
+    embeddings = CountingEmbeddings(size=16)
+    create_vectorstore(persist_directory=store, dataset_dir=str(dataset), embeddings=embeddings, backend="numpy")
+    pages = load_manifest(store)["pages"]
+    embeddings.calls = embeddings.texts = 0
+
+    with open(dataset / "Pikachu.html", "a", encoding="utf-8") as f:
+        f.write("\n<!-- modifié -->\n")
+    (dataset / "Germignon.html").unlink()
+    create_vectorstore(persist_directory=store, dataset_dir=str(dataset), embeddings=embeddings, backend="numpy")
+
+    assert embeddings.texts == len(pages[str(dataset / "Pikachu.html")]["chunk_ids"])
+    assert set(load_manifest(store)["pages"]) == {str(dataset / "Bulbizarre.html"), str(dataset / "Pikachu.html")}
+
+
+def test_layout_change_removes_the_previous_index(tmp_path, caplog):
+    import chromadb
+
+    dataset = make_dataset(tmp_path / "dataset")
+    store = tmp_path / "store"
+    embeddings = CountingEmbeddings(size=16)
+
+    def build(backend, sharding):
+        create_vectorstore(
+            persist_directory=str(store), dataset_dir=str(dataset), embeddings=embeddings,
+            backend=backend, sharding=sharding,
+        )
+
+    build("numpy", "none")
+    assert (store / "vectors.npy").exists()
+    build("numpy", "generation")
+    assert not (store / "vectors.npy").exists()
+    assert any(record.levelname == "WARNING" and "sharding none" in record.message for record in caplog.records)
+    assert (store / "shards.json").exists()
+
+    build("chroma", "generation")
+    assert not any(path.is_dir() and (path / "vectors.npy").exists() for path in store.iterdir())
+    shards = {collection.name for collection in chromadb.PersistentClient(path=str(store)).list_collections()}
+    assert shards and "langchain" not in shards
+
+    build("chroma", "none")
+    assert not (store / "shards.json").exists()
+    collections = chromadb.PersistentClient(path=str(store)).list_collections()
+    assert [collection.name for collection in collections] == ["langchain"]
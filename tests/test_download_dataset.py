@@ -0,0 +1,131 @@
+import hashlib
+import itertools
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+import pytest
+
+from RAG import download_dataset as dd
+
+PAGES = ["Bulbizarre", "Salamèche", "Carapuce", "Pikachu", "Nidoran♀"]
+
+
+class StubPokepedia(ThreadingHTTPServer):
+    """Local HTTP server serving the checked-in pages of the dataset, with ETags, after
+    `latency` seconds, and recording the requests.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.latency = latency
+        self.pages = {}
+        for name in PAGES:
+            with open(os.path.join("pokemon_dataset", f"{name}.html"), encoding="utf-8") as f:
+                self.pages[name] = f.read()
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            server.requests.append((time.monotonic(), unquote(self.path[1:]), self.headers.get("If-None-Match")))
+        try:
+            time.sleep(server.latency)
+            page = server.pages.get(unquote(self.path[1:]))
+            if page is None:
+                self.send_response(404)
+                self.end_headers()
+                return
+            body = page.encode("utf-8")
+            etag = '"' + hashlib.sha256(body).hexdigest()[:16] + '"'
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def pokepedia(tmp_path, monkeypatch):
+    server = StubPokepedia(latency=0.05)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(dd, "BASE_URL", server.url)
+    monkeypatch.setattr(dd, "OUTPUT_DIR", str(tmp_path))
+    monkeypatch.setattr(dd, "POKEMON_BY_GENERATION", {1: PAGES})
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_downloads_the_pages_concurrently(pokepedia, tmp_path):
+    dd.download_dataset(gen=1, workers=3, delay=0)
+
+    for name in PAGES:
+        with open(tmp_path / f"{dd.safe_filename(name)}.html", encoding="utf-8") as f:
+            assert f.read() == pokepedia.pages[name]
+    assert not list(tmp_path.glob("*.tmp"))
+    assert len(pokepedia.requests) == len(PAGES)
+    assert 1 < pokepedia.max_in_flight <= 3
+    assert set(dd.load_validators()) == {dd.safe_filename(name) for name in PAGES}
+
+
+def test_spaces_out_the_requests(pokepedia):
+    dd.download_dataset(gen=1, workers=4, delay=0.1)
+
+    starts = sorted(start for start, _, _ in pokepedia.requests)
+    assert all(later - earlier >= 0.09 for earlier, later in itertools.pairwise(starts))
+
+
+def test_pages_present_are_skipped(pokepedia):
+    dd.download_dataset(gen=1, workers=2, delay=0)
+    pokepedia.requests.clear()
+
+    dd.download_dataset(gen=1, workers=2, delay=0)
+    assert pokepedia.requests == []
+
+
+def test_refresh_sends_conditional_requests(pokepedia, tmp_path):
+    dd.download_dataset(gen=1, workers=2, delay=0)
+    pokepedia.requests.clear()
+    pokepedia.pages["Pikachu"] += "<!-- modifié -->"
+    session = dd.create_session(2)
+    validators = dd.load_validators()
+
+    statuses = {name: dd.download_pokemon_page(name, session, None, validators, refresh=True) for name in PAGES}
+
+    assert statuses == {name: "downloaded" if name == "Pikachu" else "not_modified" for name in PAGES}
+    assert all(etag is not None for _, _, etag in pokepedia.requests)
+    with open(tmp_path / "Pikachu.html", encoding="utf-8") as f:
+        assert f.read().endswith("<!-- modifié -->")
+
+
+def test_missing_page_fails_without_writing(pokepedia, tmp_path):
+    assert dd.download_pokemon_page("Pokémon inconnu", dd.create_session()) == "failed"
+    assert list(tmp_path.iterdir()) == []
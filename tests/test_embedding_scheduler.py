@@ -0,0 +1,127 @@
+import threading
+import time
+
+import pytest
+from langchain_core.embeddings import Embeddings
+
+from RAG import embedding_scheduler
+from RAG.embedding_scheduler import EmbeddingScheduler, TokenBucket
+
+
+class RateLimitError(Exception):
+    status_code = 429
+
+
+class StubEmbeddings(Embeddings):
+    """Embedding backend answering 429 to its first `rate_limited` requests, after `latency`
+    seconds, and tracking the requests in flight.
+    """
+
+    def __init__(self, rate_limited: int = 0, latency: float = 0.0, error: Exception | None = None):
+        self.rate_limited = rate_limited
+        self.latency = latency
+        self.error = error
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            limited = self.requests <= self.rate_limited
+        try:
+            if self.latency:
+                time.sleep(self.latency)
+            if self.error is not None:
+                raise self.error
+            if limited:
+                raise RateLimitError("429 RESOURCE_EXHAUSTED")
+            return [[float(len(text))] for text in texts]
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """The backoff delays, recorded instead of slept, with the jitter at its maximum.
+    `time.sleep` is patched for the whole process: the tests using it keep the token bucket
+    from sleeping (max_in_flight >= requests) and the stub without latency.
+    """
+    delays = []
+    monkeypatch.setattr(embedding_scheduler.time, "sleep", delays.append)
+    monkeypatch.setattr(embedding_scheduler.random, "uniform", lambda low, high: high)
+    return delays
+
+
+def test_retries_rate_limited_requests_with_exponential_backoff(sleeps):
+    stub = StubEmbeddings(rate_limited=3)
+    scheduler = EmbeddingScheduler(stub, batch_size=10, max_in_flight=8, requests_per_minute=60_000, initial_backoff=0.5)
+
+    assert scheduler.embed_documents(["a", "bb", "ccc"]) == [[1.0], [2.0], [3.0]]
+    assert stub.requests == scheduler.requests == 4
+    assert scheduler.retries == 3
+    assert sleeps == [0.5, 1.0, 2.0]
+
+
+def test_backoff_is_capped(sleeps):
+    stub = StubEmbeddings(rate_limited=4)
+    scheduler = EmbeddingScheduler(stub, max_in_flight=8, requests_per_minute=60_000, initial_backoff=1.0, max_backoff=3.0)
+
+    scheduler.embed_documents(["a"])
+    assert sleeps == [1.0, 2.0, 3.0, 3.0]
+
+
+def test_gives_up_after_max_retries(sleeps):
+    stub = StubEmbeddings(rate_limited=10)
+    scheduler = EmbeddingScheduler(stub, requests_per_minute=60_000, max_retries=2)
+
+    with pytest.raises(RateLimitError):
+        scheduler.embed_documents(["a"])
+    assert stub.requests == 3
+    assert scheduler.retries == 2
+
+
+def test_other_errors_are_not_retried(sleeps):
+    stub = StubEmbeddings(error=ValueError("invalid input"))
+    scheduler = EmbeddingScheduler(stub, requests_per_minute=60_000)
+
+    with pytest.raises(ValueError):
+        scheduler.embed_documents(["a"])
+    assert stub.requests == 1
+    assert scheduler.retries == 0
+
+
+def test_batches_keep_their_order_with_bounded_requests_in_flight():
+    stub = StubEmbeddings(latency=0.02)
+    scheduler = EmbeddingScheduler(stub, batch_size=2, max_in_flight=3, requests_per_minute=60_000)
+    texts = ["x" * length for length in range(1, 21)]
+
+    assert scheduler.embed_documents(texts) == [[float(len(text))] for text in texts]
+    assert stub.requests == 10
+    assert 1 < stub.max_in_flight <= 3
+
+
+def test_token_bucket_paces_requests():
+    bucket = TokenBucket(rate=50, capacity=2)
+    start = time.monotonic()
+    for _ in range(12):
+        bucket.acquire()
+    # the 2 tokens in reserve are spent at once, the next 10 at 50 per second
+    assert time.monotonic() - start >= 10 / 50 * 0.9
+
+
+def test_scheduler_respects_the_request_rate():
+    stub = StubEmbeddings()
+    scheduler = EmbeddingScheduler(stub, batch_size=1, max_in_flight=2, requests_per_minute=1200)
+    start = time.monotonic()
+    scheduler.embed_documents([str(i) for i in range(8)])
+    # 2 requests in reserve (max_in_flight), then 20 per second
+    assert time.monotonic() - start >= 6 / 20 * 0.9
+    assert stub.requests == 8
@@ -0,0 +1,52 @@
+import pytest
+
+from RAG.entities import FUZZY_CACHE_SIZE, default_entity_index
+from RAG.retriever import PokemonRetriever
+
+from .test_create_vectorstore import CountingEmbeddings
+
+# Words of the corpus within the edit distance of a Pokémon name
+CORPUS_WORDS = ["carapace", "armure", "debutant", "crocodile", "mental", "magma", "golem", "galop", "canines", "molosse"]
+
+
+@pytest.fixture(scope="module")
+def entities():
+    return default_entity_index(vocabulary=CORPUS_WORDS)
+
+
+def test_typo_resolves_to_the_pokemon(entities):
+    assert entities.match("qui est pickachu ?") == ([], ["Pikachu"])
+    assert entities.detect("quel est le nom japonais de Ronflex ?") == ["Ronflex"]
+
+
+@pytest.mark.parametrize("word", CORPUS_WORDS)
+def test_corpus_words_are_not_typos(entities, word):
+    assert entities.detect(f"Quels Pokémon ont un rapport avec {word} ?") == []
+    # without the vocabulary, the word would be taken for a misspelled name
+    assert default_entity_index().detect(word) != []
+
+
+def test_exact_names_come_before_typos(entities):
+    assert entities.match("pickachu ou Salamèche ?") == (["Salamèche"], ["Pikachu"])
+    assert entities.detect("pickachu ou Salamèche ?") == ["Salamèche", "Pikachu"]
+
+
+def test_fuzzy_cache_is_bounded(entities):
+    for number in range(FUZZY_CACHE_SIZE + 10):
+        entities.detect(f"mot{number:05d}")
+    assert entities._fuzzy.cache_info().currsize == FUZZY_CACHE_SIZE
+
+
+def test_typo_does_not_restrict_the_retrieval(store):
+    embeddings = CountingEmbeddings(size=16)
+    retriever = PokemonRetriever(persist_directory=store, embedding_function=embeddings, relevance_threshold=0.0)
+
+    assert retriever.entity_matches("qui est pickachu ?") == ([], ["Pikachu"])
+    docs = retriever.get_and_filter_docs("qui est pickachu ?")
+    assert embeddings.calls == 1
+    # the chunks of Pikachu are fused with the others rather than replacing them
+    assert {doc.metadata["pokemon"] for doc in docs} > {"Pikachu"}
+
+    docs = retriever.get_and_filter_docs("qui est Pikachu ?")
+    assert embeddings.calls == 1
+    assert {doc.metadata["pokemon"] for doc in docs} == {"Pikachu"}
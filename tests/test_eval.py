@@ -0,0 +1,42 @@
+import json
+import shutil
+
+from RAG.eval import ExtractiveLLM, eval
+from RAG.retriever import PokemonRetriever
+
+from .test_create_vectorstore import CountingEmbeddings
+
+QUESTIONS = [
+    {"question": "Quel est le nom japonais de Pikachu ?", "reference": "Le nom japonais de Pikachu est Pikachu."},
+    {"question": "Quels Pokémon vivent dans les grottes ?", "reference": "Nosferapti vit dans les grottes."},
+]
+
+
+def test_extractive_llm_answers_with_the_context():
+    llm = ExtractiveLLM(sentences=2)
+
+    prompt = "Question : q ?\n    Contexte : Une. Deux !\n Trois ?\n\n    Réponse :\n"
+    assert llm.invoke(prompt) == "Une. Deux !"
+    assert llm.invoke("Contexte : \nRéponse :") == "Je ne sais pas."
+
+
+def test_offline_eval_is_cached_per_store(store, tmp_path):
+    questions = tmp_path / "questions.json"
+    questions.write_text(json.dumps(QUESTIONS, ensure_ascii=False), encoding="utf-8")
+    copy = shutil.copytree(store, tmp_path / "copy")
+    cache_path = str(tmp_path / "eval_cache.sqlite3")
+
+    def run(persist_directory):
+        embeddings = CountingEmbeddings(size=16)
+        retriever = PokemonRetriever(
+            persist_directory=str(persist_directory), embedding_function=embeddings, relevance_threshold=0.0,
+        )
+        summary = eval(str(questions), judge="stub", cache_path=cache_path, generator="stub", retriever=retriever)
+        return summary, embeddings.calls
+
+    summary, calls = run(store)
+    assert calls == 1
+    assert 0.0 < summary["faithfulness"] <= 1.0
+    assert run(store) == (summary, 0)
+    # Another store does not reuse the answers of the first one.
+    assert run(copy)[1] == 1
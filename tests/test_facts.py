@@ -0,0 +1,67 @@
+import pytest
+
+from RAG.facts import FactStore, match_fact_question, page_facts
+
+
+@pytest.fixture(scope="module")
+def fact_store(tmp_path_factory):
+    store = FactStore(str(tmp_path_factory.mktemp("facts") / "facts.sqlite3"))
+    store.upsert({name: page_facts(f"pokemon_dataset/{name}.html") for name in ("Salamèche", "Pikachu", "Ronflex")})
+    return store
+
+
+@pytest.mark.parametrize(
+    ("question", "pokemon", "fields"),
+    [
+        ("Quel est le type de Ronflex ?", "Ronflex", ["types"]),
+        ("Quels sont les types de Salamèche ?", "Salamèche", ["types"]),
+        ("type de pikachu", "Pikachu", ["types"]),
+        ("De quel type est Salameche ?", "Salamèche", ["types"]),
+        ("Ronflex est de quel type ?", "Ronflex", ["types"]),
+        ("Quel est le nom japonais de Ronflex ?", "Ronflex", ["japanese_name"]),
+        ("Quelle est la taille et le poids de Ronflex ?", "Ronflex", ["height", "weight"]),
+        ("Combien pèse Ronflex ?", "Ronflex", ["weight"]),
+        ("Quel est le numéro de Pikachu ?", "Pikachu", ["number"]),
+        ("n° de Pikachu", "Pikachu", ["number"]),
+        ("Quelle est la couleur de Ronflex ?", "Ronflex", ["color"]),
+        ("Quels sont les groupes d'œuf de Pikachu ?", "Pikachu", ["egg_groups"]),
+        ("Quelle est l'attaque de base de Salamèche ?", "Salamèche", ["attack"]),
+        ("statistiques d'attaque spéciale de Pikachu", "Pikachu", ["special_attack"]),
+        ("Quels sont les PV de Ronflex ?", "Ronflex", ["hp"]),
+        ("Quel est le type de Pickachu ?", "Pikachu", ["types"]),
+    ],
+)
+def test_factual_questions(question, pokemon, fields):
+    assert match_fact_question(question, pokemon) == fields
+
+
+def test_base_stats_question():
+    assert match_fact_question("statistiques de base de Pikachu", "Pikachu") == [
+        "hp", "attack", "defense", "special_attack", "special_defense", "speed", "special", "base_stat_total",
+    ]
+
+
+@pytest.mark.parametrize(
+    ("question", "pokemon"),
+    [
+        ("Quelle attaque de type Feu apprend Salamèche ?", "Salamèche"),
+        ("Quel type de dresseur utilise Pikachu ?", "Pikachu"),
+        ("quelle est la couleur des yeux de Ronflex ?", "Ronflex"),
+        ("Pourquoi Ronflex est de type Normal ?", "Ronflex"),
+        ("Quel est le type de Ronflex et de Pikachu ?", "Ronflex"),
+        ("Quel est le type le plus efficace contre Pikachu ?", "Pikachu"),
+        ("Quelle est la taille de Pikachu dans le dessin animé ?", "Pikachu"),
+        ("Qui est Ronflex ?", "Ronflex"),
+        ("Quel est le type de Salamèche ?", "Pikachu"),
+    ],
+)
+def test_other_questions_fall_back_to_the_chain(question, pokemon):
+    assert match_fact_question(question, pokemon) == []
+
+
+def test_answers_from_the_fact_table(fact_store):
+    assert fact_store.answer("Salamèche", "Quel est le type de Salamèche ?") == "Type de Salamèche : Feu."
+    assert fact_store.answer("Ronflex", "n° de Ronflex") == "Numéro du Pokédex national de Ronflex : 0143."
+    assert fact_store.answer("Salamèche", "Quelle attaque de type Feu apprend Salamèche ?") is None
+    assert fact_store.answer("Pikachu", "Quel type de dresseur utilise Pikachu ?") is None
+    assert fact_store.answer("Ronflex", "quelle est la couleur des yeux de Ronflex ?") is None
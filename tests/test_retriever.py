@@ -0,0 +1,107 @@
+import pytest
+from langchain.docstore.document import Document
+
+from RAG.bm25 import BM25Index, tokenize
+from RAG.retriever import RRF_K, PokemonRetriever, reciprocal_rank_fusion
+
+from .test_create_vectorstore import CountingEmbeddings
+
+
+def docs(*ids: str) -> list[Document]:
+    return [Document(page_content=id, id=id) for id in ids]
+
+
+def ids(documents: list[Document]) -> list[str]:
+    return [doc.id for doc in documents]
+
+
+def test_fusion_favours_chunks_ranked_by_both():
+    dense = docs("a", "b", "c")
+    lexical = docs("c", "d", "b")
+
+    fused = reciprocal_rank_fusion([dense, lexical], [1.0, 1.0])
+
+    # b: 1/62 + 1/63, c: 1/63 + 1/61, a: 1/61, d: 1/62
+    assert ids(fused) == ["c", "b", "a", "d"]
+
+
+def test_fusion_scores():
+    fused = reciprocal_rank_fusion([docs("a", "b"), docs("b")], [2.0, 1.0], rrf_k=10)
+    # a: 2/11 = 0.182, b: 2/12 + 1/11 = 0.258
+    assert ids(fused) == ["b", "a"]
+    assert ids(reciprocal_rank_fusion([docs("a", "b")], [1.0])) == ["a", "b"]
+
+
+@pytest.mark.parametrize(
+    ("weights", "expected"),
+    [
+        ((1.0, 0.0), ["a", "b", "c"]),
+        ((0.0, 1.0), ["c", "b", "a"]),
+        ((3.0, 1.0), ["a", "b", "c"]),
+        ((1.0, 3.0), ["c", "b", "a"]),
+    ],
+)
+def test_fusion_weights(weights, expected):
+    fused = reciprocal_rank_fusion([docs("a", "b", "c"), docs("c", "b", "a")], list(weights))
+    assert ids(fused) == expected
+
+
+def test_fusion_small_rrf_k_favours_the_top_ranks():
+    dense, lexical = docs("a", "b", "c", "d"), docs("d", "b", "c", "a")
+    # b is second in both rankings, a and d are first in one and last in the other
+    assert ids(reciprocal_rank_fusion([dense, lexical], [1.0, 1.0], rrf_k=RRF_K))[0] == "b"
+    assert ids(reciprocal_rank_fusion([dense, lexical], [1.0, 1.0], rrf_k=1))[:2] == ["a", "d"]
+
+
+def test_fusion_keeps_one_document_per_chunk():
+    fused = reciprocal_rank_fusion([docs("a", "b"), docs("b", "a")], [1.0, 1.0])
+    assert ids(fused) == ["a", "b"]
+
+
+def test_fusion_needs_one_weight_per_ranking():
+    with pytest.raises(ValueError):
+        reciprocal_rank_fusion([docs("a"), docs("b")], [1.0])
+
+
+def test_tokenize_folds_case_and_accents():
+    assert tokenize("Le nom japonais de SALAMÈCHE") == ["japonais", "salameche"]
+
+
+def test_bm25_matches_accent_folded_names():
+    texts = [
+        "Salamèche - Présentation\nSalamèche est un Pokémon de type Feu.",
+        "Carapuce - Présentation\nCarapuce est un Pokémon de type Eau.",
+        "Bulbizarre - Présentation\nBulbizarre est un Pokémon de type Plante et Poison.",
+    ]
+    metadatas = [{"pokemon": text.split(" ")[0]} for text in texts]
+    index = BM25Index([f"id{i}" for i in range(3)], texts, metadatas)
+
+    results = index.search("type de salameche", k=3)
+    assert results[0][0].metadata["pokemon"] == "Salamèche"
+    assert [doc.metadata["pokemon"] for doc, _ in index.search("Carapuce", k=3)] == ["Carapuce"]
+
+
+def test_bm25_max_score_bounds_the_scores():
+    texts = ["Salamèche est un Pokémon de type Feu.", "Carapuce est un Pokémon de type Eau."]
+    index = BM25Index(["id0", "id1"], texts, [{}, {}])
+
+    for query in ("type feu de salameche", "salameche et pikachu"):
+        assert all(0 < score <= index.max_score(query) for _, score in index.search(query, k=2))
+    assert index.max_score("") == 0.0
+
+
+@pytest.mark.parametrize("lexical_threshold, retrieved", [(0.0, True), (0.25, False)])
+def test_off_topic_question_gets_no_lexical_context(store, lexical_threshold, retrieved):
+    retriever = PokemonRetriever(
+        persist_directory=store,
+        embedding_function=CountingEmbeddings(size=16),
+        relevance_threshold=1.01,  # no dense result
+        lexical_threshold=lexical_threshold,
+    )
+    assert bool(retriever.get_and_filter_docs("Comment cuisiner une tarte aux pommes avec du feu ?")) is retrieved
+
+
+def test_token_budget_is_left_to_the_context_compressor():
+    chunks = [Document(page_content="mot " * 400, id=str(i)) for i in range(10)]
+    assert PokemonRetriever().fit_token_budget(chunks) == chunks
+    assert len(PokemonRetriever(max_context_tokens=1000).fit_token_budget(chunks)) < len(chunks)
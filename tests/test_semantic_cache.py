@@ -0,0 +1,118 @@
+import os
+
+import numpy as np
+import pytest
+from langchain_core.language_models import FakeListLLM
+
+from RAG import semantic_cache
+from RAG.app import build_rag_chain
+from RAG.bench.common import HashingEmbeddings
+from RAG.manifest import manifest_path, save_manifest
+from RAG.retriever import PokemonRetriever
+from RAG.semantic_cache import SemanticCache
+
+from .test_create_vectorstore import CountingEmbeddings
+
+
+class CountingHashingEmbeddings(HashingEmbeddings):
+    """Word hashing embeddings, so that two wordings of a question with the same words match."""
+
+    calls = 0
+
+    def embed_query(self, text: str) -> list[float]:
+        self.calls += 1
+        return super().embed_query(text)
+
+
+def unit(*values: float) -> np.ndarray:
+    return SemanticCache.vector(list(values))
+
+
+@pytest.fixture
+def chain(store, tmp_path):
+    embeddings = CountingEmbeddings(size=16)
+    retriever = PokemonRetriever(persist_directory=store, embedding_function=embeddings, relevance_threshold=0.0)
+    cache = SemanticCache(path=str(tmp_path / "semantic_cache.sqlite3"), persist_directory=store)
+    llm = FakeListLLM(responses=["Réponse."])
+    return build_rag_chain(llm, semantic_cache=cache, retriever=retriever), embeddings, cache
+
+
+def test_dense_question_is_embedded_once(chain):
+    rag_chain, embeddings, cache = chain
+
+    assert rag_chain.invoke("Quels Pokémon vivent dans les grottes ?")["answer"] == "Réponse."
+    assert embeddings.calls == 1
+    assert cache.stats()["misses"] == 1
+
+    rag_chain.invoke("Quels Pokémon vivent dans les grottes ?")
+    assert embeddings.calls == 2
+    assert cache.stats()["hits"] == 1
+
+
+def test_routed_question_is_embedded_for_the_cache_only(chain):
+    rag_chain, embeddings, cache = chain
+
+    rag_chain.invoke("Quel est le nom japonais de Pikachu ?")
+    rag_chain.invoke("quel est le nom japonais de pikachu")
+    assert embeddings.calls == 2
+    assert cache.stats() == {"hits": 1, "misses": 1, "hit_rate": 0.5, "size": 1}
+
+
+def test_paraphrase_of_a_routed_question_is_a_hit(store, tmp_path):
+    embeddings = CountingHashingEmbeddings(size=64)
+    retriever = PokemonRetriever(persist_directory=store, embedding_function=embeddings)
+    cache = SemanticCache(path=str(tmp_path / "semantic_cache.sqlite3"), persist_directory=store)
+    rag_chain = build_rag_chain(FakeListLLM(responses=["Pikachu."]), semantic_cache=cache, retriever=retriever)
+
+    assert rag_chain.invoke("Quel est le nom japonais de Pikachu ?")["answer"] == "Pikachu."
+    assert rag_chain.invoke("Pikachu : quel est son nom japonais ?")["answer"] == "Pikachu."
+    assert cache.stats()["hits"] == 1
+    assert embeddings.calls == 2
+
+
+def test_expired_entries_are_not_returned(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(semantic_cache.time, "time", lambda: now[0])
+    cache = SemanticCache(path=str(tmp_path / "cache.sqlite3"), ttl=60, persist_directory=str(tmp_path))
+
+    cache.store("question", unit(1, 0), "key", "réponse")
+    now[0] += 59
+    assert cache.lookup(unit(1, 0), "key") == "réponse"
+    now[0] += 2
+    assert cache.lookup(unit(1, 0), "key") is None
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = SemanticCache(path=str(tmp_path / "cache.sqlite3"), max_entries=2, persist_directory=str(tmp_path))
+
+    cache.store("a", unit(1, 0, 0), "key", "A")
+    cache.store("b", unit(0, 1, 0), "key", "B")
+    assert cache.lookup(unit(1, 0, 0), "key") == "A"  # b is now the least recently used
+    cache.store("c", unit(0, 0, 1), "key", "C")
+
+    assert cache.stats()["size"] == 2
+    assert cache.lookup(unit(0, 1, 0), "key") is None
+    assert cache.lookup(unit(1, 0, 0), "key") == "A"
+    assert cache.lookup(unit(0, 0, 1), "key") == "C"
+
+
+def test_cache_is_dropped_when_the_store_is_rebuilt(tmp_path):
+    save_manifest({"pages": {}}, str(tmp_path))
+    cache = SemanticCache(path=str(tmp_path / "cache.sqlite3"), persist_directory=str(tmp_path))
+    cache.store("question", unit(1, 0), "key", "réponse")
+    assert cache.lookup(unit(1, 0), "key") == "réponse"
+
+    manifest = manifest_path(str(tmp_path))
+    stat = os.stat(manifest)
+    os.utime(manifest, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    assert cache.lookup(unit(1, 0), "key") is None
+    assert cache.stats()["size"] == 0
+
+
+def test_outputs_of_the_chain(chain):
+    rag_chain, _, _ = chain
+
+    result = rag_chain.invoke("Qui est Bulbizarre ?")
+    assert set(result) == {"context", "question", "answer"}
+    chunks = list(rag_chain.stream("Qui est Bulbizarre ?"))
+    assert {key for chunk in chunks for key in chunk} == {"context", "question", "answer"}
@@ -0,0 +1,27 @@
+import asyncio
+
+from langchain_core.language_models import FakeListLLM
+
+from RAG.retriever import PokemonRetriever
+from RAG.semantic_cache import SemanticCache
+from RAG.server import create_server
+
+from .test_create_vectorstore import CountingEmbeddings
+
+
+def test_semantic_cache_embeddings_are_batched(store, tmp_path):
+    embeddings = CountingEmbeddings(size=16)
+    retriever = PokemonRetriever(persist_directory=store, embedding_function=embeddings)
+    cache = SemanticCache(path=str(tmp_path / "semantic_cache.sqlite3"), persist_directory=store)
+    server = create_server(FakeListLLM(responses=["Réponse."]), retriever=retriever, semantic_cache=cache)
+    questions = [f"Question {i} : quels Pokémon vivent dans les grottes ?" for i in range(20)]
+
+    async def ask_all():
+        return await asyncio.gather(*(server.rag_chain.ainvoke(question) for question in questions))
+
+    results = asyncio.run(ask_all())
+
+    assert [result["answer"] for result in results] == ["Réponse."] * len(questions)
+    assert cache.stats()["misses"] == len(questions)
+    assert server.batcher.queries == len(questions)
+    assert embeddings.calls == server.batcher.batches < len(questions)